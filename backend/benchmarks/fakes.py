@@ -0,0 +1,448 @@
+"""In-process stand-ins for the AWS services and ChromaDB used by the backend.
+
+`install_fakes()` routes every `boto3` client/resource and Chroma client
+created by the webserver or the entity miner to the objects in `FakeServices`,
+so both can be exercised end to end without network access.
+"""
+
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import boto3
+import chromadb
+from botocore.exceptions import ClientError
+from chromadb.api.types import EmbeddingFunction
+
+# Rough chars-per-token ratio used to turn prompt/response sizes into token counts
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+class _Body:
+    """Mimics botocore's StreamingBody for the parts the backend uses."""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt: int | None = None) -> bytes:
+        return self._stream.read(amt)
+
+
+def _exceptions(*names: str) -> type:
+    return type("Exceptions", (), {name: type(name, (Exception,), {}) for name in names})
+
+
+# --- S3 ---
+
+
+class FakeS3Client:
+    exceptions = _exceptions("NoSuchKey")
+
+    def __init__(self):
+        self.objects: dict[tuple[str, str], dict] = {}
+        self.lock = threading.Lock()
+        self.bytes_out = 0
+
+    def put_object(self, Bucket: str, Key: str, Body, **kwargs) -> dict:
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        with self.lock:
+            self.objects[(Bucket, Key)] = {
+                "data": data,
+                "Metadata": dict(kwargs.get("Metadata") or {}),
+                "ContentType": kwargs.get("ContentType"),
+                "ContentEncoding": kwargs.get("ContentEncoding"),
+            }
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def _get(self, Bucket: str, Key: str) -> dict:
+        with self.lock:
+            obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise self.exceptions.NoSuchKey(f"{Bucket}/{Key}")
+        return obj
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        obj = self._get(Bucket, Key)
+        return {
+            "ContentLength": len(obj["data"]),
+            "ETag": f'"{hashlib.md5(obj["data"]).hexdigest()}"',
+            "Metadata": dict(obj["Metadata"]),
+            "ContentType": obj["ContentType"],
+            "ContentEncoding": obj["ContentEncoding"],
+        }
+
+    def get_object(self, Bucket: str, Key: str, Range: str | None = None, **kwargs) -> dict:
+        obj = self._get(Bucket, Key)
+        data = obj["data"]
+        if Range:
+            start, _, end = Range.removeprefix("bytes=").partition("-")
+            data = data[int(start) : int(end) + 1 if end else None]
+        with self.lock:
+            self.bytes_out += len(data)
+        response = self.head_object(Bucket, Key)
+        response["ContentLength"] = len(data)
+        response["Body"] = _Body(data)
+        return response
+
+
+# --- DynamoDB ---
+
+
+class FakeTable:
+    def __init__(self, name: str):
+        self.name = name
+        self.items: dict[tuple, dict] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(key: dict) -> tuple:
+        return (key.get("novel_name"), key.get("template_type"))
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        with self.lock:
+            self.items[self._key(Item)] = dict(Item)
+        return {}
+
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        with self.lock:
+            item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item else {}
+
+
+class FakeDynamoDBResource:
+    def __init__(self):
+        self.tables: dict[str, FakeTable] = {}
+        self.lock = threading.Lock()
+
+    def Table(self, name: str) -> FakeTable:
+        with self.lock:
+            return self.tables.setdefault(name, FakeTable(name))
+
+
+# --- Lambda ---
+
+
+class FakeLambdaClient:
+    exceptions = _exceptions("ResourceNotFoundException")
+
+    def __init__(self):
+        self.invocations: list[dict] = []
+
+    def invoke(self, FunctionName: str, Payload: str = "{}", **kwargs) -> dict:
+        self.invocations.append({"FunctionName": FunctionName, "Payload": json.loads(Payload)})
+        return {
+            "StatusCode": 202,
+            "ResponseMetadata": {"RequestId": f"fake-{len(self.invocations)}"},
+        }
+
+
+# --- Bedrock ---
+
+
+class CannedResponder:
+    """Produces model outputs shaped like the `pydantic_models` schemas.
+
+    The entity miner's stage is recognised from its system prompt; any other
+    prompt (the webserver's forecaster and completion chains) gets prose.
+    """
+
+    def __init__(self, stage_outputs: dict[str, dict], prose_tokens: int = 300):
+        self.stage_outputs = stage_outputs
+        self.system_prompt_stages: dict[str, str] = {}
+        self.prose_tokens = prose_tokens
+
+    def register_stage(self, system_prompt: str, stage: str) -> None:
+        self.system_prompt_stages[system_prompt] = stage
+
+    @staticmethod
+    def _entity_name(user_prompt: str) -> str:
+        match = re.search(r'"([^"{}\n]+)"', user_prompt)
+        return match.group(1) if match else "Unknown"
+
+    def _prose(self, user_prompt: str) -> str:
+        words = re.findall(r"[A-Za-z']+", user_prompt) or ["story"]
+        rng = random.Random(len(user_prompt))
+        n_words = self.prose_tokens * CHARS_PER_TOKEN // 6
+        return " ".join(rng.choice(words) for _ in range(n_words)) + "."
+
+    def __call__(self, system_prompt: str, user_prompt: str) -> str:
+        stage = self.system_prompt_stages.get(system_prompt)
+        if stage is None or stage not in self.stage_outputs:
+            return self._prose(user_prompt)
+
+        output = json.loads(json.dumps(self.stage_outputs[stage]))
+        if stage.endswith("_profiler"):
+            name_key = "name" if stage == "person_profiler" else "primary_name"
+            output[name_key] = self._entity_name(user_prompt)
+        return f"```json\n{json.dumps(output, indent=2)}\n```"
+
+
+class BedrockStub:
+    """Stand-in for the `bedrock-runtime` client.
+
+    Supports `invoke_model` (OpenAI-style chat body, used by the entity miner)
+    and `converse` (used by langchain's ChatBedrockConverse in the webserver).
+    Each call sleeps for `latency_ms` (or the model's entry in `model_latency_ms`)
+    +/- `jitter_ms` and is rejected with a
+    ThrottlingException with probability `throttle_rate`. Content blocks marked
+    with `cache_control` are treated as a cacheable prefix: repeated prefixes
+    are reported as cache reads, first sightings as cache writes.
+    """
+
+    def __init__(
+        self,
+        responder,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        throttle_rate: float = 0,
+        seed: int = 0,
+        model_latency_ms: dict[str, float] | None = None,
+    ):
+        self.responder = responder
+        self.latency_ms = latency_ms
+        self.model_latency_ms = model_latency_ms or {}
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {
+            "calls": 0,
+            "throttled": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_tokens": 0,
+        }
+        self.cached_prefixes: set[str] = set()
+
+    def _simulate_call(self, operation: str, model_id: str) -> float:
+        latency_ms = self.model_latency_ms.get(model_id, self.latency_ms)
+        with self.lock:
+            self.stats["calls"] += 1
+            throttled = self.rng.random() < self.throttle_rate
+            delay = max(0.0, latency_ms + self.rng.uniform(-1, 1) * self.jitter_ms)
+        if throttled:
+            with self.lock:
+                self.stats["throttled"] += 1
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, operation
+            )
+        time.sleep(delay / 1000)
+        return delay
+
+    def _record_tokens(self, prompt: str, output: str) -> tuple[int, int]:
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(output)
+        with self.lock:
+            self.stats["input_tokens"] += input_tokens
+            self.stats["output_tokens"] += output_tokens
+        return input_tokens, output_tokens
+
+    @staticmethod
+    def _message_text(content) -> str:
+        if isinstance(content, str):
+            return content
+        return "".join(block.get("text", "") for block in content)
+
+    def _cache_usage(self, messages: list) -> tuple[int, int]:
+        """Returns (cache_read, cache_write) tokens for the prefix up to the last cache marker."""
+        prefix, marked = "", ""
+        for message in messages:
+            content = message["content"]
+            blocks = [{"text": content}] if isinstance(content, str) else content
+            for block in blocks:
+                prefix += block.get("text", "")
+                if "cache_control" in block:
+                    marked = prefix
+        if not marked:
+            return 0, 0
+        tokens = estimate_tokens(marked)
+        with self.lock:
+            if marked in self.cached_prefixes:
+                self.stats["cache_read_tokens"] += tokens
+                return tokens, 0
+            self.cached_prefixes.add(marked)
+        return 0, tokens
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> dict:
+        latency = self._simulate_call("InvokeModel", modelId)
+        request = json.loads(body)
+        messages = request.get("messages", [])
+        system_prompt = "".join(
+            self._message_text(m["content"]) for m in messages if m["role"] == "system"
+        )
+        user_prompt = "".join(
+            self._message_text(m["content"]) for m in messages if m["role"] != "system"
+        )
+
+        content = self.responder(system_prompt, user_prompt)
+        input_tokens, output_tokens = self._record_tokens(system_prompt + user_prompt, content)
+        cache_read_tokens, cache_write_tokens = self._cache_usage(messages)
+        response_body = {
+            "id": f"stub-{self.stats['calls']}",
+            "model": modelId,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": input_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+                "prompt_tokens_details": {"cached_tokens": cache_read_tokens},
+                "cache_creation_input_tokens": cache_write_tokens,
+            },
+        }
+        return {
+            "body": _Body(json.dumps(response_body).encode("utf-8")),
+            "contentType": "application/json",
+            "ResponseMetadata": {
+                "HTTPStatusCode": 200,
+                "HTTPHeaders": {
+                    "x-amzn-bedrock-input-token-count": str(input_tokens),
+                    "x-amzn-bedrock-output-token-count": str(output_tokens),
+                    "x-amzn-bedrock-invocation-latency": str(int(latency)),
+                },
+            },
+        }
+
+    def converse(self, modelId: str, messages: list, system: list | None = None, **kwargs) -> dict:
+        latency = self._simulate_call("Converse", modelId)
+        system_prompt = "".join(block.get("text", "") for block in system or [])
+        user_prompt = "".join(
+            block.get("text", "") for message in messages for block in message.get("content", [])
+        )
+
+        content = self.responder(system_prompt, user_prompt)
+        input_tokens, output_tokens = self._record_tokens(system_prompt + user_prompt, content)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": content}]}},
+            "stopReason": "end_turn",
+            "usage": {
+                "inputTokens": input_tokens,
+                "outputTokens": output_tokens,
+                "totalTokens": input_tokens + output_tokens,
+            },
+            "metrics": {"latencyMs": int(latency)},
+            "ResponseMetadata": {"HTTPStatusCode": 200, "HTTPHeaders": {}},
+        }
+
+
+class FakeBedrockControlClient:
+    """The `bedrock` control-plane client langchain creates next to bedrock-runtime."""
+
+    def get_inference_profile(self, inferenceProfileIdentifier: str, **kwargs) -> dict:
+        return {"models": [{"modelArn": inferenceProfileIdentifier}]}
+
+
+# --- Chroma ---
+
+
+class HashingEmbeddingFunction(EmbeddingFunction):
+    """Deterministic bag-of-words embeddings; avoids downloading an embedding model."""
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    @staticmethod
+    def name() -> str:
+        return "novelwriter-benchmark-hashing"
+
+    def get_config(self) -> dict:
+        return {"dimensions": self.dimensions}
+
+    @staticmethod
+    def build_from_config(config: dict) -> "HashingEmbeddingFunction":
+        return HashingEmbeddingFunction(**config)
+
+    def __call__(self, input):
+        embeddings = []
+        for text in input:
+            vector = [0.0] * self.dimensions
+            for token in re.findall(r"\w+", text.lower()):
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+                vector[int.from_bytes(digest, "little") % self.dimensions] += 1.0
+            norm = sum(v * v for v in vector) ** 0.5 or 1.0
+            embeddings.append([v / norm for v in vector])
+        return embeddings
+
+
+class InProcessChromaClient:
+    """Wraps an in-process Chroma client, pinning the embedding function."""
+
+    def __init__(self, client=None, embedding_function=None):
+        self.client = client or chromadb.EphemeralClient(
+            settings=chromadb.Settings(anonymized_telemetry=False)
+        )
+        self.embedding_function = embedding_function or HashingEmbeddingFunction()
+
+    def get_or_create_collection(self, name: str, **kwargs):
+        kwargs.setdefault("embedding_function", self.embedding_function)
+        return self.client.get_or_create_collection(name=name, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.client, attr)
+
+
+# --- Wiring ---
+
+
+class FakeServices:
+    def __init__(self, bedrock: BedrockStub, chroma: InProcessChromaClient | None = None):
+        self.s3 = FakeS3Client()
+        self.dynamodb = FakeDynamoDBResource()
+        self.lambda_client = FakeLambdaClient()
+        self.bedrock = bedrock
+        self.chroma = chroma or InProcessChromaClient()
+
+    def client(self, service_name: str):
+        clients = {
+            "s3": self.s3,
+            "lambda": self.lambda_client,
+            "bedrock-runtime": self.bedrock,
+            "bedrock": FakeBedrockControlClient(),
+        }
+        if service_name not in clients:
+            raise ValueError(f"No fake available for AWS service '{service_name}'")
+        return clients[service_name]
+
+    def resource(self, service_name: str):
+        if service_name != "dynamodb":
+            raise ValueError(f"No fake available for AWS resource '{service_name}'")
+        return self.dynamodb
+
+
+@contextmanager
+def install_fakes(services: FakeServices):
+    """Routes boto3 sessions and `chromadb.HttpClient`/`PersistentClient` to `services`
+    while active."""
+    original_client = boto3.session.Session.client
+    original_resource = boto3.session.Session.resource
+    original_http_client = chromadb.HttpClient
+    original_persistent_client = chromadb.PersistentClient
+
+    boto3.session.Session.client = lambda _self, service_name, *a, **kw: services.client(
+        service_name
+    )
+    boto3.session.Session.resource = lambda _self, service_name, *a, **kw: services.resource(
+        service_name
+    )
+    chromadb.HttpClient = lambda *a, **kw: services.chroma
+    chromadb.PersistentClient = lambda *a, **kw: services.chroma
+    try:
+        yield services
+    finally:
+        boto3.session.Session.client = original_client
+        boto3.session.Session.resource = original_resource
+        chromadb.HttpClient = original_http_client
+        chromadb.PersistentClient = original_persistent_client
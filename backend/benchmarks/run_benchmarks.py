@@ -0,0 +1,661 @@
+"""End-to-end performance benchmarks for the webserver and the entity miner.
+
+Runs the FastAPI app and `entity_miner.lambda_handler` against the in-process
+fakes in `fakes.py` and prints a JSON report with latency percentiles,
+throughput and Bedrock call/token counts for every scenario. The `chroma`
+target compares query and add latency of the embedded and HTTP Chroma modes,
+and the `telemetry` target measures what the miner's tracing adds per run.
+
+    python run_benchmarks.py --target webserver --requests 50 --concurrency 8 \\
+        --bedrock-latency-ms 400 --throttle-rate 0.02 --output report.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import chromadb
+from fakes import (
+    BedrockStub,
+    CannedResponder,
+    FakeServices,
+    InProcessChromaClient,
+    install_fakes,
+)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+WEBSERVER_DIR = BACKEND_DIR / "webserver"
+LAMBDA_DIR = BACKEND_DIR / "lambda"
+
+# entity_mining_prompt_templates.json key -> DynamoDB template_type read by the miner
+MINER_TEMPLATE_TYPES = {
+    "genre_determination": "entity_miner_genre_determination",
+    "entity_extraction": "entity_miner_entity_extraction_and_classification",
+    "person_profiler": "entity_miner_person_profiler",
+    "location_profiler": "entity_miner_location_profiler",
+    "event_profiler": "entity_miner_event_profiler",
+    "object_profiler": "entity_miner_object_profiler",
+    "organization_profiler": "entity_miner_organization_profiler",
+    "relationship_extractor": "entity_miner_relationship_extraction",
+}
+
+WEBSERVER_TEMPLATES = {
+    "forecaster": (
+        "You are a story forecaster. Using the known entities below, predict what happens next.\n"
+        "Known entities:\n{vector_search_results}\n\nCurrent fragment:\n{current_story_fragment}"
+    ),
+    "novel_completion": (
+        "Continue the story in the same voice, following the forecast.\n"
+        "Forecast:\n{forecaster_response}\n\nStory so far:\n{current_story_fragment}"
+    ),
+}
+
+STORY_PARAGRAPH = (
+    "Balasar raised Javok above the shield wall as the orc warchief bellowed across the "
+    "Shesten highlands. Shedinn knelt in the mud beside him, whispering a prayer to the Great "
+    "Mother Tamara, and the runes on his brother's scales began to glow a warm yellow. Far to "
+    "the south the Aass-Nag jungle steamed beneath its canopy, where Ssarki had fallen to the "
+    "Yuan-Ti long ago, and the Daedendrainn clan still sang his name at every fire."
+)
+
+# per-route totals the lambda scenario sums from each run's `usage` summary
+ROUTE_USAGE_FIELDS = ("calls", "input_tokens", "output_tokens", "latency_ms")
+
+NOVEL_NAME = "benchmark novel"
+BUCKET = "benchmark-bucket"
+STORY_KEY = "benchmark/story.txt"
+
+
+def _generate_story_key(i: int) -> str:
+    return f"benchmark/generate-{i}.txt"
+
+
+def synthetic_story(paragraphs: int) -> str:
+    chapters = []
+    for chapter in range(max(1, paragraphs // 20) + 1):
+        body = "\n\n".join(STORY_PARAGRAPH for _ in range(min(20, paragraphs - chapter * 20)))
+        if body:
+            chapters.append(f"Chapter {chapter + 1}\n\n{body}")
+    return "\n\n".join(chapters)
+
+
+def percentile(sorted_values: list[float], q: float) -> float | None:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def latency_percentiles(latencies_s: list[float]) -> dict:
+    latencies_ms = sorted(latency * 1000 for latency in latencies_s)
+    return {
+        "mean": round(sum(latencies_ms) / len(latencies_ms), 2) if latencies_ms else None,
+        "p50": percentile(latencies_ms, 50),
+        "p95": percentile(latencies_ms, 95),
+        "p99": percentile(latencies_ms, 99),
+        "max": latencies_ms[-1] if latencies_ms else None,
+    }
+
+
+def summarize(
+    target: str,
+    scenario: str,
+    args: argparse.Namespace,
+    latencies_s: list[float],
+    errors: int,
+    wall_time_s: float,
+    bedrock_before: dict,
+    bedrock_after: dict,
+) -> dict:
+    bedrock = {key: bedrock_after[key] - bedrock_before.get(key, 0) for key in bedrock_after}
+    return {
+        "target": target,
+        "scenario": scenario,
+        "requests": len(latencies_s),
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "wall_time_s": round(wall_time_s, 3),
+        "throughput_rps": round(len(latencies_s) / wall_time_s, 3) if wall_time_s else None,
+        "latency_ms": latency_percentiles(latencies_s),
+        "bedrock": bedrock,
+        "bedrock_stub": {
+            "latency_ms": args.bedrock_latency_ms,
+            "jitter_ms": args.bedrock_jitter_ms,
+            "throttle_rate": args.throttle_rate,
+            "model_latency_ms": dict(args.model_latency_ms),
+        },
+    }
+
+
+def build_services(args: argparse.Namespace) -> tuple[FakeServices, CannedResponder]:
+    with open(LAMBDA_DIR / "entity_mining_prompt_templates.json") as f:
+        miner_templates = json.load(f)
+
+    stage_outputs = {
+        stage: template["example_output"]
+        for stage, template in miner_templates.items()
+        if template.get("example_output")
+    }
+    extracted = stage_outputs.get("entity_extraction", {}).get("entities", [])
+    entity_names = [e["name"] for e in extracted]
+    stage_outputs["minor_profiles"] = {
+        "entities": [
+            {"name": e["name"], "category": e["category"], "summary": "Mentioned in passing."}
+            for e in extracted
+            if e.get("significance") == "Minor"
+        ]
+    }
+    stage_outputs["relationship_extractor"] = {
+        "relationships": [
+            {"source": a, "target": b, "relation_type": "Ally", "dynamics": "Fight side by side."}
+            for a, b in itertools.pairwise(entity_names)
+        ]
+    }
+
+    responder = CannedResponder(stage_outputs, prose_tokens=args.completion_tokens)
+    bedrock = BedrockStub(
+        responder,
+        latency_ms=args.bedrock_latency_ms,
+        jitter_ms=args.bedrock_jitter_ms,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+        model_latency_ms=dict(args.model_latency_ms),
+    )
+    services = FakeServices(bedrock, chroma=InProcessChromaClient())
+
+    for stage, template in miner_templates.items():
+        responder.register_stage(template["system_prompt"], stage)
+    return services, responder
+
+
+def seed_miner_templates(services: FakeServices, table_name: str) -> None:
+    with open(LAMBDA_DIR / "entity_mining_prompt_templates.json") as f:
+        miner_templates = json.load(f)
+
+    table = services.dynamodb.Table(table_name)
+    for stage, template_type in MINER_TEMPLATE_TYPES.items():
+        template = miner_templates[stage]
+        table.put_item(
+            Item={
+                "novel_name": "global",
+                "template_type": template_type,
+                "system_prompt_template": template["system_prompt"],
+                "instruction_prompt_template": template["user_prompt"],
+            }
+        )
+
+
+def _enter_service_dir(service_dir: Path) -> None:
+    # Both services read ./config.json, so benchmark each from its own directory
+    os.chdir(service_dir)
+    sys.path.insert(0, str(service_dir))
+
+
+# --- Webserver ---
+
+
+async def _drive_app(app, requests: list[tuple[str, str, dict]], concurrency: int):
+    """Sends `requests` with at most `concurrency` in flight, each worker from its own client
+    address (so admission's per-client limit does not reject them); returns (latency, response)
+    pairs and the wall time."""
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None
+    ) as client:
+
+        async def send(i: int, method: str, path: str, params: dict):
+            headers = {"X-Forwarded-For": f"10.0.0.{i % concurrency + 1}"}
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.request(method, path, params=params, headers=headers)
+                results.append((time.perf_counter() - start, response))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(i, *request) for i, request in enumerate(requests)))
+        wall_time = time.perf_counter() - start
+
+    return results, wall_time
+
+
+async def _bench_webserver(args: argparse.Namespace, services: FakeServices) -> list[dict]:
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        logging.getLogger().setLevel(args.log_level)
+        config = main.state.config
+
+        table = services.dynamodb.Table(config["aws"]["dynamodb_table"])
+        for template_type, prompt_template in WEBSERVER_TEMPLATES.items():
+            table.put_item(
+                Item={
+                    "novel_name": NOVEL_NAME,
+                    "template_type": template_type,
+                    "prompt_template": prompt_template,
+                    "date": "2025-01-01",
+                    "version": "1",
+                }
+            )
+
+        # written like an upload: compressed, with the chapter index for ranged reads
+        story = synthetic_story(args.story_paragraphs)
+        main.state.story_store.write(BUCKET, STORY_KEY, story, metadata={})
+        # every generate request gets its own story text, so that identical requests are
+        # not coalesced into one generation
+        for i in range(args.requests):
+            ending = f"The chronicle of day {i + 1} ends here."
+            main.state.story_store.write(BUCKET, _generate_story_key(i), f"{story}\n\n{ending}", {})
+
+        with open(WEBSERVER_DIR / "entities.json") as f:
+            entities = json.load(f)
+        # stored like `/api/entity` entries: a short embedded text, the full profile in metadata
+        main.state.chroma_collection.upsert(
+            documents=[f"{e['entity']}: {e['description']}" for e in entities],
+            metadatas=[
+                {
+                    "source": "benchmark",
+                    "entity": e["entity"],
+                    "profile_json": json.dumps(
+                        {
+                            "name": e["entity"],
+                            "description": e["description"],
+                            "key_relations": e["key_relations"],
+                            "history": e["history"],
+                        }
+                    ),
+                }
+                for e in entities
+            ],
+            ids=[f"benchmark-{i}" for i in range(len(entities))],
+        )
+
+        scenarios = {
+            "generate": lambda i: (
+                "GET",
+                "/api/generate",
+                {
+                    "bucket": BUCKET,
+                    "story_key": _generate_story_key(i),
+                    "novel_name": NOVEL_NAME,
+                    "username": f"benchmark-{i % args.concurrency}",
+                },
+            ),
+            "similar_entities": lambda i: (
+                "GET",
+                "/api/similar_entities",
+                {"query_text": STORY_PARAGRAPH, "n_results": 3},
+            ),
+            "get_story": lambda i: (
+                "GET",
+                "/api/story",
+                {"bucket": BUCKET, "object_key": STORY_KEY},
+            ),
+            "story_page": lambda i: (
+                "GET",
+                "/api/story/page",
+                {"bucket": BUCKET, "object_key": STORY_KEY, "chapter": 0},
+            ),
+        }
+
+        reports = []
+        for scenario in args.scenarios or scenarios:
+            if scenario not in scenarios:
+                continue
+            before = dict(services.bedrock.stats)
+            s3_bytes_before = services.s3.bytes_out
+            results, wall_time = await _drive_app(
+                main.app, [scenarios[scenario](i) for i in range(args.requests)], args.concurrency
+            )
+
+            # failed requests are counted, but left out of the latency percentiles; coalesced
+            # generations are reported apart, since they measure the reuse, not the pipeline
+            ok = [(latency, r) for latency, r in results if r.status_code < 400]
+            coalesced = []
+            if scenario == "generate":
+                coalesced = [latency for latency, r in ok if r.json()["coalesced"]]
+                ok = [(latency, r) for latency, r in ok if not r.json()["coalesced"]]
+            report = summarize(
+                "webserver",
+                scenario,
+                args,
+                [latency for latency, _ in ok],
+                len(results) - len(ok) - len(coalesced),
+                wall_time,
+                before,
+                dict(services.bedrock.stats),
+            )
+            report["requests"] = len(results)
+            report["s3_bytes_read"] = services.s3.bytes_out - s3_bytes_before
+            if scenario == "generate":
+                report["coalesced"] = {
+                    "requests": len(coalesced),
+                    "latency_ms": latency_percentiles(coalesced),
+                }
+            reports.append(report)
+        return reports
+
+
+def bench_webserver(args: argparse.Namespace) -> list[dict]:
+    _enter_service_dir(WEBSERVER_DIR)
+    services, _ = build_services(args)
+    with install_fakes(services):
+        return asyncio.run(_bench_webserver(args, services))
+
+
+# --- Entity miner Lambda ---
+
+
+def bench_lambda(args: argparse.Namespace) -> list[dict]:
+    _enter_service_dir(LAMBDA_DIR)
+    if not args.with_telemetry:
+        os.environ["OTEL_SDK_DISABLED"] = "true"
+
+    services, responder = build_services(args)
+    with install_fakes(services):
+        import entity_miner
+
+        # the batched Minor entity call uses a built-in prompt rather than a DynamoDB template
+        responder.register_stage(entity_miner.MINOR_ENTITIES_SYSTEM_PROMPT, "minor_profiles")
+
+        logging.getLogger().setLevel(args.log_level)
+        config = entity_miner.load_config()
+        seed_miner_templates(services, config["aws"]["dynamodb_table"])
+        story = synthetic_story(args.story_paragraphs)
+
+        route_usage = {}
+
+        def invoke(i: int) -> tuple[float, bool]:
+            event = {"text": story, "novel_name": f"benchmark-{i}", "username": "benchmark"}
+            start = time.perf_counter()
+            result = entity_miner.lambda_handler(event, None)
+            for route, usage in result.get("usage", {}).get("routes", {}).items():
+                totals = route_usage.setdefault(route, dict.fromkeys(ROUTE_USAGE_FIELDS, 0))
+                for field in ROUTE_USAGE_FIELDS:
+                    totals[field] += usage[field]
+            return time.perf_counter() - start, result.get("status") == "success"
+
+        reports = []
+        if not args.scenarios or "mine" in args.scenarios:
+            before = dict(services.bedrock.stats)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                results = list(executor.map(invoke, range(args.requests)))
+            wall_time = time.perf_counter() - start
+
+            report = summarize(
+                "lambda",
+                "mine",
+                args,
+                [latency for latency, ok in results if ok],
+                sum(1 for _, ok in results if not ok),
+                wall_time,
+                before,
+                dict(services.bedrock.stats),
+            )
+            report["requests"] = len(results)
+            report["model_routes"] = route_usage
+            if args.with_telemetry and entity_miner.span_processor:
+                report["telemetry"] = _telemetry_per_run(
+                    entity_miner.span_processor.snapshot(), args.requests
+                )
+            reports.append(report)
+        return reports
+
+
+def _telemetry_per_run(stats: dict, runs: int) -> dict:
+    return {
+        "spans_per_run": round(stats["spans"] / runs, 1),
+        "span_processing_ms_per_run": round(stats["processing_seconds"] * 1000 / runs, 3),
+        "spans_dropped": stats.get("dropped", 0) + stats.get("buffer_dropped", 0),
+        "traces_sampled_out": stats.get("traces_sampled_out", 0),
+    }
+
+
+def bench_telemetry(args: argparse.Namespace) -> list[dict]:
+    """The `mine` scenario with the miner's OTel SDK disabled and enabled, in separate
+    processes, and the latency the instrumentation adds per run.
+
+    The OTLP endpoint, sampling and flush settings come from the environment, so pointing
+    OTEL_EXPORTER_OTLP_ENDPOINT at nothing measures an unreachable collector.
+    """
+    child_argv = [
+        "--target", "lambda", "--scenario", "mine",
+        "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+        "--story-paragraphs", str(args.story_paragraphs),
+        "--bedrock-latency-ms", str(args.bedrock_latency_ms),
+        "--bedrock-jitter-ms", str(args.bedrock_jitter_ms),
+        "--throttle-rate", str(args.throttle_rate),
+        "--seed", str(args.seed), "--log-level", args.log_level,
+    ]  # fmt: skip
+    for model_id, latency_ms in args.model_latency_ms:
+        child_argv += ["--model-latency-ms", f"{model_id}={latency_ms}"]
+
+    runs = {}
+    for variant, extra in (("disabled", []), ("enabled", ["--with-telemetry"])):
+        result = subprocess.run(
+            [sys.executable, __file__, *child_argv, *extra],
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        runs[variant] = json.loads(result.stdout)[0]
+
+    overhead = {
+        key: round(runs["enabled"]["latency_ms"][key] - runs["disabled"]["latency_ms"][key], 2)
+        for key in ("mean", "p50", "p95")
+    }
+    return [
+        {
+            "target": "telemetry",
+            "scenario": "mine",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latency_ms": {variant: run["latency_ms"] for variant, run in runs.items()},
+            "overhead_ms": overhead,
+            "telemetry": runs["enabled"].get("telemetry"),
+        }
+    ]
+
+
+# --- Chroma client modes ---
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def _start_chroma_server(data_dir: str) -> tuple[subprocess.Popen, int]:
+    """Runs `chroma run` on a free port and waits until it answers."""
+    port = _free_port()
+    server = subprocess.Popen(
+        [shutil.which("chroma"), "run", "--path", data_dir, "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            chromadb.HttpClient(host="localhost", port=port).heartbeat()
+            return server, port
+        except Exception:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.terminate()
+                raise RuntimeError("Chroma server did not start") from None
+            time.sleep(0.5)
+
+
+def _bench_chroma_mode(args: argparse.Namespace, mode: str, client) -> list[dict]:
+    with open(WEBSERVER_DIR / "entities.json") as f:
+        entities = json.load(f)
+    documents = [f"{e['entity']}: {e['description']}" for e in entities]
+    # pinned embeddings, so only the client/transport differs between modes
+    collection = InProcessChromaClient(client).get_or_create_collection(f"benchmark-{mode}")
+
+    def add(i: int) -> float:
+        batch = [
+            documents[(i * args.chroma_batch_size + j) % len(documents)]
+            for j in range(args.chroma_batch_size)
+        ]
+        start = time.perf_counter()
+        collection.upsert(
+            documents=batch,
+            metadatas=[{"source": "benchmark"} for _ in batch],
+            ids=[f"benchmark-{i}-{j}" for j in range(len(batch))],
+        )
+        return time.perf_counter() - start
+
+    def query(i: int) -> float:
+        start = time.perf_counter()
+        collection.query(query_texts=[STORY_PARAGRAPH], n_results=3)
+        return time.perf_counter() - start
+
+    reports = []
+    for scenario, call in (("add", add), ("query", query)):
+        if args.scenarios and scenario not in args.scenarios:
+            continue
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            latencies = list(executor.map(call, range(args.requests)))
+        wall_time = time.perf_counter() - start
+        report = summarize("chroma", scenario, args, latencies, 0, wall_time, {}, {})
+        reports.append(report | {"chroma_mode": mode, "batch_size": args.chroma_batch_size})
+    return reports
+
+
+def bench_chroma(args: argparse.Namespace) -> list[dict]:
+    """Same adds and queries through a persistent embedded client and over HTTP.
+
+    The HTTP mode uses the server at --chroma-host/--chroma-port, or starts `chroma run`
+    on a temporary directory; it is skipped if neither is available.
+    """
+    reports = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        embedded = chromadb.PersistentClient(
+            path=os.path.join(data_dir, "embedded"),
+            settings=chromadb.Settings(anonymized_telemetry=False),
+        )
+        reports.extend(_bench_chroma_mode(args, "embedded", embedded))
+
+        server = None
+        host, port = args.chroma_host, args.chroma_port
+        if host is None:
+            if not shutil.which("chroma"):
+                logging.warning("No Chroma server given and `chroma` not installed; skipping HTTP")
+                return reports
+            server, port = _start_chroma_server(os.path.join(data_dir, "server"))
+            host = "localhost"
+        try:
+            http = chromadb.HttpClient(
+                host=host, port=port, settings=chromadb.Settings(anonymized_telemetry=False)
+            )
+            reports.extend(_bench_chroma_mode(args, "http", http))
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+    return reports
+
+
+TARGETS = {
+    "webserver": bench_webserver,
+    "lambda": bench_lambda,
+    "chroma": bench_chroma,
+    "telemetry": bench_telemetry,
+}
+
+
+def _model_latency(value: str) -> tuple[str, float]:
+    model_id, _, latency_ms = value.rpartition("=")
+    if not model_id:
+        raise argparse.ArgumentTypeError(f"expected MODEL_ID=MS, got {value!r}")
+    return model_id, float(latency_ms)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=[*TARGETS, "all"], default="all")
+    parser.add_argument(
+        "--scenario",
+        dest="scenarios",
+        action="append",
+        help="Scenario to run (repeatable). Webserver: generate, similar_entities, get_story, "
+        "story_page. Lambda: mine. Chroma: add, query. Defaults to all scenarios of the target.",
+    )
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--story-paragraphs", type=int, default=40)
+    parser.add_argument("--bedrock-latency-ms", type=float, default=200)
+    parser.add_argument("--bedrock-jitter-ms", type=float, default=50)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--model-latency-ms",
+        type=_model_latency,
+        action="append",
+        default=[],
+        metavar="MODEL_ID=MS",
+        help="Stub latency for one model (repeatable), e.g. moonshot.kimi-k2-thinking=2000",
+    )
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--with-telemetry", action="store_true", help="Keep the miner's OTel SDK enabled"
+    )
+    parser.add_argument(
+        "--chroma-host", help="Chroma server for the chroma target's HTTP mode (default: start one)"
+    )
+    parser.add_argument("--chroma-port", type=int, default=8000)
+    parser.add_argument("--chroma-batch-size", type=int, default=10, help="Documents per add")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+
+    if args.target == "all":
+        # Each service reads ./config.json, so run every target in its own process
+        child_argv = list(argv)
+        if args.output:
+            child_argv = [a for a in child_argv if a not in ("--output", args.output)]
+            child_argv = [a for a in child_argv if not a.startswith("--output=")]
+
+        reports = []
+        for target in TARGETS:
+            result = subprocess.run(
+                [sys.executable, __file__, *child_argv, "--target", target],
+                stdout=subprocess.PIPE,
+                text=True,
+                check=True,
+            )
+            reports.extend(json.loads(result.stdout))
+    else:
+        reports = TARGETS[args.target](args)
+
+    report = json.dumps(reports, indent=2)
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import json
+import re
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+
+from pydantic_models import ExtractedAndClassifiedEntity, ExtractedRelationships
+
+ARTICLES = {"the", "a", "an"}
+
+# minimum trigram overlap (Jaccard) for an alias to be compared character by character
+TRIGRAM_CANDIDATE_THRESHOLD = 0.3
+
+# Words that may differ between two names of one entity ("Tamara" / "Great Mother Tamara")
+HONORIFICS = {
+    "aunt",
+    "baron",
+    "baroness",
+    "brother",
+    "captain",
+    "commander",
+    "count",
+    "countess",
+    "dame",
+    "doctor",
+    "dr",
+    "duchess",
+    "duke",
+    "elder",
+    "emperor",
+    "empress",
+    "father",
+    "general",
+    "grand",
+    "great",
+    "high",
+    "holy",
+    "king",
+    "lady",
+    "lord",
+    "madam",
+    "master",
+    "miss",
+    "mistress",
+    "mother",
+    "mr",
+    "mrs",
+    "ms",
+    "priest",
+    "priestess",
+    "prince",
+    "princess",
+    "professor",
+    "queen",
+    "saint",
+    "sir",
+    "sister",
+    "st",
+    "uncle",
+}
+
+# Words of descriptive names ("Son of Balasar", "Balasar's father"), which name another
+# entity by its relation to the one they mention. "s" is what remains of a possessive.
+RELATIONAL_WORDS = {"of", "s"}
+
+# lower is more significant; a merged entity keeps its most significant classification
+SIGNIFICANCE_RANK = {"Major": 0, "Supporting": 1, "Minor": 2}
+
+
+def normalize_name(name: str) -> str:
+    """Casefolded words of a name, without punctuation or leading articles."""
+    tokens = re.findall(r"[^\W_]+", name.casefold())
+    while len(tokens) > 1 and tokens[0] in ARTICLES:
+        tokens = tokens[1:]
+    return " ".join(tokens)
+
+
+def trigrams(normalized: str) -> set[str]:
+    padded = f"  {normalized} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _has_possessive(name: str) -> bool:
+    return re.search(r"\w['’]s\b|\ws['’](?!\w)", name) is not None
+
+
+def _differ_by_honorifics(tokens: set[str], other: set[str]) -> bool:
+    """Whether one set of name words is the other plus honorifics only."""
+    shorter, longer = sorted((tokens, other), key=len)
+    if not shorter <= longer:
+        return False
+    if shorter <= HONORIFICS or longer & RELATIONAL_WORDS:
+        return False
+    return longer - shorter <= HONORIFICS
+
+
+def _rank(significance: str) -> int:
+    return SIGNIFICANCE_RANK.get(significance, len(SIGNIFICANCE_RANK))
+
+
+@dataclass
+class CanonicalEntity:
+    id: int
+    name: str
+    category: str | None
+    # normalized alias -> "name" (names and secondary names) or "title" (titles and nicknames)
+    aliases: dict[str, str] = field(default_factory=dict)
+
+
+class AliasIndex:
+    """Names, secondary names and nicknames of a novel's entities, indexed for matching.
+
+    A name matches an entity by
+    1. exact normalized alias: any name or secondary name, or a title or nickname of an
+       entity of a compatible category (equal, or unknown on either side);
+    2. spelling similarity of at least `similarity_threshold` (difflib ratio, checked on
+       the aliases that share enough trigrams), within a compatible category;
+    3. word containment in either direction with a name or secondary name of an entity of
+       a compatible category, where the extra words are all honorifics, e.g. "Tamara" and
+       "Great Mother Tamara". The shorter name must have a word that is not an honorific
+       ("Mother" alone matches nothing), and descriptive names ("Son of Balasar",
+       "Balasar's father") never match this way. Titles and nicknames are left out here,
+       since they often mention other entities ("great servant of Tamara").
+    Fuzzy and containment matches that point to more than one entity are ignored.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.88):
+        self.similarity_threshold = similarity_threshold
+        self.entities: list[CanonicalEntity] = []
+        self.by_alias: dict[str, set[int]] = {}
+        self.by_trigram: dict[str, set[str]] = {}
+        self.by_token: dict[str, set[str]] = {}
+
+    def add(self, name: str, category: str | None = None, titles=(), names=()) -> CanonicalEntity:
+        entity = CanonicalEntity(id=len(self.entities), name=name, category=category)
+        self.entities.append(entity)
+        for alias in (name, *names):
+            self.add_alias(entity, alias)
+        for title in titles:
+            self.add_alias(entity, title, kind="title")
+        return entity
+
+    def add_alias(self, entity: CanonicalEntity, alias: str, kind: str = "name") -> None:
+        normalized = normalize_name(alias or "")
+        if not normalized or entity.aliases.get(normalized) == "name":
+            return
+        entity.aliases[normalized] = kind
+        self.by_alias.setdefault(normalized, set()).add(entity.id)
+        for gram in trigrams(normalized):
+            self.by_trigram.setdefault(gram, set()).add(normalized)
+        for token in normalized.split():
+            self.by_token.setdefault(token, set()).add(normalized)
+
+    def _compatible(self, alias: str, category: str | None, kinds=("name", "title")):
+        ids = set()
+        for i in self.by_alias.get(alias, ()):
+            entity = self.entities[i]
+            if entity.aliases[alias] not in kinds:
+                continue
+            if category is None or entity.category is None or entity.category == category:
+                ids.add(i)
+        return ids
+
+    def match(self, name: str, category: str | None = None) -> CanonicalEntity | None:
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+
+        # the same name is the same entity even if extraction classified it differently
+        exact = self._compatible(normalized, category) or self._compatible(
+            normalized, None, kinds=("name",)
+        )
+        if exact:
+            return self.entities[min(exact)]
+
+        grams = trigrams(normalized)
+        shared: dict[str, int] = {}
+        for gram in grams:
+            for alias in self.by_trigram.get(gram, ()):
+                shared[alias] = shared.get(alias, 0) + 1
+        similar = set()
+        for alias, count in shared.items():
+            overlap = count / (len(grams) + len(trigrams(alias)) - count)
+            if overlap < TRIGRAM_CANDIDATE_THRESHOLD:
+                continue
+            if SequenceMatcher(None, normalized, alias).ratio() >= self.similarity_threshold:
+                similar |= self._compatible(alias, category)
+        if len(similar) == 1:
+            return self.entities[similar.pop()]
+
+        tokens = set(normalized.split())
+        if tokens & RELATIONAL_WORDS or _has_possessive(name):
+            return None
+        candidates = set().union(*(self.by_token.get(token, set()) for token in tokens))
+        contained = set()
+        for alias in candidates:
+            alias_tokens = set(alias.split())
+            if _differ_by_honorifics(tokens, alias_tokens):
+                contained |= self._compatible(alias, category, kinds=("name",))
+        if len(contained) == 1:
+            return self.entities[contained.pop()]
+        return None
+
+    @classmethod
+    def from_profiles(
+        cls, documents: list[str], metadatas: list[dict], similarity_threshold: float = 0.88
+    ) -> "AliasIndex":
+        """Index of the profiles stored in a novel's Chroma collection by earlier runs."""
+        index = cls(similarity_threshold)
+        for document, metadata in zip(documents, metadatas, strict=True):
+            metadata = metadata or {}
+            # the full profile is in `profile_json`; older entries stored it as the document
+            try:
+                profile = json.loads(metadata.get("profile_json") or document)
+            except (TypeError, ValueError):
+                profile = {}
+            if not isinstance(profile, dict):
+                profile = {}
+            name = metadata.get("entity_name") or profile.get("name") or profile.get("primary_name")
+            if not name:
+                continue
+            stored_aliases = metadata.get("aliases")
+            index.add(
+                name,
+                category=metadata.get("category") or profile.get("category"),
+                titles=profile.get("titles_and_nicknames") or [],
+                names=[
+                    profile.get("secondary_name"),
+                    *(stored_aliases.split("; ") if stored_aliases else []),
+                ],
+            )
+        return index
+
+
+def canonicalize(
+    entities: list[ExtractedAndClassifiedEntity], index: AliasIndex
+) -> tuple[list[ExtractedAndClassifiedEntity], dict[str, list[str]]]:
+    """Collapses name variants onto one entity each, matching against `index` and each other.
+
+    Entities are taken in order of significance, longest name first, so a new entity is
+    named after its most significant and most complete mention. Returns the canonical
+    entities (with the highest significance of their variants) and, per canonical name,
+    the other names it was extracted under.
+    """
+    ordered = sorted(entities, key=lambda e: (_rank(e.significance), -len(e.name)))
+    canonical: dict[str, ExtractedAndClassifiedEntity] = {}
+    aliases: dict[str, list[str]] = {}
+    for entity in ordered:
+        match = index.match(entity.name, entity.category)
+        if match is None:
+            match = index.add(entity.name, entity.category)
+        else:
+            index.add_alias(match, entity.name)
+
+        existing = canonical.get(match.name)
+        if existing is None:
+            canonical[match.name] = entity.model_copy(
+                update={"name": match.name, "category": match.category or entity.category}
+            )
+        elif _rank(entity.significance) < _rank(existing.significance):
+            existing.significance = entity.significance
+        if entity.name != match.name and entity.name not in aliases.get(match.name, []):
+            aliases.setdefault(match.name, []).append(entity.name)
+    return list(canonical.values()), aliases
+
+
+def canonicalize_relationships(
+    relationships: list[ExtractedRelationships], index: AliasIndex
+) -> list[ExtractedRelationships]:
+    """Renames relationship endpoints to the canonical names in `index`.
+
+    Names the index does not know are kept as they are; relationships whose endpoints turn
+    out to be the same entity are dropped.
+    """
+    result = []
+    for relationship in relationships:
+        source, target = (
+            match.name if (match := index.match(name)) else name
+            for name in (relationship.source, relationship.target)
+        )
+        if normalize_name(source) == normalize_name(target):
+            continue
+        result.append(relationship.model_copy(update={"source": source, "target": target}))
+    return result
@@ -1,40 +1,76 @@
 import datetime
+import gzip
 import hashlib
 import json
 import logging
 import os
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tkinter import E
 
 import boto3
 import chromadb
-from opentelemetry import context, trace
+from opentelemetry import context, metrics, propagate, trace
+from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.instrumentation.aws_lambda import AwsLambdaInstrumentor
 from opentelemetry.instrumentation.botocore import BotocoreInstrumentor
 from opentelemetry.instrumentation.logging import LoggingInstrumentor
 from opentelemetry.instrumentation.threading import ThreadingInstrumentor
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
 from opentelemetry.trace import Status, StatusCode
 from pydantic import BaseModel
 
+from canonicalization import AliasIndex, canonicalize, canonicalize_relationships
+from miner_telemetry import (
+    BoundedFlushProvider,
+    create_span_processor,
+    flush_telemetry,
+    flush_timeout_millis,
+)
+from model_routing import ModelRouter
+from profile_documents import embedding_text, merge_stored_profile, profile_name
 from pydantic_models import (
     EntityExtractionAndClassification,
     EventProfile,
+    ExtractedAndClassifiedEntity,
+    ExtractedRelationships,
     GenreDetermination,
     LocationProfile,
+    MinorEntityProfile,
+    MinorEntityProfiles,
     ObjectProfile,
     OrganizationProfile,
     PersonProfile,
+    RelationshipExtractor,
+    SupportingEntityProfile,
+    SupportingPersonProfile,
+)
+from relationship_index import RelationshipIndexStore
+from structured_output import (
+    extract_json,
+    field_subset_schema,
+    fill_nullable_fields,
+    invalid_fields,
+    nullable_fields,
+    validate_items,
 )
+from token_usage import RunUsage, parse_usage
 
 # Configure logging
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO)
 
 tracer = None
+span_processor = None
+
+# The webserver and the miner keep their own objects in the story bucket as JSON (summaries,
+# story indexes, entity graphs); stories are text. Writing one must not start a mining run.
+SERVICE_OBJECT_SUFFIX = ".json"
 
 
 def load_config():
@@ -66,17 +102,27 @@ def setup_otel():
         }
     )
 
+    global span_processor
+    # head sampling is read from OTEL_TRACES_SAMPLER / OTEL_TRACES_SAMPLER_ARG
     provider = TracerProvider(resource=resource)
 
     exporter = OTLPSpanExporter(
         endpoint=os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"),
     )
 
-    provider.add_span_processor(BatchSpanProcessor(exporter))
+    # tail sampling and a bounded export queue, see miner_telemetry
+    span_processor = create_span_processor(exporter)
+    provider.add_span_processor(span_processor)
     # For local runs to see the traces in the console
     # provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
     trace.set_tracer_provider(provider)
 
+    meter_provider = MeterProvider(
+        resource=resource,
+        metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter())],
+    )
+    metrics.set_meter_provider(meter_provider)
+
     # Instrumentation Setup
     LoggingInstrumentor().instrument(set_logging_format=True)
     BotocoreInstrumentor().instrument()
@@ -84,7 +130,79 @@ def setup_otel():
 
     return trace.get_tracer("entity_miner")
 
+
+# Story text goes first in the user message so that the system prompt and the story form a
+# prefix shared by every call of a stage; the instruction refers back to it.
+SHARED_CONTEXT_TEMPLATE = "Text:\n{text}\n\n"
+SHARED_CONTEXT_REFERENCE = "(the text given at the start of this message)"
+
+FIELD_REPAIR_INSTRUCTION = """
+
+Your previous answer was missing or had invalid values for these fields: {fields}.
+Return ONLY a JSON object with exactly these keys, adhering to this schema:
+```json
+{schema}
+```"""
+
+# Appended to the profiler templates for Supporting entities, which get a reduced schema
+SUPPORTING_PROFILE_INSTRUCTION = """
+
+This is a Supporting entity, so a lighter profile is enough. Ignore the schema and example
+above and return ONLY a JSON object adhering to this schema, one or two sentences per field:
+```json
+{schema}
+```"""
+
+# Appended to the profiler templates when extraction found the entity under other names too
+ALIASES_INSTRUCTION = """
+
+The text also refers to {entity_name} as: {aliases}. Treat these as the same entity."""
+
+MINOR_ENTITIES_SYSTEM_PROMPT = (
+    "You are a story archivist. You write short factual notes about minor entities that are "
+    "mentioned in a story, based only on the provided text. Your output must be a valid JSON "
+    "object wrapped in markdown code blocks (```json ... ```)."
+)
+
+MINOR_ENTITIES_INSTRUCTION = """The following entities play only a minor role in {text}.
+Context/Genre: {genre}
+
+Entities:
+{entities}
+
+For each entity write a one-sentence summary of who or what it is and how it appears in the
+text, using only evidence from the text (null if there is none). Keep the names and categories
+exactly as given. Return ONLY a JSON object adhering to this schema:
+```json
+{schema}
+```"""
+
+# Appended to the relationship extractor template: the pass runs over the aggregated profiles
+RELATIONSHIP_PROFILES_INSTRUCTION = """
+
+Profiles of these entities, mined from the same text:
+{profiles}"""
+
+# list-shaped outputs: items are validated one by one and invalid ones dropped
+LIST_OUTPUT_SCHEMAS = {
+    EntityExtractionAndClassification: ("entities", ExtractedAndClassifiedEntity),
+    MinorEntityProfiles: ("entities", MinorEntityProfile),
+    RelationshipExtractor: ("relationships", ExtractedRelationships),
+}
+
 tracer = setup_otel()
+meter = metrics.get_meter("entity_miner")
+
+token_usage_histogram = meter.create_histogram(
+    "gen_ai.client.token.usage",
+    unit="{token}",
+    description="Tokens used per Bedrock call, by stage and token type",
+)
+operation_duration_histogram = meter.create_histogram(
+    "gen_ai.client.operation.duration",
+    unit="s",
+    description="Bedrock model latency per call, by stage",
+)
 
 class EntityMiningWorkflow:
     def __init__(
@@ -128,10 +246,42 @@ class EntityMiningWorkflow:
                 "dynamodb_table_global_prompt_templates_novel_name"
             )
 
+            self.run_usage = RunUsage(
+                pricing=self.config.get("aws").get("model_pricing_per_1k_tokens", {})
+            )
+
+            # model_id -> "tool" | "json_schema" for models that support constrained output
+            self.structured_output_modes = self.config.get("aws").get("structured_output_modes", {})
+            # models that accept explicit cache markers on the shared prompt prefix
+            self.prompt_cache_models = self.config.get("aws").get("prompt_cache_models", [])
+
+            # per-novel relationship index (JSON in the story bucket), read by the webserver
+            self.relationship_index_store = RelationshipIndexStore(
+                boto3.client("s3", region_name=self.config.get("aws").get("region")),
+                bucket=self.config.get("aws").get("bucket_name"),
+                prefix=self.config.get("aws").get("relationship_index_prefix", "entity_graphs/"),
+            )
+            # names of this run's and earlier runs' entities, set by canonicalize_entities
+            self.alias_index: AliasIndex | None = None
+
+            # "batch": one call summarizes all Minor entities; "extraction": no call at all
+            self.minor_profile_mode = self.config.get("aws").get("minor_profile_mode", "batch")
+
             self.model_temperature = model_temperature
             self.model_top_p = model_top_p
             self.model_seed = model_seed
 
+            # stage x category x significance -> model and sampling parameters
+            self.model_router = ModelRouter(
+                self.config.get("aws").get("model_routes", []),
+                default={
+                    "model_id": self.model_id,
+                    "temperature": model_temperature,
+                    "top_p": model_top_p,
+                    "seed": model_seed,
+                },
+            )
+
             self.fetch_workflow_prompt_templates()
 
             self.initialize_chroma(local=local_chroma, collection_name=chroma_collection_name)
@@ -144,17 +294,28 @@ class EntityMiningWorkflow:
             span.set_attribute("chroma.client.local", local)
 
             try:
-                config_key = "local" if local else "remote"
-                host = self.config.get("chroma").get(config_key).get("host")
-                port = self.config.get("chroma").get(config_key).get("port")
-                span.set_attribute("chroma.host", host)
-                span.set_attribute("chroma.port", port)
-
-                self.chroma_client = chromadb.HttpClient(
-                    host=host,
-                    port=port,
-                    settings=chromadb.Settings(anonymized_telemetry=False),
-                )
+                # "embedded": a persistent in-process client (single-node deployments)
+                mode = self.config.get("chroma").get("mode", "http")
+                span.set_attribute("chroma.mode", mode)
+                if mode == "embedded":
+                    path = self.config.get("chroma").get("embedded", {}).get("path")
+                    span.set_attribute("chroma.path", path)
+                    self.chroma_client = chromadb.PersistentClient(
+                        path=path,
+                        settings=chromadb.Settings(anonymized_telemetry=False),
+                    )
+                else:
+                    config_key = "local" if local else "remote"
+                    host = self.config.get("chroma").get(config_key).get("host")
+                    port = self.config.get("chroma").get(config_key).get("port")
+                    span.set_attribute("chroma.host", host)
+                    span.set_attribute("chroma.port", port)
+
+                    self.chroma_client = chromadb.HttpClient(
+                        host=host,
+                        port=port,
+                        settings=chromadb.Settings(anonymized_telemetry=False),
+                    )
             except Exception as e:
                 span.record_exception(e)
                 span.set_status(Status(StatusCode.ERROR, "Failed to initialize ChromaDB client"))
@@ -228,26 +389,31 @@ class EntityMiningWorkflow:
             "Person": {
                 "template": self.person_profiler_prompt_template,
                 "schema": PersonProfile,
+                "supporting_schema": SupportingPersonProfile,
                 "label": "person_profile",
             },
             "Location": {
                 "template": self.location_profiler_prompt_template,
                 "schema": LocationProfile,
+                "supporting_schema": SupportingEntityProfile,
                 "label": "location_profile",
             },
             "Event": {
                 "template": self.event_profiler_prompt_template,
                 "schema": EventProfile,
+                "supporting_schema": SupportingEntityProfile,
                 "label": "event_profile",
             },
             "Object": {
                 "template": self.object_profiler_prompt_template,
                 "schema": ObjectProfile,
+                "supporting_schema": SupportingEntityProfile,
                 "label": "object_profile",
             },
             "Organization": {
                 "template": self.organization_profiler_prompt_template,
                 "schema": OrganizationProfile,
+                "supporting_schema": SupportingEntityProfile,
                 "label": "organization_profile",
             },
         }
@@ -279,11 +445,18 @@ class EntityMiningWorkflow:
         model_id: str,
         system_prompt: str,
         instruction_prompt: str,
+        stage: str = "unknown",
+        shared_context: str | None = None,
+        output_schema: dict | None = None,
         temperature: float = 0,
         top_p: float = 0.9,
         seed: int = 69420,
-    ):
+        route: str = "default",
+    ) -> dict:
         with tracer.start_as_current_span("bedrock_invoke_model") as span:
+            span.set_attribute("novelwriter.stage", stage)
+            span.set_attribute("novelwriter.model_route", route)
+            span.set_attribute("gen_ai.request.model", model_id or "")
             span.set_attribute(
                 "genai.system_prompt.length", len(system_prompt) if system_prompt else 0
             )
@@ -291,6 +464,9 @@ class EntityMiningWorkflow:
                 "genai.instruction_prompt.length",
                 len(instruction_prompt) if instruction_prompt else 0,
             )
+            span.set_attribute(
+                "genai.shared_context.length", len(shared_context) if shared_context else 0
+            )
 
             if not model_id or not system_prompt or not instruction_prompt:
                 span.set_status(Status(StatusCode.ERROR, "Parameters missing"))
@@ -299,40 +475,223 @@ class EntityMiningWorkflow:
             logger.info(f"Invoking model: {model_id}")
             try:
                 body = {
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": instruction_prompt},
-                    ],
+                    "messages": self._build_messages(
+                        model_id, system_prompt, instruction_prompt, shared_context
+                    ),
                     "temperature": temperature,
                     "top_p": top_p,
                     "seed": seed,
                 }
+                structured_output_mode = self._add_output_schema(body, model_id, output_schema)
+                span.set_attribute("gen_ai.request.structured_output", structured_output_mode)
 
+                start = time.perf_counter()
                 response = self.bedrock_runtime.invoke_model(
                     modelId=model_id,
                     body=json.dumps(body),
                     contentType="application/json",
                 )
+                response_body = json.loads(response.get("body").read())
+                elapsed_ms = (time.perf_counter() - start) * 1000
+
+                self._record_usage(
+                    span,
+                    stage,
+                    model_id,
+                    parse_usage(response_body, response.get("ResponseMetadata"), elapsed_ms),
+                    route,
+                )
 
                 span.set_status(Status(StatusCode.OK))
-                return response
+                return response_body
             except Exception as e:
                 span.record_exception(e)
                 span.set_status(Status(StatusCode.ERROR, "Model invocation failed"))
                 logger.error(f"Error invoking model: {e}")
                 raise
 
-    def _parse_response(self, response, model_output_schema: BaseModel) -> BaseModel:
-        content = (
-            json.loads(response.get("body").read()).get("choices")[0].get("message").get("content")
+    def _build_messages(
+        self,
+        model_id: str,
+        system_prompt: str,
+        instruction_prompt: str,
+        shared_context: str | None = None,
+    ) -> list[dict]:
+        """Lays out the messages as [system, shared context, instruction].
+
+        Everything up to the end of `shared_context` is identical across the calls of a
+        stage, so provider-side prefix caching can reuse it; models in
+        `prompt_cache_models` also get an explicit cache marker at that boundary.
+        """
+        if not shared_context:
+            user_content = instruction_prompt
+        elif model_id in self.prompt_cache_models:
+            user_content = [
+                {"type": "text", "text": shared_context, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": instruction_prompt},
+            ]
+        else:
+            user_content = shared_context + instruction_prompt
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ]
+
+    def _record_usage(
+        self, span, stage: str, model_id: str, usage: dict, route: str = "default"
+    ) -> None:
+        span.set_attribute("gen_ai.usage.input_tokens", usage["input_tokens"])
+        span.set_attribute("gen_ai.usage.output_tokens", usage["output_tokens"])
+        span.set_attribute("gen_ai.usage.reasoning_tokens", usage["reasoning_tokens"])
+        span.set_attribute(
+            "gen_ai.usage.reasoning_tokens_estimated", usage["reasoning_tokens_estimated"]
+        )
+        span.set_attribute("gen_ai.usage.cache_read_input_tokens", usage["cache_read_tokens"])
+        span.set_attribute("gen_ai.usage.cache_write_input_tokens", usage["cache_write_tokens"])
+        span.set_attribute("gen_ai.response.latency_ms", usage["latency_ms"])
+
+        attributes = {
+            "gen_ai.request.model": model_id,
+            "novelwriter.stage": stage,
+            "novelwriter.model_route": route,
+        }
+        for token_type in ("input", "output", "reasoning", "cache_read", "cache_write"):
+            token_usage_histogram.record(
+                usage[f"{token_type}_tokens"], attributes | {"gen_ai.token.type": token_type}
+            )
+        operation_duration_histogram.record(usage["latency_ms"] / 1000, attributes)
+
+        self.run_usage.record(stage, model_id, usage, route=route)
+
+    def _add_output_schema(self, body: dict, model_id: str, output_schema: dict | None) -> str:
+        """Requests schema-constrained output from models configured to support it."""
+        mode = self.structured_output_modes.get(model_id) if output_schema else None
+        name = (output_schema or {}).get("title", "output")
+        if mode == "tool":
+            body["tools"] = [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": name,
+                        "description": f"Record the {name} result",
+                        "parameters": output_schema,
+                    },
+                }
+            ]
+            body["tool_choice"] = {"type": "function", "function": {"name": name}}
+        elif mode == "json_schema":
+            body["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": name, "schema": output_schema},
+            }
+        return mode or "none"
+
+    @staticmethod
+    def _response_content(response_body: dict) -> str:
+        message = response_body.get("choices")[0].get("message")
+        tool_calls = message.get("tool_calls")
+        if tool_calls:
+            return tool_calls[0].get("function", {}).get("arguments", "")
+        return message.get("content") or ""
+
+    def _invoke_and_parse(
+        self,
+        model_output_schema: BaseModel,
+        stage: str,
+        system_prompt: str,
+        instruction_prompt: str,
+        shared_context: str | None = None,
+        route_stage: str | None = None,
+        category: str | None = None,
+        significance: str | None = None,
+    ) -> BaseModel:
+        # `stage` labels the call in usage reports; routing matches on `route_stage`
+        route, model_settings = self.model_router.route(
+            route_stage or stage, category=category, significance=significance
         )
-        extracted_json = content.split("```json")[-1].split("```")[0]
-        parsed = json.loads(extracted_json)
+        request = {
+            "system_prompt": system_prompt,
+            "instruction_prompt": instruction_prompt,
+            "shared_context": shared_context,
+            "stage": stage,
+            "route": route,
+            **model_settings,
+        }
+        response = self.invoke_model(
+            **request, output_schema=model_output_schema.model_json_schema()
+        )
+        return self._parse_response(response, model_output_schema, request)
 
-        if model_output_schema is EntityExtractionAndClassification and isinstance(parsed, list):
-            parsed = {"entities": parsed}
+    def _parse_response(
+        self, response_body: dict, model_output_schema: BaseModel, request: dict | None = None
+    ) -> BaseModel:
+        """Parses and validates model output, salvaging as much of it as possible.
+
+        Damaged JSON is repaired, list items (extracted entities, minor entity
+        summaries, relationships) are validated one by one
+        (invalid ones are dropped) and, when the originating `invoke_model` arguments
+        are given, invalid or missing fields of other schemas are re-requested in a
+        follow-up call.
+        """
+        with tracer.start_as_current_span("parse_model_output") as span:
+            span.set_attribute("output.schema", model_output_schema.__name__)
+            parsed = extract_json(self._response_content(response_body))
+
+            if model_output_schema in LIST_OUTPUT_SCHEMAS:
+                list_field, item_schema = LIST_OUTPUT_SCHEMAS[model_output_schema]
+                if isinstance(parsed, list):
+                    parsed = {list_field: parsed}
+                items = parsed.get(list_field) if isinstance(parsed, dict) else None
+                valid, rejected = validate_items(item_schema, items or [])
+                span.set_attribute("output.items.rejected", len(rejected))
+                if rejected:
+                    logger.warning(f"Dropped {len(rejected)} invalid {list_field}: {rejected}")
+                return model_output_schema(**{list_field: valid})
+
+            # a left-out nullable field is not worth a follow-up call
+            parsed = fill_nullable_fields(model_output_schema, parsed)
+            fields = invalid_fields(model_output_schema, parsed)
+            if fields is None:
+                raise ValueError(f"Model output does not match {model_output_schema.__name__}")
+            if fields and request:
+                span.set_attribute("output.fields.repaired", fields)
+                parsed = self._repair_fields(parsed, fields, model_output_schema, request)
+
+            return model_output_schema.model_validate(parsed)
+
+    def _repair_fields(
+        self,
+        parsed: dict,
+        fields: list[str],
+        model_output_schema: BaseModel,
+        request: dict,
+    ) -> dict:
+        """Re-requests only `fields`; nullable fields that are still invalid become null."""
+        subset_schema = field_subset_schema(model_output_schema, fields)
+        subset_schema["title"] = f"{model_output_schema.__name__}Fields"
+        followup_request = request | {
+            "instruction_prompt": request["instruction_prompt"]
+            + FIELD_REPAIR_INSTRUCTION.format(
+                fields=", ".join(fields), schema=json.dumps(subset_schema, indent=2)
+            ),
+            "stage": f"{request['stage']}.repair",
+        }
 
-        return model_output_schema.model_validate(parsed)
+        logger.info(f"Re-requesting fields {fields} for {model_output_schema.__name__}")
+        try:
+            response = self.invoke_model(**followup_request, output_schema=subset_schema)
+            patch = extract_json(self._response_content(response))
+            if isinstance(patch, dict):
+                parsed = parsed | {field: patch[field] for field in fields if field in patch}
+        except Exception as e:
+            logger.warning(f"Follow-up call for fields {fields} failed: {e}")
+
+        nullable = nullable_fields(model_output_schema)
+        for field in invalid_fields(model_output_schema, parsed) or []:
+            if field in nullable:
+                parsed[field] = None
+        return parsed
 
     @staticmethod
     def _get_prompts(template: dict, label: str) -> tuple[str, str]:
@@ -347,13 +706,13 @@ class EntityMiningWorkflow:
             system_prompt, instruction_prompt = self._get_prompts(
                 self.genre_determination_prompt_template, "genre_determination"
             )
-            instruction_prompt = instruction_prompt.format(text=text)
-            response = self.invoke_model(
-                model_id=self.model_id,
-                system_prompt=system_prompt,
-                instruction_prompt=instruction_prompt,
+            result = self._invoke_and_parse(
+                GenreDetermination,
+                "genre_determination",
+                system_prompt,
+                instruction_prompt.format(text=SHARED_CONTEXT_REFERENCE),
+                shared_context=SHARED_CONTEXT_TEMPLATE.format(text=text),
             )
-            result = self._parse_response(response, GenreDetermination)
             span.set_attribute("genre.detected", result.genre)
             return result
 
@@ -362,22 +721,30 @@ class EntityMiningWorkflow:
             system_prompt, instruction_prompt = self._get_prompts(
                 self.entity_extraction_and_classification_prompt_template, "entity_extraction"
             )
-            instruction_prompt = instruction_prompt.format(genre=genre, text=text)
-            response = self.invoke_model(
-                model_id=self.model_id,
-                system_prompt=system_prompt,
-                instruction_prompt=instruction_prompt,
+            result = self._invoke_and_parse(
+                EntityExtractionAndClassification,
+                "entity_extraction",
+                system_prompt,
+                instruction_prompt.format(genre=genre, text=SHARED_CONTEXT_REFERENCE),
+                shared_context=SHARED_CONTEXT_TEMPLATE.format(text=text),
             )
-            result = self._parse_response(response, EntityExtractionAndClassification)
             span.set_attribute("entities.count", len(result.entities))
             return result
 
     def profile_entity(
-        self, text: str, entity_name: str, genre: str, category: str, significance: str = None
+        self,
+        text: str,
+        entity_name: str,
+        genre: str,
+        category: str,
+        significance: str = None,
+        aliases: list[str] | None = None,
     ) -> BaseModel:
+        """Profiles one entity: the full schema for Major entities, a reduced one otherwise."""
         with tracer.start_as_current_span("profile_entity") as span:
             span.set_attribute("entity.name", entity_name)
             span.set_attribute("entity.category", category)
+            span.set_attribute("entity.significance", significance or "")
 
             if category not in self.profile_config:
                 return None
@@ -387,18 +754,167 @@ class EntityMiningWorkflow:
                 config["template"], config["label"]
             )
 
-            format_args = {"entity_name": entity_name, "genre": genre, "text": text}
-            if category == "Person" and significance != "Minor":
-                format_args["significance"] = significance
+            instruction_prompt = instruction_prompt.format(
+                entity_name=entity_name,
+                genre=genre,
+                text=SHARED_CONTEXT_REFERENCE,
+                significance=significance or "Major",
+            )
+            schema, stage = config["schema"], config["label"]
+            if significance in ("Supporting", "Minor"):
+                schema, stage = config["supporting_schema"], f"{config['label']}_supporting"
+                instruction_prompt += SUPPORTING_PROFILE_INSTRUCTION.format(
+                    schema=json.dumps(schema.model_json_schema(), indent=2)
+                )
+            if aliases:
+                instruction_prompt += ALIASES_INSTRUCTION.format(
+                    entity_name=entity_name, aliases=", ".join(aliases)
+                )
+            span.set_attribute("profile.schema", schema.__name__)
+
+            # the entity-specific instruction goes after the story text shared by all calls
+            profile = self._invoke_and_parse(
+                schema,
+                stage,
+                system_prompt,
+                instruction_prompt,
+                shared_context=SHARED_CONTEXT_TEMPLATE.format(text=text),
+                route_stage="profile",
+                category=category,
+                significance=significance,
+            )
+            # keep the canonical name, whichever variant the model echoed back
+            name_field = "name" if "name" in type(profile).model_fields else "primary_name"
+            setattr(profile, name_field, entity_name)
+            return profile
+
+    def load_alias_index(self) -> AliasIndex:
+        """Names and aliases of the profiles that earlier runs stored for this novel."""
+        threshold = self.config.get("aws").get("alias_similarity_threshold", 0.88)
+        collection = getattr(self, "chroma_collection", None)
+        if collection is None:
+            return AliasIndex(threshold)
+        try:
+            stored = collection.get(include=["documents", "metadatas"])
+            return AliasIndex.from_profiles(stored["documents"], stored["metadatas"], threshold)
+        except Exception as e:
+            logger.warning(f"Could not load stored profiles for canonicalization: {e}")
+            return AliasIndex(threshold)
+
+    def canonicalize_entities(
+        self, extraction: EntityExtractionAndClassification
+    ) -> tuple[EntityExtractionAndClassification, dict[str, list[str]]]:
+        """Collapses name variants onto one entity, matching stored profiles and each other."""
+        with tracer.start_as_current_span("canonicalize_entities") as span:
+            index = self.load_alias_index()
+            span.set_attribute("canonicalization.known_entities", len(index.entities))
+            entities, aliases = canonicalize(extraction.entities, index)
+            self.alias_index = index
+            span.set_attribute("entities.count", len(extraction.entities))
+            span.set_attribute("entities.canonical", len(entities))
+            if aliases:
+                logger.info(f"Merged entity name variants: {aliases}")
+            return EntityExtractionAndClassification(entities=entities), aliases
+
+    @staticmethod
+    def minor_profiles_from_extraction(
+        entities: list[ExtractedAndClassifiedEntity],
+    ) -> list[MinorEntityProfile]:
+        """Minimal profiles built from the extraction output alone, without an LLM call."""
+        return [
+            MinorEntityProfile(name=entity.name, category=entity.category, summary=None)
+            for entity in entities
+        ]
+
+    def profile_minor_entities(
+        self,
+        text: str,
+        genre: str,
+        entities: list[ExtractedAndClassifiedEntity],
+        aliases: dict[str, list[str]] | None = None,
+    ) -> list[MinorEntityProfile]:
+        """Summarizes all Minor entities in one batched call."""
+        aliases = aliases or {}
+        with tracer.start_as_current_span("profile_minor_entities") as span:
+            span.set_attribute("entities.count", len(entities))
+            entity_lines = []
+            for entity in entities:
+                line = f"- {entity.name} ({entity.category})"
+                if entity.name in aliases:
+                    line += f", also called {', '.join(aliases[entity.name])}"
+                entity_lines.append(line)
+            result = self._invoke_and_parse(
+                MinorEntityProfiles,
+                "minor_profiles",
+                MINOR_ENTITIES_SYSTEM_PROMPT,
+                MINOR_ENTITIES_INSTRUCTION.format(
+                    text=SHARED_CONTEXT_REFERENCE,
+                    genre=genre,
+                    entities="\n".join(entity_lines),
+                    schema=json.dumps(MinorEntityProfiles.model_json_schema(), indent=2),
+                ),
+                shared_context=SHARED_CONTEXT_TEMPLATE.format(text=text),
+                route_stage="profile",
+                significance="Minor",
+            )
 
-            instruction_prompt = instruction_prompt.format(**format_args)
+            # keep entities the model skipped, with the minimal extraction-only profile
+            summarized = {profile.name for profile in result.entities}
+            missing = [entity for entity in entities if entity.name not in summarized]
+            span.set_attribute("entities.missing", len(missing))
+            return result.entities + self.minor_profiles_from_extraction(missing)
 
-            response = self.invoke_model(
-                model_id=self.model_id,
-                system_prompt=system_prompt,
-                instruction_prompt=instruction_prompt,
+    @staticmethod
+    def _profile_name(profile: BaseModel) -> str:
+        return profile_name(profile)
+
+    def extract_relationships(
+        self, text: str, genre: str, profiles: list[BaseModel]
+    ) -> RelationshipExtractor:
+        """One global pass over the aggregated profiles (not pairwise calls)."""
+        with tracer.start_as_current_span("extract_relationships") as span:
+            profiles = [p for p in profiles if not isinstance(p, MinorEntityProfile)]
+            span.set_attribute("entities.count", len(profiles))
+            if len(profiles) < 2:
+                return RelationshipExtractor(relationships=[])
+
+            system_prompt, instruction_prompt = self._get_prompts(
+                self.relationship_extractor_prompt_template, "relationship_extraction"
+            )
+            instruction_prompt = instruction_prompt.format(
+                top_k_names=", ".join(self._profile_name(p) for p in profiles),
+                genre=genre,
+                text=SHARED_CONTEXT_REFERENCE,
+            ) + RELATIONSHIP_PROFILES_INSTRUCTION.format(
+                profiles="\n".join(p.model_dump_json(exclude_none=True) for p in profiles)
             )
-            return self._parse_response(response, config["schema"])
+            result = self._invoke_and_parse(
+                RelationshipExtractor,
+                "relationship_extraction",
+                system_prompt,
+                instruction_prompt,
+                shared_context=SHARED_CONTEXT_TEMPLATE.format(text=text),
+            )
+            relationships = result.relationships
+            if self.alias_index is not None:
+                # graph nodes must match the canonical `entity_name`s stored in Chroma
+                relationships = canonicalize_relationships(relationships, self.alias_index)
+            span.set_attribute("relationships.count", len(relationships))
+            return RelationshipExtractor(relationships=relationships)
+
+    def save_relationship_index(self, relationships: list[ExtractedRelationships], index_name: str):
+        with tracer.start_as_current_span("save_relationship_index") as span:
+            span.set_attribute("relationship_index.name", index_name)
+            try:
+                index = self.relationship_index_store.merge(
+                    index_name, [r.model_dump() for r in relationships]
+                )
+                span.set_attribute("relationship_index.edges", len(index["edges"]))
+                return True
+            except Exception as e:
+                span.record_exception(e)
+                logger.error(f"Error saving relationship index {index_name}: {e}")
+                return False
 
     def execute(self, text: str) -> dict:
         with tracer.start_as_current_span("entity_mining_execution") as span:
@@ -407,59 +923,169 @@ class EntityMiningWorkflow:
 
             extracted_entities = self.extract_entities(text=text, genre=genre)
 
+            # name variants collapse onto one entity before any profiling call goes out
+            aliases = {}
+            if self.config.get("aws").get("canonicalize_entities", True):
+                extracted_entities, aliases = self.canonicalize_entities(extracted_entities)
+
             profiled_entities = []
             failed_profiles = 0
 
+            # Minor entities get a minimal summary: one batched call, or none at all in
+            # "extraction" mode. Major and Supporting entities are profiled one by one.
+            minor_entities = [
+                entity
+                for entity in extracted_entities.entities
+                if entity.significance == "Minor" and entity.category in self.profile_config
+            ]
+            entities = [
+                entity for entity in extracted_entities.entities if entity.significance != "Minor"
+            ]
+            span.set_attribute("entities.minor", len(minor_entities))
+            if minor_entities and self.minor_profile_mode == "extraction":
+                profiled_entities.extend(self.minor_profiles_from_extraction(minor_entities))
+                minor_entities = []
+
+            # With prompt_cache_warmup, one entity per profiler category is profiled first so
+            # the shared system prompt + story prefix is cached before the fan-out.
+            waves = [entities]
+            if self.config.get("aws").get("prompt_cache_warmup", False):
+                first_per_category = {}
+                for entity in entities:
+                    first_per_category.setdefault(entity.category, entity)
+                warmup = list(first_per_category.values())
+                waves = [warmup, [entity for entity in entities if entity not in warmup]]
+
             max_workers = self.config.get("aws").get("thread_pool_max_workers", 10)
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [
+                minor_future = (
                     executor.submit(
-                        self.profile_entity,
-                        text=text,
-                        entity_name=entity.name,
-                        genre=genre,
-                        category=entity.category,
-                        significance=(entity.significance if entity.significance else None),
+                        self.profile_minor_entities, text, genre, minor_entities, aliases
                     )
-                    for entity in extracted_entities.entities
-                ]
-                for future in as_completed(futures):
+                    if minor_entities
+                    else None
+                )
+                for wave in waves:
+                    futures = [
+                        executor.submit(
+                            self.profile_entity,
+                            text=text,
+                            entity_name=entity.name,
+                            genre=genre,
+                            category=entity.category,
+                            significance=(entity.significance if entity.significance else None),
+                            aliases=aliases.get(entity.name),
+                        )
+                        for entity in wave
+                    ]
+                    for future in as_completed(futures):
+                        try:
+                            result = future.result()
+                            if result:
+                                profiled_entities.append(result)
+                        except Exception as e:
+                            failed_profiles += 1
+                            logger.error(f"Error profiling entity: {e}")
+
+                if minor_future:
                     try:
-                        result = future.result()
-                        if result:
-                            profiled_entities.append(result)
+                        profiled_entities.extend(minor_future.result())
                     except Exception as e:
-                        failed_profiles += 1
-                        logger.error(f"Error profiling entity: {e}")
+                        logger.error(
+                            f"Error summarizing minor entities, keeping them unsummarized: {e}"
+                        )
+                        profiled_entities.extend(
+                            self.minor_profiles_from_extraction(minor_entities)
+                        )
 
             span.set_attribute("entities.profiled", len(profiled_entities))
+
+            relationships = []
+            if self.config.get("aws").get("extract_relationships", True):
+                try:
+                    relationships = self.extract_relationships(
+                        text, genre, profiled_entities
+                    ).relationships
+                except Exception as e:
+                    logger.error(f"Error extracting relationships: {e}")
+
+            usage_total = self.run_usage.summary()["total"]
+            span.set_attribute("gen_ai.usage.input_tokens", usage_total["input_tokens"])
+            span.set_attribute("gen_ai.usage.output_tokens", usage_total["output_tokens"])
+            span.set_attribute("gen_ai.usage.reasoning_tokens", usage_total["reasoning_tokens"])
+            span.set_attribute(
+                "gen_ai.usage.cache_read_input_tokens", usage_total["cache_read_tokens"]
+            )
             return {
                 "genre": genre,
                 "genre_determination_reasoning": genre_result.reasoning,
                 "profiled_entities": profiled_entities,
+                "relationships": relationships,
+                "entities": extracted_entities.entities,
+                "aliases": aliases,
             }
 
     def save_entities_to_chroma(
-        self, entity_profiles: list[BaseModel], genre: str, novel_name: str
+        self,
+        entity_profiles: list[BaseModel],
+        genre: str,
+        novel_name: str,
+        entities: list[ExtractedAndClassifiedEntity] | None = None,
+        aliases: dict[str, list[str]] | None = None,
     ) -> bool:
+        """Upserts the profiles under their canonical names, so re-mining updates them.
+
+        A profile stored by an earlier run is merged with the new one rather than replaced
+        (see `merge_stored_profile`). The document (what gets embedded) is the profile's
+        short embedding text; the full profile is kept in the `profile_json` metadata.
+        """
         with tracer.start_as_current_span("save_to_chromadb") as span:
             try:
-                doc_ids = []
-                for profile in entity_profiles:
-                    name = getattr(profile, "name", getattr(profile, "primary_name", "unknown"))
-                    doc_ids.append(f"{novel_name}-{name}")
-
-                self.chroma_collection.add(
-                    documents=[profile.model_dump_json() for profile in entity_profiles],
-                    metadatas=[
-                        {
-                            "novel_name": novel_name,
-                            "genre": genre,
-                            "source": "entity_miner",
-                            "created_at": datetime.datetime.now().isoformat(),
-                        }
-                        for _ in entity_profiles
-                    ],
+                names = [self._profile_name(profile) for profile in entity_profiles]
+                doc_ids = [f"{novel_name}-{name}" for name in names]
+                categories = {entity.name: entity.category for entity in entities or []}
+                significances = {entity.name: entity.significance for entity in entities or []}
+                aliases = aliases or {}
+                existing = self.chroma_collection.get(
+                    ids=doc_ids, include=["metadatas", "documents"]
+                )
+                # older entries stored the full profile as the document
+                stored = {
+                    doc_id: {"profile_json": document} | (metadata or {})
+                    for doc_id, metadata, document in zip(
+                        existing["ids"], existing["metadatas"], existing["documents"], strict=True
+                    )
+                }
+                span.set_attribute("chroma.merged_profiles", len(stored))
+
+                metadatas, documents = [], []
+                for doc_id, name, profile in zip(doc_ids, names, entity_profiles, strict=True):
+                    stored_metadata = stored.get(doc_id) or {}
+                    profile, significance, profile_aliases = merge_stored_profile(
+                        profile, significances.get(name), aliases.get(name), stored_metadata
+                    )
+                    metadata = {
+                        "novel_name": novel_name,
+                        "genre": genre,
+                        "source": "entity_miner",
+                        "entity_name": name,
+                        "profile_json": profile.model_dump_json(exclude_none=True),
+                        "created_at": datetime.datetime.now().isoformat(),
+                    }
+                    category = categories.get(name) or stored_metadata.get("category")
+                    if category:
+                        metadata["category"] = category
+                    if significance:
+                        metadata["significance"] = significance
+                    if profile_aliases:
+                        metadata["aliases"] = "; ".join(profile_aliases)
+                    metadatas.append(metadata)
+                    documents.append(embedding_text(profile, profile_aliases))
+
+                span.set_attribute("chroma.document_chars", sum(len(d) for d in documents))
+                self.chroma_collection.upsert(
+                    documents=documents,
+                    metadatas=metadatas,
                     ids=doc_ids,
                 )
                 return True
@@ -469,19 +1095,46 @@ class EntityMiningWorkflow:
                 return False
 
 
+def read_story_object(response: dict) -> str:
+    """Text of a story `get_object` response; the webserver stores stories gzip-compressed,
+    older objects are plain UTF-8."""
+    data = response["Body"].read()
+    encoding = response.get("ContentEncoding")
+    if encoding == "gzip":
+        data = gzip.decompress(data)
+    elif encoding and encoding != "identity":
+        raise ValueError(f"Unsupported story Content-Encoding: {encoding}")
+    return data.decode("utf-8")
+
+
+def _event_context_extractor(lambda_event) -> context.Context:
+    """Extracts the trace context the webserver sends in the invocation payload."""
+    carrier = lambda_event.get("trace_context") or lambda_event.get("headers") or {}
+    return propagate.extract(carrier)
+
+
 def lambda_handler(event, context_obj):
     provider = trace.get_tracer_provider()
+    # When not wrapped by AwsLambdaInstrumentor (e.g. the webserver's local mining backend),
+    # parent the handler span on the caller's trace directly.
+    parent_context = None
+    if not trace.get_current_span().get_span_context().is_valid:
+        parent_context = _event_context_extractor(event)
+    telemetry_before = span_processor.snapshot() if span_processor else None
     try:
-        with tracer.start_as_current_span("lambda_handler") as span:
+        with tracer.start_as_current_span("lambda_handler", context=parent_context) as span:
             if "Records" in event and len(event.get("Records", [])) > 0:
                 record = event["Records"][0]
                 if record.get("eventSource") == "aws:s3":
                     bucket_name = record["s3"]["bucket"]["name"]
                     key = record["s3"]["object"]["key"]
+                    if key.endswith(SERVICE_OBJECT_SUFFIX):
+                        logger.info(f"Ignoring S3 event for non-story object {key}")
+                        return {"status": "ignored", "key": key}
                     config = load_config()
                     s3_client = boto3.client("s3", region_name=config.get("aws").get("region"))
                     file_object = s3_client.get_object(Bucket=bucket_name, Key=key)
-                    story_text = file_object["Body"].read().decode("utf-8")
+                    story_text = read_story_object(file_object)
                     novel_name = key.split("/")[-1].split(".")[0]
                     username = file_object["Metadata"].get("username", "unknown")
                 else:
@@ -504,16 +1157,28 @@ def lambda_handler(event, context_obj):
 
             mined_entities = entity_miner.execute(story_text)
             saved = entity_miner.save_entities_to_chroma(
-                mined_entities["profiled_entities"], mined_entities["genre"], novel_name
+                mined_entities["profiled_entities"],
+                mined_entities["genre"],
+                novel_name,
+                entities=mined_entities["entities"],
+                aliases=mined_entities["aliases"],
+            )
+
+            relationships_saved = entity_miner.save_relationship_index(
+                mined_entities["relationships"], index_name=f"{username}-{novel_name}"
             )
 
             span.set_attribute("entities.mined", len(mined_entities["profiled_entities"]))
             span.set_attribute("entities.saved", saved)
+            span.set_attribute("relationships.saved", relationships_saved)
 
             return {
                 "status": "success" if saved else "error",
                 "num_mined_entities": len(mined_entities["profiled_entities"]),
+                "num_relationships": len(mined_entities["relationships"]),
+                "relationships_saved": relationships_saved,
                 "genre": mined_entities.get("genre"),
+                "usage": entity_miner.run_usage.summary(),
             }
     except ValueError as e:
         logger.error(f"Validation error: {e}")
@@ -530,15 +1195,42 @@ def lambda_handler(event, context_obj):
             "error_message": str(e),
         }
     finally:
-        # Always flush traces, even on error
-        if provider and hasattr(provider, "force_flush"):
-            try:
-                provider.force_flush()
-            except Exception as e:
-                logger.warning(f"Failed to flush traces: {e}")
+        # Flush traces and metrics even on error, but for at most the flush timeout. Under
+        # AwsLambdaInstrumentor the invocation span is still open here, so the instrumentor
+        # flushes once it has ended, through the same bounded flush.
+        flushed, flush_seconds = True, 0.0
+        if parent_context is not None:
+            flushed, flush_seconds = flush_telemetry(
+                (provider, metrics.get_meter_provider()), flush_timeout_millis()
+            )
+        if telemetry_before is not None:
+            _log_telemetry_overhead(
+                telemetry_before, span_processor.snapshot(), flush_seconds, flushed
+            )
+
+
+def _log_telemetry_overhead(
+    before: dict, after: dict, flush_seconds: float, flushed: bool
+) -> None:
+    """Logs what tracing cost this invocation, from the span processor counters."""
+    delta = {key: after[key] - before.get(key, 0) for key in after}
+    logger.info(
+        f"Telemetry: {delta['spans']} spans, "
+        f"{delta['processing_seconds'] * 1000:.1f}ms in span processing, "
+        f"{delta.get('dropped', 0) + delta.get('buffer_dropped', 0)} dropped, "
+        f"{delta.get('traces_sampled_out', 0)} traces sampled out, "
+        f"flush {flush_seconds * 1000:.1f}ms ({'complete' if flushed else 'deferred'})"
+    )
+
 
 # dirty but works. TODO: refactor OTel instrumentation to be more pythonic.
-AwsLambdaInstrumentor().instrument()
+# The instrumentor's own end-of-invocation flush gets the same time bound as ours.
+os.environ.setdefault("OTEL_INSTRUMENTATION_AWS_LAMBDA_FLUSH_TIMEOUT", str(flush_timeout_millis()))
+AwsLambdaInstrumentor().instrument(
+    event_context_extractor=_event_context_extractor,
+    tracer_provider=BoundedFlushProvider(trace.get_tracer_provider()),
+    meter_provider=BoundedFlushProvider(metrics.get_meter_provider()),
+)
 
 if __name__ == "__main__":
     prologue_path = "stories/nadarr_prologue.txt"
@@ -558,6 +1250,7 @@ if __name__ == "__main__":
         logger.info(f"Execution complete. Found {len(result['profiled_entities'])} entities.")
 
         logger.info(f"Mined entities: {result}")
+        logger.info(f"Bedrock usage: {entity_miner.run_usage.summary()}")
 
         saved = entity_miner.save_entities_to_chroma(result['profiled_entities'], result['genre'], "nadarr_prologue")
         logger.info(f"Entities saved to ChromaDB: {saved}")
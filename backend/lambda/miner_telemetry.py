@@ -0,0 +1,284 @@
+"""Span processing for the entity miner: tail sampling, dropped span counts and bounded flushes.
+
+Head sampling uses the SDK's standard `OTEL_TRACES_SAMPLER` / `OTEL_TRACES_SAMPLER_ARG`. On top
+of it, spans are set by these environment variables:
+
+- `MINER_TAIL_SAMPLING` (`true`/`false`, default false): buffer each trace until its local root
+  span ends, then keep it only if it has an error, ran for at least
+  `MINER_TAIL_SAMPLING_MIN_DURATION_MS` (default 30000), or falls in the random
+  `MINER_TAIL_SAMPLING_RATIO` (default 0.1).
+- `OTEL_BSP_MAX_QUEUE_SIZE`, `OTEL_BSP_SCHEDULE_DELAY`, `OTEL_BSP_MAX_EXPORT_BATCH_SIZE`: the
+  SDK's export queue. Spans that do not fit in it are dropped and counted.
+- `MINER_TELEMETRY_FLUSH_TIMEOUT_MS` (default 500): how long an invocation waits for the export
+  at the end, also under `AwsLambdaInstrumentor` (see `BoundedFlushProvider`); 0 defers the
+  export to the background thread (or the next invocation).
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from opentelemetry import metrics
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter
+from opentelemetry.trace import StatusCode
+
+logger = logging.getLogger(__name__)
+
+meter = metrics.get_meter("entity_miner.telemetry")
+spans_dropped = meter.create_counter(
+    "novelwriter.telemetry.spans.dropped",
+    unit="{span}",
+    description="Spans not exported by the entity miner, by reason",
+)
+
+# Traces whose sampling decision is remembered for spans that end after their root
+DECIDED_TRACES = 256
+
+# flush threads by provider, so that a hung flush is not started again on every invocation
+_pending_flushes: dict[int, threading.Thread] = {}
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid value for {name}; using {default}")
+        return default
+
+
+class DropCountingSpanProcessor(SpanProcessor):
+    """The SDK's `BatchSpanProcessor`, counting the spans it drops because its queue is full.
+
+    When the queue is full the SDK drops the oldest span without a trace; a sampled span that
+    ends while the queue is at `OTEL_BSP_MAX_QUEUE_SIZE` is counted as one drop.
+    """
+
+    def __init__(self, exporter: SpanExporter):
+        self.processor = BatchSpanProcessor(exporter)
+        self.stats = {"dropped": 0}
+
+    def _queue_full(self) -> bool:
+        queue = getattr(getattr(self.processor, "_batch_processor", None), "_queue", None)
+        maxlen = getattr(queue, "maxlen", None)
+        return maxlen is not None and len(queue) >= maxlen
+
+    def on_start(self, span, parent_context=None) -> None:
+        self.processor.on_start(span, parent_context)
+
+    def on_end(self, span: ReadableSpan) -> None:
+        full = span.context.trace_flags.sampled and self._queue_full()
+        self.processor.on_end(span)
+        if full:
+            self.stats["dropped"] += 1
+            spans_dropped.add(1, {"reason": "queue_full"})
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.processor.force_flush(timeout_millis)
+
+    def shutdown(self) -> None:
+        self.processor.shutdown()
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """Buffers the spans of each trace until its local root ends, then forwards the whole
+    trace to `processor` or drops it.
+
+    A trace is kept if any of its spans failed, its root ran for at least `min_duration_ms`,
+    or it falls in the random `keep_ratio`. At most `max_traces` traces are buffered; the
+    oldest is dropped to make room.
+    """
+
+    def __init__(
+        self,
+        processor: SpanProcessor,
+        min_duration_ms: float = 30000,
+        keep_ratio: float = 0.1,
+        max_traces: int = 64,
+        max_spans_per_trace: int = 4096,
+    ):
+        self.processor = processor
+        self.min_duration_ns = min_duration_ms * 1_000_000
+        self.keep_ratio = keep_ratio
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        self.traces: OrderedDict[int, list[ReadableSpan]] = OrderedDict()
+        self.decided: OrderedDict[int, bool] = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"traces_kept": 0, "traces_sampled_out": 0, "buffer_dropped": 0}
+
+    def on_start(self, span, parent_context=None) -> None:
+        self.processor.on_start(span, parent_context)
+
+    def _drop(self, count: int, reason: str) -> None:
+        spans_dropped.add(count, {"reason": reason})
+
+    def _keep(self, root: ReadableSpan, spans: list[ReadableSpan]) -> bool:
+        if any(s.status.status_code == StatusCode.ERROR for s in spans):
+            return True
+        if root.end_time - root.start_time >= self.min_duration_ns:
+            return True
+        return random.random() < self.keep_ratio
+
+    def on_end(self, span: ReadableSpan) -> None:
+        trace_id = span.context.trace_id
+        is_root = span.parent is None or span.parent.is_remote
+        with self.lock:
+            if trace_id in self.decided:
+                # a span that ended after its trace's root: follow the trace's decision
+                if self.decided[trace_id]:
+                    self.processor.on_end(span)
+                else:
+                    self._drop(1, "tail_sampled")
+                return
+
+            spans = self.traces.get(trace_id)
+            if spans is None:
+                if len(self.traces) >= self.max_traces:
+                    _, evicted = self.traces.popitem(last=False)
+                    self.stats["buffer_dropped"] += len(evicted)
+                    self._drop(len(evicted), "buffer_full")
+                spans = self.traces[trace_id] = []
+            if len(spans) < self.max_spans_per_trace:
+                spans.append(span)
+            else:
+                self.stats["buffer_dropped"] += 1
+                self._drop(1, "buffer_full")
+            if not is_root:
+                return
+
+            del self.traces[trace_id]
+            keep = self._keep(span, spans)
+            self.decided[trace_id] = keep
+            while len(self.decided) > DECIDED_TRACES:
+                self.decided.popitem(last=False)
+
+        if keep:
+            self.stats["traces_kept"] += 1
+            for buffered in spans:
+                self.processor.on_end(buffered)
+        else:
+            self.stats["traces_sampled_out"] += 1
+            self._drop(len(spans), "tail_sampled")
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.processor.force_flush(timeout_millis)
+
+    def shutdown(self) -> None:
+        self.processor.shutdown()
+
+
+class TimedSpanProcessor(SpanProcessor):
+    """Counts spans and the time the instrumented code spends handing them to `processor`."""
+
+    def __init__(self, processor: SpanProcessor):
+        self.processor = processor
+        self.stats = {"spans": 0, "processing_seconds": 0.0}
+
+    def on_start(self, span, parent_context=None) -> None:
+        start = time.perf_counter()
+        self.processor.on_start(span, parent_context)
+        self.stats["processing_seconds"] += time.perf_counter() - start
+
+    def on_end(self, span: ReadableSpan) -> None:
+        start = time.perf_counter()
+        self.processor.on_end(span)
+        self.stats["spans"] += 1
+        self.stats["processing_seconds"] += time.perf_counter() - start
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.processor.force_flush(timeout_millis)
+
+    def shutdown(self) -> None:
+        self.processor.shutdown()
+
+    def snapshot(self) -> dict:
+        """Counters of this processor and the ones it wraps."""
+        stats, processor = dict(self.stats), self.processor
+        while processor is not None:
+            stats.update(getattr(processor, "stats", {}))
+            processor = getattr(processor, "processor", None)
+        return stats
+
+
+def create_span_processor(exporter: SpanExporter) -> TimedSpanProcessor:
+    """The miner's span processing chain, as set by the environment (see the module doc)."""
+    processor = DropCountingSpanProcessor(exporter)
+    if _env_flag("MINER_TAIL_SAMPLING"):
+        processor = TailSamplingSpanProcessor(
+            processor,
+            min_duration_ms=_env_number("MINER_TAIL_SAMPLING_MIN_DURATION_MS", 30000),
+            keep_ratio=_env_number("MINER_TAIL_SAMPLING_RATIO", 0.1),
+        )
+    return TimedSpanProcessor(processor)
+
+
+def flush_timeout_millis() -> int:
+    return int(_env_number("MINER_TELEMETRY_FLUSH_TIMEOUT_MS", 500))
+
+
+def _bounded_flush(provider, timeout_millis: float) -> bool:
+    """Runs `provider.force_flush` in its own thread and waits for it at most `timeout_millis`.
+
+    The OTLP exporters retry a failed export for up to their own timeout (10s by default)
+    whatever the flush timeout, so an unreachable collector would otherwise block the caller.
+    A flush that is still running from an earlier invocation is not started again.
+    """
+    pending = _pending_flushes.get(id(provider))
+    if pending is not None and pending.is_alive():
+        return False
+    result = {}
+
+    def run() -> None:
+        try:
+            result["flushed"] = provider.force_flush(timeout_millis) is not False
+        except Exception as e:
+            logger.warning(f"Failed to flush telemetry: {e}")
+
+    thread = threading.Thread(target=run, name="telemetry-flush", daemon=True)
+    _pending_flushes[id(provider)] = thread
+    thread.start()
+    thread.join(timeout_millis / 1000)
+    return result.get("flushed", False)
+
+
+class BoundedFlushProvider:
+    """Wraps a tracer or meter provider so that `force_flush` returns within its timeout.
+
+    Passed to `AwsLambdaInstrumentor`, whose end-of-invocation flush would otherwise wait for
+    the exporters' retries; everything else is delegated to `provider`.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    def force_flush(self, timeout_millis: float = 30000) -> bool:
+        return _bounded_flush(self.provider, timeout_millis)
+
+
+def flush_telemetry(providers, timeout_millis: int) -> tuple[bool, float]:
+    """Flushes `providers` in order within `timeout_millis` in total.
+
+    Returns whether everything was flushed and the seconds it took. What is not flushed in
+    time is left to the export threads; with a timeout of 0 nothing is flushed here.
+    """
+    start = time.perf_counter()
+    flushed = True
+    for provider in providers:
+        remaining = timeout_millis - (time.perf_counter() - start) * 1000
+        if remaining <= 0:
+            flushed = False
+            break
+        if provider and hasattr(provider, "force_flush"):
+            flushed = _bounded_flush(provider, remaining) and flushed
+    return flushed, time.perf_counter() - start
@@ -0,0 +1,42 @@
+SAMPLING_PARAMETERS = ("temperature", "top_p", "seed")
+
+
+class ModelRouter:
+    """Picks the model and sampling parameters for each miner call.
+
+    `routes` is an ordered list of
+    `{"name": ..., "match": {"stage": ..., "category": ..., "significance": ...}, "model_id": ...,
+    "temperature": ..., "top_p": ..., "seed": ...}`. Match values may be a string or a
+    list of strings and omitted keys match anything; the first matching route wins.
+    Anything a route does not set comes from `default`.
+    """
+
+    def __init__(self, routes: list[dict], default: dict):
+        self.routes = routes or []
+        self.default = default
+        for route in self.routes:
+            unknown = set(route.get("match", {})) - {"stage", "category", "significance"}
+            if unknown:
+                raise ValueError(
+                    f"Unknown match keys in model route {route.get('name')}: {unknown}"
+                )
+
+    @staticmethod
+    def _matches(match: dict, call: dict) -> bool:
+        for key, expected in match.items():
+            expected = expected if isinstance(expected, list) else [expected]
+            if call.get(key) not in expected:
+                return False
+        return True
+
+    def route(self, stage: str, category: str | None = None, significance: str | None = None):
+        """Returns the route name and the `invoke_model` arguments for a call."""
+        call = {"stage": stage, "category": category, "significance": significance}
+        for route in self.routes:
+            if self._matches(route.get("match", {}), call):
+                name = route.get("name") or route["model_id"]
+                settings = self.default | {
+                    key: route[key] for key in ("model_id", *SAMPLING_PARAMETERS) if key in route
+                }
+                return name, settings
+        return "default", dict(self.default)
@@ -0,0 +1,106 @@
+import json
+
+from pydantic import BaseModel, ConfigDict
+
+from canonicalization import SIGNIFICANCE_RANK
+
+# Profile fields that make up the embedding text after the names, each capped so that
+# long free-text fields do not drown out the name, role and description
+EMBEDDING_TEXT_FIELDS = (
+    (("role", "type", "category"), 120),
+    (("description", "summary", "physical_description"), 400),
+    (("history",), 240),
+)
+
+
+def profile_name(profile: BaseModel) -> str:
+    return getattr(profile, "name", getattr(profile, "primary_name", "unknown"))
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return f"{cut}…"
+
+
+def profile_aliases(profile: BaseModel, aliases: list[str] | None = None) -> list[str]:
+    """Other names of a profiled entity: its titles and secondary name, then merged variants."""
+    names = [
+        *(getattr(profile, "titles_and_nicknames", None) or []),
+        getattr(profile, "secondary_name", None),
+        *(aliases or []),
+    ]
+    seen = {profile_name(profile).casefold()}
+    result = []
+    for name in names:
+        if name and name.casefold() not in seen:
+            seen.add(name.casefold())
+            result.append(name)
+    return result
+
+
+def embedding_text(profile: BaseModel, aliases: list[str] | None = None) -> str:
+    """Short text that is embedded for a profile: names first, then role and description.
+
+    The full profile is stored next to it (`profile_json` metadata); only this text is
+    embedded, so near-empty fields and JSON keys do not end up in the vector.
+    """
+    data = profile.model_dump(exclude_none=True)
+    parts = [profile_name(profile)]
+    other_names = profile_aliases(profile, aliases)
+    if other_names:
+        parts[0] += f" (also {', '.join(other_names)})"
+    for fields, max_chars in EMBEDDING_TEXT_FIELDS:
+        value = next((data[field] for field in fields if data.get(field)), None)
+        if isinstance(value, str):
+            parts.append(_truncate(value, max_chars))
+    return " ".join(part if part.endswith("…") else f"{part.rstrip('.')}." for part in parts)
+
+
+class StoredProfile(BaseModel):
+    """A profile read back from its `profile_json` metadata, whichever model produced it."""
+
+    model_config = ConfigDict(extra="allow")
+
+
+def _rank(significance: str | None) -> int:
+    return SIGNIFICANCE_RANK.get(significance, len(SIGNIFICANCE_RANK))
+
+
+def merge_stored_profile(
+    profile: BaseModel, significance: str | None, aliases: list[str] | None, metadata: dict | None
+) -> tuple[BaseModel, str | None, list[str]]:
+    """Merges a new profile with the one an earlier run stored for the same entity.
+
+    The profile of the more significant run wins field by field (the new one on a tie) and
+    the other fills in the fields it lacks, so an entity ranked lower by a later run keeps
+    its full profile. The significance never drops and the aliases of both are kept.
+    Returns the profile, significance and aliases to store.
+    """
+    aliases = list(aliases or [])
+    if not metadata:
+        return profile, significance, aliases
+
+    try:
+        stored = json.loads(metadata.get("profile_json") or "{}")
+    except ValueError:
+        stored = {}
+    if not isinstance(stored, dict):
+        stored = {}
+    new = profile.model_dump(exclude_none=True)
+    stored_significance = metadata.get("significance")
+    if _rank(stored_significance) < _rank(significance):
+        merged = new | stored
+        significance = stored_significance
+    else:
+        merged = stored | new
+
+    stored_aliases = metadata.get("aliases")
+    seen = {profile_name(profile).casefold()}
+    merged_aliases = []
+    for alias in [*(stored_aliases.split("; ") if stored_aliases else []), *aliases]:
+        if alias and alias.casefold() not in seen:
+            seen.add(alias.casefold())
+            merged_aliases.append(alias)
+    return StoredProfile(**merged), significance, merged_aliases
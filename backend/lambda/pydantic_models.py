@@ -158,12 +158,72 @@ class OrganizationProfile(BaseModel):
     prominent_members: list[str] | None
 
 
-# class ExtractedRelationships(BaseModel):
-#     source: str
-#     target: str
-#     relation_type: str
-#     dynamics: str
+class SupportingPersonProfile(BaseModel):
+    """
+    Lighter profile for Supporting characters (role, key trait and voice).
+
+    Example output:
+    {
+        "name": "Shedinn",
+        "titles_and_nicknames": ["Healer", "Prince"],
+        "role": "Priest-healer and brother of Balasar",
+        "personality": "Devout and steadfast; calm under pressure.",
+        "voice_style": "Quiet, prayerful and formal."
+    }
+    """
+
+    name: str
+    titles_and_nicknames: list[str] | None
+    role: str
+    personality: str | None
+    voice_style: str | None
+
+
+class SupportingEntityProfile(BaseModel):
+    """
+    Lighter profile for Supporting locations, events, objects and organizations.
+
+    Example output:
+    {
+        "primary_name": "Shesten highlands",
+        "secondary_name": null,
+        "description": "Windswept highlands ruled by Balasar, where the battle against the orc horde is fought."
+    }
+    """
+
+    primary_name: str
+    secondary_name: str | None
+    description: str | None
+
+
+class MinorEntityProfile(BaseModel):
+    """
+    Minimal summary for Minor entities of any category.
+
+    Example output:
+    {"name": "Aass-Nag jungle", "category": "Location", "summary": "Jungle to the south where Ssarki fell to the Yuan-Ti."}
+    """
+
+    name: str
+    category: str
+    summary: str | None
+
+
+class MinorEntityProfiles(BaseModel):
+    entities: list[MinorEntityProfile]
+
+
+class ExtractedRelationships(BaseModel):
+    """
+    Example output:
+    {"source": "Ssarki", "target": "Balasar", "relation_type": "Friendship", "dynamics": "Ssarki gifted Javok to Balasar; his spirit still fights beside him through the blade."}
+    """
+
+    source: str
+    target: str
+    relation_type: str
+    dynamics: str
 
 
-# class RelationshipExtractor(BaseModel):
-#     relationships: list[ExtractedRelationships]
\ No newline at end of file
+class RelationshipExtractor(BaseModel):
+    relationships: list[ExtractedRelationships]
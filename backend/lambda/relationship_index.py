@@ -0,0 +1,82 @@
+import datetime
+import json
+import logging
+
+logger = logging.getLogger()
+
+EDGE_FIELDS = ("source", "target", "relation_type", "dynamics")
+
+
+def build_adjacency(edges: list[dict]) -> dict[str, list[int]]:
+    """Maps each entity to the indexes of the edges it takes part in (either direction)."""
+    adjacency: dict[str, list[int]] = {}
+    for i, edge in enumerate(edges):
+        adjacency.setdefault(edge["source"], []).append(i)
+        if edge["target"] != edge["source"]:
+            adjacency.setdefault(edge["target"], []).append(i)
+    return adjacency
+
+
+def merge_relationships(index: dict | None, relationships: list[dict], index_name: str) -> dict:
+    """Adds a mining run's relationships to a novel's index.
+
+    Edges are keyed by (source, target, relation_type), compared case-insensitively;
+    a relationship seen again replaces the stored dynamics with the newer ones.
+    """
+    edges = list((index or {}).get("edges", []))
+    positions = {
+        (e["source"].casefold(), e["target"].casefold(), e["relation_type"].casefold()): i
+        for i, e in enumerate(edges)
+    }
+    for relationship in relationships:
+        edge = {field: relationship[field].strip() for field in EDGE_FIELDS}
+        if not edge["source"] or not edge["target"]:
+            continue
+        key = (
+            edge["source"].casefold(),
+            edge["target"].casefold(),
+            edge["relation_type"].casefold(),
+        )
+        if key in positions:
+            edges[positions[key]] = edge
+        else:
+            positions[key] = len(edges)
+            edges.append(edge)
+
+    return {
+        "index_name": index_name,
+        "updated_at": datetime.datetime.now().isoformat(),
+        "edges": edges,
+        "adjacency": build_adjacency(edges),
+    }
+
+
+class RelationshipIndexStore:
+    """Per-novel relationship indexes stored as JSON objects in S3."""
+
+    def __init__(self, s3_client, bucket: str, prefix: str = "entity_graphs/"):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, index_name: str) -> str:
+        return f"{self.prefix}{index_name}.json"
+
+    def load(self, index_name: str) -> dict | None:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(index_name))
+            return json.loads(response["Body"].read())
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+
+    def merge(self, index_name: str, relationships: list[dict]) -> dict:
+        """Read-merge-write of the novel's index; returns the merged index."""
+        index = merge_relationships(self.load(index_name), relationships, index_name)
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(index_name),
+            Body=json.dumps(index),
+            ContentType="application/json",
+        )
+        logger.info(f"Relationship index {index_name} now has {len(index['edges'])} edges")
+        return index
@@ -0,0 +1,188 @@
+import json
+import re
+import types
+import typing
+
+from pydantic import BaseModel, ValidationError
+
+_THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+_PYTHON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+_CLOSERS = {"{": "}", "[": "]"}
+# a bare word outside of strings: letters of any script, no digits or underscores
+_BARE_WORD = re.compile(r"[^\W\d_]+")
+
+# How many cut points to try when recovering a truncated payload
+MAX_TRUNCATION_REPAIRS = 20
+
+
+def _strip_fences(content: str) -> str:
+    content = _THINK_BLOCK.sub("", content)
+    if "```json" in content:
+        content = content.split("```json")[-1]
+        return content.split("```")[0]
+    if "```" in content:
+        parts = content.split("```")
+        # the payload sits between the first pair of fences (or after an unclosed one)
+        return parts[1]
+    return content
+
+
+def _scan(text: str) -> tuple[str, list[tuple[int, list[str]]], list[str], bool]:
+    """Normalizes the text outside of strings and records where recovery can cut.
+
+    Returns the normalized text, the positions of commas outside of strings with
+    the bracket stack at that point, the final bracket stack and whether the
+    text ends inside a string.
+    """
+    out = []
+    cut_points = []
+    stack = []
+    in_string = escaped = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            i += 1
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+        elif char in "}]":
+            # drop trailing commas: {"a": 1,} / [1, 2,]
+            while out and out[-1] in " \t\r\n,":
+                if out.pop() == ",":
+                    cut_points.pop()
+            if stack:
+                stack.pop()
+            out.append(char)
+            if not stack:
+                break  # anything after the top-level value is chatter
+            i += 1
+            continue
+        elif char == ",":
+            j = len(out) - 1
+            while j >= 0 and out[j] in " \t\r\n":
+                j -= 1
+            if j >= 0 and out[j] in (",", "[", "{"):
+                i += 1
+                continue  # empty element: [1,,2] / {,"a": 1}
+            cut_points.append((len(out), list(stack)))
+        elif char.isalpha():
+            match = _BARE_WORD.match(text, i)
+            word = match.group(0) if match else char
+            out.extend(_PYTHON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+
+        out.append(char)
+        i += 1
+
+    return "".join(out), cut_points, stack, in_string
+
+
+def repair_json(text: str):
+    """Parses JSON, repairing common model-output damage.
+
+    Handles surrounding prose, Python literals (None/True/False), trailing
+    commas and truncated output (unterminated strings, unclosed arrays and
+    objects, a dangling key or value); truncated payloads are cut back to the
+    last complete element.
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        raise ValueError("No JSON object or array found in model output")
+
+    normalized, cut_points, stack, in_string = _scan(text[start:])
+    try:
+        return json.loads(normalized)
+    except json.JSONDecodeError as e:
+        last_error = e
+
+    candidates = [(normalized + ('"' if in_string else ""), stack)]
+    candidates += [(normalized[:pos], cut_stack) for pos, cut_stack in reversed(cut_points)]
+    for candidate, candidate_stack in candidates[:MAX_TRUNCATION_REPAIRS]:
+        closing = "".join(_CLOSERS[opener] for opener in reversed(candidate_stack))
+        try:
+            return json.loads(candidate.rstrip().rstrip(",") + closing)
+        except json.JSONDecodeError as e:
+            last_error = e
+
+    raise ValueError(f"Could not repair model output as JSON: {last_error}")
+
+
+def extract_json(content: str):
+    """Extracts the JSON payload from a model response (fenced or bare)."""
+    payload = _strip_fences(content)
+    try:
+        return json.loads(payload)
+    except json.JSONDecodeError:
+        return repair_json(payload)
+
+
+def validate_items(item_schema: type[BaseModel], items: list) -> tuple[list[BaseModel], list]:
+    """Validates list items one by one; returns the valid models and the rejected items."""
+    valid, rejected = [], []
+    for item in items:
+        try:
+            valid.append(item_schema.model_validate(item))
+        except ValidationError:
+            rejected.append(item)
+    return valid, rejected
+
+
+def fill_nullable_fields(schema: type[BaseModel], data):
+    """Sets nullable fields missing from `data` to None, so that only required fields count
+    as missing."""
+    if not isinstance(data, dict):
+        return data
+    missing = [
+        name
+        for name in nullable_fields(schema)
+        if name not in data and schema.model_fields[name].is_required()
+    ]
+    return dict.fromkeys(missing) | data
+
+
+def invalid_fields(schema: type[BaseModel], data) -> list[str] | None:
+    """Top-level fields of `data` that fail validation, or None if the whole value is unusable."""
+    if not isinstance(data, dict):
+        return None
+    try:
+        schema.model_validate(data)
+        return []
+    except ValidationError as e:
+        fields = {error["loc"][0] for error in e.errors() if error["loc"]}
+        if not fields or not fields <= set(schema.model_fields):
+            return None
+        return sorted(fields)
+
+
+def nullable_fields(schema: type[BaseModel]) -> set[str]:
+    nullable = set()
+    for name, field in schema.model_fields.items():
+        origin = typing.get_origin(field.annotation)
+        if origin in (typing.Union, types.UnionType) and type(None) in typing.get_args(
+            field.annotation
+        ):
+            nullable.add(name)
+    return nullable
+
+
+def field_subset_schema(schema: type[BaseModel], fields: list[str]) -> dict:
+    """JSON schema of `schema` restricted to `fields`, for targeted follow-up calls."""
+    full = schema.model_json_schema()
+    return {
+        "type": "object",
+        "properties": {name: full["properties"][name] for name in fields},
+        "required": fields,
+        **({"$defs": full["$defs"]} if "$defs" in full else {}),
+    }
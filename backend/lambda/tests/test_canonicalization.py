@@ -0,0 +1,67 @@
+from canonicalization import AliasIndex, canonicalize_relationships
+from pydantic_models import ExtractedRelationships
+from relationship_index import merge_relationships
+
+
+def relationship(source: str, target: str) -> ExtractedRelationships:
+    return ExtractedRelationships(
+        source=source, target=target, relation_type="Devotion", dynamics="Prays to her."
+    )
+
+
+def alias_index() -> AliasIndex:
+    index = AliasIndex()
+    index.add("Great Mother Tamara", "Person")
+    index.add("Shedinn", "Person", titles=["the priest"])
+    index.add("Balasar", "Person")
+    return index
+
+
+def test_names_differing_by_honorifics_match():
+    index = alias_index()
+    assert index.match("Tamara").name == "Great Mother Tamara"
+    assert index.match("Lord Balasar").name == "Balasar"
+
+
+def test_descriptive_names_do_not_match_the_entity_they_mention():
+    index = alias_index()
+    assert index.match("Son of Balasar", "Person") is None
+    assert index.match("Balasar's father", "Person") is None
+    assert index.match("the twins' mother", "Person") is None
+
+
+def test_single_generic_words_do_not_match():
+    index = alias_index()
+    assert index.match("Mother", "Person") is None
+    assert index.match("Great Mother", "Person") is None
+
+
+def test_descriptive_names_are_not_matched_by_the_entity_they_mention():
+    index = AliasIndex()
+    index.add("Son of Balasar", "Person")
+    assert index.match("Balasar", "Person") is None
+
+
+def test_alias_endpoints_are_renamed_to_canonical_names():
+    relationships = canonicalize_relationships(
+        [relationship("the priest", "Tamara"), relationship("Balasar", "Shedinn")], alias_index()
+    )
+
+    assert [(r.source, r.target) for r in relationships] == [
+        ("Shedinn", "Great Mother Tamara"),
+        ("Balasar", "Shedinn"),
+    ]
+    graph = merge_relationships(None, [r.model_dump() for r in relationships], "u-novel")
+    assert set(graph["adjacency"]) == {"Shedinn", "Great Mother Tamara", "Balasar"}
+
+
+def test_unknown_endpoints_are_kept():
+    relationships = canonicalize_relationships([relationship("Ssarki", "Tamara")], alias_index())
+    assert [(r.source, r.target) for r in relationships] == [("Ssarki", "Great Mother Tamara")]
+
+
+def test_relationships_between_variants_of_one_entity_are_dropped():
+    relationships = canonicalize_relationships(
+        [relationship("Tamara", "Great Mother Tamara")], alias_index()
+    )
+    assert relationships == []
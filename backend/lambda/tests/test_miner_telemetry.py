@@ -0,0 +1,80 @@
+import importlib
+import socket
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+from miner_telemetry import DropCountingSpanProcessor
+
+
+class BlockedExporter(SpanExporter):
+    def __init__(self):
+        self.released = threading.Event()
+
+    def export(self, spans):
+        self.released.wait(5)
+        return SpanExportResult.SUCCESS
+
+
+@pytest.fixture
+def silent_collector():
+    """A collector endpoint that accepts connections but never answers."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(64)
+    yield f"http://127.0.0.1:{server.getsockname()[1]}"
+    server.close()
+
+
+def test_instrumented_handler_returns_within_the_flush_timeout(silent_collector, monkeypatch):
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "entity-miner")
+    monkeypatch.setenv("_HANDLER", "entity_miner.lambda_handler")
+    monkeypatch.setenv("OTEL_EXPORTER_OTLP_ENDPOINT", silent_collector)
+    monkeypatch.setenv("OTEL_EXPORTER_OTLP_TIMEOUT", "3")
+    monkeypatch.setenv("MINER_TELEMETRY_FLUSH_TIMEOUT_MS", "300")
+    monkeypatch.delenv("OTEL_INSTRUMENTATION_AWS_LAMBDA_FLUSH_TIMEOUT", raising=False)
+    monkeypatch.delenv("OTEL_SDK_DISABLED", raising=False)
+    monkeypatch.delitem(sys.modules, "entity_miner", raising=False)
+    entity_miner = importlib.import_module("entity_miner")
+    assert hasattr(entity_miner.lambda_handler, "__wrapped__")
+    lambda_context = SimpleNamespace(
+        invoked_function_arn="arn:aws:lambda:us-east-1:123456789012:function:entity-miner",
+        aws_request_id="test-request",
+        function_name="entity-miner",
+    )
+
+    start = time.perf_counter()
+    # no "text": fails validation straight away, leaving only the telemetry flush
+    result = entity_miner.lambda_handler({}, lambda_context)
+    elapsed = time.perf_counter() - start
+
+    assert result["error_type"] == "ValidationError"
+    # the span and metric flushes each wait at most 300ms, not the exporters' 3s timeout
+    assert elapsed < 1.5
+
+
+def test_spans_that_do_not_fit_in_the_queue_are_counted(monkeypatch):
+    monkeypatch.setenv("OTEL_BSP_MAX_QUEUE_SIZE", "4")
+    monkeypatch.setenv("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", "1")
+    exporter = BlockedExporter()
+    processor = DropCountingSpanProcessor(exporter)
+    provider = TracerProvider()
+    provider.add_span_processor(processor)
+    tracer = provider.get_tracer("test")
+
+    # the first span is taken by the export thread, which then blocks; four more fill the queue
+    with tracer.start_as_current_span("first"):
+        pass
+    time.sleep(0.2)
+    for i in range(7):
+        with tracer.start_as_current_span(f"span-{i}"):
+            pass
+
+    assert processor.stats["dropped"] == 3
+    exporter.released.set()
+    provider.shutdown()
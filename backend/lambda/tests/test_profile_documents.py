@@ -0,0 +1,72 @@
+import json
+
+from profile_documents import embedding_text, merge_stored_profile
+from pydantic_models import MinorEntityProfile, SupportingPersonProfile
+
+MAJOR_PROFILE = {
+    "name": "Shedinn",
+    "titles_and_nicknames": ["Healer"],
+    "role": "Priest-healer and brother of Balasar",
+    "history": "Raised in the temple of the Great Mother Tamara.",
+    "personality": "Devout and steadfast.",
+}
+
+
+def stored_metadata(significance: str | None = "Major", aliases: str = "the priest") -> dict:
+    metadata = {"profile_json": json.dumps(MAJOR_PROFILE), "aliases": aliases}
+    if significance:
+        metadata["significance"] = significance
+    return metadata
+
+
+def supporting_profile() -> SupportingPersonProfile:
+    return SupportingPersonProfile(
+        name="Shedinn",
+        titles_and_nicknames=None,
+        role="High priest of Tamara",
+        personality="Stern.",
+        voice_style="Formal.",
+    )
+
+
+def test_new_entity_is_stored_as_profiled():
+    profile = MinorEntityProfile(name="Ssarki", category="Person", summary="A fallen scout.")
+    merged, significance, aliases = merge_stored_profile(profile, "Minor", ["the scout"], None)
+    assert merged is profile
+    assert (significance, aliases) == ("Minor", ["the scout"])
+
+
+def test_lower_ranked_run_does_not_replace_a_major_profile():
+    profile = MinorEntityProfile(name="Shedinn", category="Person", summary="A healer.")
+    merged, significance, aliases = merge_stored_profile(
+        profile, "Minor", ["Brother Shedinn"], stored_metadata()
+    )
+
+    data = merged.model_dump(exclude_none=True)
+    assert significance == "Major"
+    assert {key: data[key] for key in MAJOR_PROFILE} == MAJOR_PROFILE
+    assert data["summary"] == "A healer."
+    assert aliases == ["the priest", "Brother Shedinn"]
+    assert embedding_text(merged, aliases).startswith("Shedinn (also Healer, the priest")
+
+
+def test_higher_ranked_run_updates_the_stored_fields():
+    profile = supporting_profile()
+    merged, significance, aliases = merge_stored_profile(
+        profile, "Supporting", ["the priest"], stored_metadata(significance="Minor")
+    )
+
+    data = merged.model_dump(exclude_none=True)
+    assert significance == "Supporting"
+    assert data["role"] == "High priest of Tamara"
+    assert data["history"] == MAJOR_PROFILE["history"]
+    assert aliases == ["the priest"]
+
+
+def test_entries_without_a_significance_take_the_new_profile():
+    profile = supporting_profile()
+    merged, significance, _ = merge_stored_profile(
+        profile, "Supporting", None, stored_metadata(significance=None)
+    )
+    assert significance == "Supporting"
+    assert merged.model_dump()["role"] == "High priest of Tamara"
@@ -0,0 +1,72 @@
+import pytest
+from pydantic import BaseModel
+
+from structured_output import fill_nullable_fields, invalid_fields, repair_json
+
+
+class Profile(BaseModel):
+    name: str
+    description: str | None
+    titles: list[str] | None = None
+
+
+def test_repair_json_strips_surrounding_prose():
+    text = 'Here is the profile:\n{"name": "Balasar", "role": "Champion"}\nHope this helps!'
+    assert repair_json(text) == {"name": "Balasar", "role": "Champion"}
+
+
+def test_repair_json_drops_trailing_commas():
+    assert repair_json('{"names": ["Shedinn", "Balasar",], "count": 2,}') == {
+        "names": ["Shedinn", "Balasar"],
+        "count": 2,
+    }
+
+
+def test_repair_json_converts_python_literals():
+    assert repair_json('{"a": None, "b": True, "c": False}') == {"a": None, "b": True, "c": False}
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        (
+            '{"name": "Shedinn", "history": "Born in the Shes',
+            {"name": "Shedinn", "history": "Born in the Shes"},
+        ),
+        (
+            '{"entities": [{"name": "Ssarki"}, {"name": "Yuan-Ti"}, {"na',
+            {"entities": [{"name": "Ssarki"}, {"name": "Yuan-Ti"}]},
+        ),
+        ('{"name": "Tamara", "domain":', {"name": "Tamara"}),
+    ],
+)
+def test_repair_json_recovers_truncated_output(text, expected):
+    assert repair_json(text) == expected
+
+
+def test_repair_json_keeps_non_ascii_strings():
+    assert repair_json('{"name": "Ünwë Þórr", "place": "Aass-Nag",}') == {
+        "name": "Ünwë Þórr",
+        "place": "Aass-Nag",
+    }
+
+
+def test_repair_json_fails_cleanly_on_non_ascii_bare_word():
+    with pytest.raises(ValueError):
+        repair_json('{"a": Ünknown}')
+
+
+def test_repair_json_without_json_raises():
+    with pytest.raises(ValueError):
+        repair_json("I could not find any entities.")
+
+
+def test_missing_nullable_fields_are_not_invalid():
+    data = fill_nullable_fields(Profile, {"name": "Balasar"})
+    assert data == {"name": "Balasar", "description": None}
+    assert invalid_fields(Profile, data) == []
+
+
+def test_missing_required_and_invalid_fields_are_reported():
+    data = fill_nullable_fields(Profile, {"description": 3})
+    assert invalid_fields(Profile, data) == ["description", "name"]
@@ -0,0 +1,146 @@
+import threading
+
+# Rough chars-per-token ratio, used only when the model does not report a count
+CHARS_PER_TOKEN = 4
+
+USAGE_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "reasoning_tokens",
+    "cache_read_tokens",
+    "cache_write_tokens",
+    "latency_ms",
+)
+
+
+def _header(response_metadata: dict, name: str) -> int | None:
+    value = (response_metadata or {}).get("HTTPHeaders", {}).get(name)
+    return int(value) if value not in (None, "") else None
+
+
+def parse_usage(response_body: dict, response_metadata: dict, elapsed_ms: float) -> dict:
+    """Extracts token counts and latency from a Bedrock InvokeModel response.
+
+    Prefers the OpenAI-style `usage` block in the body and falls back to the
+    `x-amzn-bedrock-*` response headers. Reasoning tokens come from
+    `usage.completion_tokens_details.reasoning_tokens` when reported, otherwise
+    they are estimated from the returned reasoning text. Prompt-cache hits and
+    writes are counted separately; they are part of `input_tokens`.
+    """
+    body_usage = response_body.get("usage") or {}
+
+    input_tokens = body_usage.get("prompt_tokens", body_usage.get("input_tokens"))
+    if input_tokens is None:
+        input_tokens = _header(response_metadata, "x-amzn-bedrock-input-token-count")
+
+    output_tokens = body_usage.get("completion_tokens", body_usage.get("output_tokens"))
+    if output_tokens is None:
+        output_tokens = _header(response_metadata, "x-amzn-bedrock-output-token-count")
+
+    reasoning_tokens = (body_usage.get("completion_tokens_details") or {}).get("reasoning_tokens")
+    reasoning_estimated = False
+    if reasoning_tokens is None:
+        choices = response_body.get("choices") or [{}]
+        message = choices[0].get("message") or {}
+        reasoning_text = message.get("reasoning_content") or message.get("reasoning") or ""
+        reasoning_tokens = len(reasoning_text) // CHARS_PER_TOKEN
+        reasoning_estimated = bool(reasoning_text)
+
+    cache_read_tokens = (body_usage.get("prompt_tokens_details") or {}).get(
+        "cached_tokens", body_usage.get("cache_read_input_tokens")
+    )
+    if cache_read_tokens is None:
+        cache_read_tokens = _header(
+            response_metadata, "x-amzn-bedrock-cache-read-input-token-count"
+        )
+
+    cache_write_tokens = body_usage.get("cache_creation_input_tokens")
+    if cache_write_tokens is None:
+        cache_write_tokens = _header(
+            response_metadata, "x-amzn-bedrock-cache-write-input-token-count"
+        )
+
+    latency_ms = _header(response_metadata, "x-amzn-bedrock-invocation-latency")
+    if latency_ms is None:
+        latency_ms = round(elapsed_ms)
+
+    return {
+        "input_tokens": input_tokens or 0,
+        "output_tokens": output_tokens or 0,
+        "reasoning_tokens": reasoning_tokens or 0,
+        "reasoning_tokens_estimated": reasoning_estimated,
+        "cache_read_tokens": cache_read_tokens or 0,
+        "cache_write_tokens": cache_write_tokens or 0,
+        "latency_ms": latency_ms,
+    }
+
+
+def _empty_totals() -> dict:
+    return {"calls": 0, "models": [], "estimated_cost_usd": None} | {
+        field: 0 for field in USAGE_FIELDS
+    }
+
+
+def _add_usage(totals: dict, model_id: str, usage: dict, cost: float | None) -> None:
+    totals["calls"] += 1
+    for field in USAGE_FIELDS:
+        totals[field] += usage.get(field, 0)
+    if model_id not in totals["models"]:
+        totals["models"].append(model_id)
+    if cost is not None:
+        totals["estimated_cost_usd"] = (totals["estimated_cost_usd"] or 0) + cost
+
+
+class RunUsage:
+    """Thread-safe aggregation of Bedrock usage over one mining run, by stage and model route."""
+
+    def __init__(self, pricing: dict | None = None):
+        # {model_id: {"input": usd_per_1k_tokens, "output": usd_per_1k_tokens,
+        #             "cache_read": usd_per_1k_tokens}}  (cache_read defaults to "input")
+        self.pricing = pricing or {}
+        self.lock = threading.Lock()
+        self.stages: dict[str, dict] = {}
+        self.routes: dict[str, dict] = {}
+
+    def estimate_cost(self, model_id: str, usage: dict) -> float | None:
+        prices = self.pricing.get(model_id)
+        if not prices:
+            return None
+        input_price = prices.get("input", 0)
+        cache_read = usage.get("cache_read_tokens", 0)
+        return (
+            (usage["input_tokens"] - cache_read) * input_price
+            + cache_read * prices.get("cache_read", input_price)
+            + usage["output_tokens"] * prices.get("output", 0)
+        ) / 1000
+
+    def record(self, stage: str, model_id: str, usage: dict, route: str = "default") -> None:
+        cost = self.estimate_cost(model_id, usage)
+        with self.lock:
+            _add_usage(self.stages.setdefault(stage, _empty_totals()), model_id, usage, cost)
+            _add_usage(self.routes.setdefault(route, _empty_totals()), model_id, usage, cost)
+
+    def summary(self) -> dict:
+        with self.lock:
+            stages = {stage: dict(totals) for stage, totals in self.stages.items()}
+            routes = {
+                route: totals | {"avg_latency_ms": round(totals["latency_ms"] / totals["calls"])}
+                for route, totals in self.routes.items()
+            }
+
+        total = {"calls": 0, "estimated_cost_usd": None} | {field: 0 for field in USAGE_FIELDS}
+        for totals in stages.values():
+            total["calls"] += totals["calls"]
+            for field in USAGE_FIELDS:
+                total[field] += totals[field]
+            if totals["estimated_cost_usd"] is not None:
+                total["estimated_cost_usd"] = (total["estimated_cost_usd"] or 0) + totals[
+                    "estimated_cost_usd"
+                ]
+
+        total["cache_hit_ratio"] = (
+            round(total["cache_read_tokens"] / total["input_tokens"], 4)
+            if total["input_tokens"]
+            else 0.0
+        )
+        return {"total": total, "stages": stages, "routes": routes}
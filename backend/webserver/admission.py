@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from telemetry import admission_queue_depth, admission_rejections, admission_wait
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a request is not admitted; carries the HTTP status and Retry-After."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def client_address(peer: str | None, forwarded_for: str | None, trusted_proxies: int = 0) -> str:
+    """The address of the client behind `trusted_proxies` reverse proxies (the ALB is one).
+
+    Each trusted proxy appends the address it received the request from to
+    X-Forwarded-For, so the client's is the `trusted_proxies`-th entry from the right;
+    entries further left come from the client and can be anything. Without trusted proxies
+    (or without the header) it is the connection's peer.
+    """
+    hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+    if trusted_proxies > 0 and len(hops) >= trusted_proxies:
+        return hops[-trusted_proxies]
+    return peer or "unknown"
+
+
+class AdmissionController:
+    """Concurrency limit for one endpoint with a bounded, per-user fair wait queue.
+
+    At most `max_concurrent` requests run at once. Up to `max_queue` more wait, at most
+    `max_queue_per_user` of them from one user, and freed slots go to users in turn, so
+    a burst from one user cannot starve the others. Requests are rejected straight away
+    when the queue is full (503) or the user's share of it is (429), and after waiting
+    `queue_timeout_seconds` without a slot (503). The user is whatever identity the
+    caller trusts, e.g. `client_address`, not a name the client sends.
+
+    Must be used from the event loop; the requests themselves may run in the threadpool.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        max_concurrent: int = 4,
+        max_queue: int = 16,
+        max_queue_per_user: int = 4,
+        queue_timeout_seconds: float = 10,
+        retry_after_seconds: int = 5,
+    ):
+        self.endpoint = endpoint
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.waiting: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+    def _reject(self, reason: str, status_code: int, message: str):
+        self.rejected += 1
+        admission_rejections.add(1, {"endpoint": self.endpoint, "reason": reason})
+        return AdmissionRejectedError(message, status_code, self.retry_after_seconds)
+
+    def _dequeue(self, user: str, future: asyncio.Future) -> None:
+        queue = self.waiting.get(user)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self.waiting[user]
+            self.queued -= 1
+            admission_queue_depth.add(-1, {"endpoint": self.endpoint})
+
+    def _grant(self) -> None:
+        # one waiter per user per round, in the order users started waiting
+        while self.active < self.max_concurrent and self.waiting:
+            user, queue = next(iter(self.waiting.items()))
+            future = queue[0]
+            self._dequeue(user, future)
+            if user in self.waiting:
+                self.waiting.move_to_end(user)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    async def acquire(self, user: str) -> None:
+        """Takes a slot, waiting in `user`'s queue if none is free; pair with `release`."""
+        if self.active < self.max_concurrent and not self.waiting:
+            self.active += 1
+            return
+        if self.queued >= self.max_queue:
+            raise self._reject(
+                "queue_full",
+                503,
+                f"Too many {self.endpoint} requests ({self.active} running, {self.queued} queued)",
+            )
+        if len(self.waiting.get(user, ())) >= self.max_queue_per_user:
+            raise self._reject(
+                "user_queue_full",
+                429,
+                f"Too many queued {self.endpoint} requests for user '{user}'",
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(user, deque()).append(future)
+        self.queued += 1
+        admission_queue_depth.add(1, {"endpoint": self.endpoint})
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout_seconds)
+        except (TimeoutError, asyncio.CancelledError) as e:
+            self._dequeue(user, future)
+            if future.done() and not future.cancelled():
+                # granted a slot just as the wait ended; pass it on
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject(
+                "queue_timeout",
+                503,
+                f"Timed out after {self.queue_timeout_seconds}s waiting for a {self.endpoint} slot",
+            ) from None
+        finally:
+            admission_wait.record(time.perf_counter() - start, {"endpoint": self.endpoint})
+
+    def release(self) -> None:
+        self.active -= 1
+        self._grant()
+
+    @asynccontextmanager
+    async def admit(self, user: str):
+        """Holds one of the endpoint's slots for the duration of the block."""
+        await self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def admit_if_free(self):
+        """Holds a slot for the block if one is free right now; yields whether it got one.
+
+        For optional work, which should be skipped under load rather than queued.
+        """
+        if self.active >= self.max_concurrent or self.waiting:
+            yield False
+            return
+        self.active += 1
+        try:
+            yield True
+        finally:
+            self.release()
@@ -0,0 +1,173 @@
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any
+
+
+class StageTimeoutError(Exception):
+    """Raised when a stage does not finish within its share of the request's deadline."""
+
+
+class Deadline:
+    """Time budget of one request, shared out between its stages.
+
+    A stage with a share gets at most `share * budget_seconds`, and never more than what is
+    left after the shares `reserved` for the stages that still have to run. A stage without
+    a share, or the final stage (`capped=False`), gets whatever remains. Stages that were
+    skipped or cut short are recorded in `degraded`.
+    """
+
+    def __init__(self, budget_seconds: float, shares: dict[str, float] | None = None):
+        self.budget_seconds = budget_seconds
+        self.shares = shares or {}
+        self.expires_at = time.monotonic() + budget_seconds
+        self.degraded: list[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_budget(
+        self, stage: str, reserved: tuple[str, ...] = (), capped: bool = True
+    ) -> float:
+        available = self.remaining() - sum(
+            self.shares.get(later, 0) * self.budget_seconds for later in reserved
+        )
+        if capped and stage in self.shares:
+            available = min(available, self.shares[stage] * self.budget_seconds)
+        return max(0.0, available)
+
+    def degrade(self, stage: str) -> None:
+        if stage not in self.degraded:
+            self.degraded.append(stage)
+
+
+class LatencyTracker:
+    """Recent latencies of one kind of call, for picking the hedging delay."""
+
+    def __init__(self, window: int = 100, percentile: float = 0.95, min_samples: int = 20):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.samples: deque[float] = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def threshold(self) -> float | None:
+        """The `percentile` latency, or None until `min_samples` calls were recorded."""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(self.percentile * len(ordered)) - 1)]
+
+
+class DeadlineExecutor:
+    """Runs blocking calls with a timeout, optionally hedged.
+
+    A call that times out keeps running in its worker thread (a client call cannot be
+    interrupted), but the caller gets `StageTimeoutError` straight away; a hedge that lost
+    keeps running too. Such abandoned calls still hold workers, so while more than
+    `max_abandoned` of them run, new calls fail straight away rather than queue behind them.
+    With `hedge_after`, a second copy of the call is started if the first has not finished
+    by then and a worker is free, and the first result wins.
+    """
+
+    def __init__(self, max_workers: int = 16, max_abandoned: int | None = None):
+        self.max_workers = max_workers
+        self.max_abandoned = max_workers // 2 if max_abandoned is None else max_abandoned
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="deadline")
+        # submitted calls that have not finished, whether running or waiting for a worker
+        self.in_flight = 0
+        self.abandoned = 0
+        self.lock = threading.Lock()
+
+    def _finished(self, future) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def _submit(self, fn: Callable[[], Any]):
+        with self.lock:
+            self.in_flight += 1
+        # the copy keeps the caller's trace context in the worker thread
+        future = self.pool.submit(contextvars.copy_context().run, fn)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _abandon(self, futures) -> None:
+        """Cancels the calls that have not started; counts the others until they finish."""
+        for future in futures:
+            if future.cancel() or future.done():
+                continue
+            with self.lock:
+                self.abandoned += 1
+            future.add_done_callback(self._abandoned_finished)
+
+    def _abandoned_finished(self, future) -> None:
+        with self.lock:
+            self.abandoned -= 1
+
+    def call(
+        self,
+        fn: Callable[[], Any],
+        timeout: float,
+        hedge_after: float | None = None,
+        tracker: LatencyTracker | None = None,
+    ) -> tuple[Any, bool]:
+        """Returns `fn()`'s result and whether it came from the hedged copy.
+
+        `tracker` gets the latency of the first copy, whichever copy won, or `timeout` if
+        it had not finished by then; failed calls are not recorded.
+        """
+        if self.abandoned > self.max_abandoned:
+            raise StageTimeoutError(
+                f"{self.abandoned} abandoned calls are still holding workers; not starting another"
+            )
+        start = time.monotonic()
+        expires_at = start + timeout
+        recorded = threading.Lock()
+
+        def record(seconds: float) -> None:
+            if tracker is not None and recorded.acquire(blocking=False):
+                tracker.record(seconds)
+
+        def record_primary(future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                record(time.monotonic() - start)
+
+        futures = [self._submit(fn)]
+        futures[0].add_done_callback(record_primary)
+        if hedge_after is not None and hedge_after < timeout:
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done and self.in_flight < self.max_workers:
+                futures.append(self._submit(fn))
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=max(0.0, expires_at - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            # prefer a successful copy; a failed one only counts once all copies failed
+            for future in done:
+                if future.exception() is None:
+                    self._abandon(pending)
+                    return future.result(), future is not futures[0]
+            if not pending:
+                raise next(iter(done)).exception()
+        if not futures[0].done():
+            # recorded as at least the timeout; the primary's own latency is then ignored
+            record(timeout)
+        self._abandon(futures)
+        raise StageTimeoutError(f"Call did not finish within {timeout:.1f}s")
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
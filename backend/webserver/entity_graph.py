@@ -0,0 +1,99 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class EntityGraph:
+    """Read-only view of a novel's relationship index written by the entity miner.
+
+    The index holds `edges` (source, target, relation_type, dynamics) and an `adjacency`
+    map from entity name to the indexes of its edges. Names are matched case-insensitively.
+    """
+
+    def __init__(self, index: dict):
+        self.edges = index.get("edges", [])
+        self.adjacency = index.get("adjacency") or {}
+        self.names = {name.casefold(): name for name in self.adjacency}
+
+    def canonical_name(self, name: str) -> str | None:
+        return self.names.get(name.strip().casefold())
+
+    def neighbors(self, name: str, hops: int = 1, limit: int | None = None):
+        """Breadth-first k-hop lookup.
+
+        Returns the neighbors as `{"name", "hops"}` (nearest first, at most `limit`) and
+        the edges traversed to reach them, or None if the entity is not in the graph.
+        """
+        start = self.canonical_name(name)
+        if start is None:
+            return None
+
+        distances = {start: 0}
+        edge_ids = []
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if distances[node] >= hops:
+                continue
+            for edge_id in self.adjacency.get(node, []):
+                edge = self.edges[edge_id]
+                other = edge["target"] if edge["source"] == node else edge["source"]
+                if other in distances:
+                    continue
+                if limit is not None and len(distances) - 1 >= limit:
+                    queue.clear()
+                    break
+                distances[other] = distances[node] + 1
+                edge_ids.append(edge_id)
+                queue.append(other)
+
+        neighbors = [{"name": n, "hops": d} for n, d in distances.items() if n != start]
+        return neighbors, [self.edges[i] for i in edge_ids]
+
+
+class EntityGraphStore:
+    """Loads relationship indexes from S3, caching each one for `ttl_seconds`.
+
+    A missing index is only cached for `miss_ttl_seconds`, so that a novel's graph shows up
+    soon after its first mining run.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        prefix: str = "entity_graphs/",
+        ttl_seconds=300,
+        miss_ttl_seconds=10,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.miss_ttl_seconds = miss_ttl_seconds
+        self.cache: dict[str, tuple[float, EntityGraph | None]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, index_name: str) -> EntityGraph | None:
+        """The graph for `{username}-{novel_name}`, or None if the novel has none yet."""
+        with self.lock:
+            cached = self.cache.get(index_name)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=f"{self.prefix}{index_name}.json"
+            )
+            graph = EntityGraph(json.loads(response["Body"].read()))
+        except self.s3_client.exceptions.NoSuchKey:
+            graph = None
+
+        with self.lock:
+            ttl = self.ttl_seconds if graph is not None else self.miss_ttl_seconds
+            self.cache[index_name] = (time.monotonic() + ttl, graph)
+        return graph
@@ -0,0 +1,97 @@
+import json
+
+from summaries import CHARS_PER_TOKEN
+
+NAME_FIELDS = ("name", "primary_name")
+
+# Profile fields in the order they are worth prompt tokens to the forecaster
+SUMMARY_FIELDS = (
+    "role",
+    "type",
+    "category",
+    "description",
+    "summary",
+    "personality",
+    "motivations",
+    "current_internal_state",
+    "short_term_goals",
+    "key_relations",
+    "history",
+    "owner",
+    "magical_properties",
+    "goals",
+    "prominent_members",
+    "prominent_entities_associated",
+    "long_term_goals",
+    "physical_description",
+    "voice_style",
+    "strengths",
+    "flaws",
+)
+
+# A field is only cut short if at least this much of it still fits
+MIN_FIELD_CHARS = 40
+
+
+def stored_profile(document: str, metadata: dict | None) -> dict | None:
+    """The structured profile of a Chroma entry.
+
+    The entity miner keeps it in the `profile_json` metadata; entries written before that
+    stored the profile JSON as the document itself.
+    """
+    metadata = metadata or {}
+    for candidate in (metadata.get("profile_json"), document):
+        if not candidate:
+            continue
+        try:
+            profile = json.loads(candidate)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(profile, dict):
+            return profile
+    return None
+
+
+def profile_entity_name(profile: dict) -> str | None:
+    return next((profile[field] for field in NAME_FIELDS if profile.get(field)), None)
+
+
+def _format_value(value) -> str:
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value)
+    return str(value)
+
+
+def render_profile(document: str, metadata: dict | None, max_tokens: int) -> str:
+    """A summary of a vector search hit within `max_tokens` (estimated), for prompts.
+
+    Names come first, then the profile's fields by `SUMMARY_FIELDS` order until the budget
+    is used up; entries without a structured profile are cut to the budget as they are.
+    """
+    budget = max_tokens * CHARS_PER_TOKEN
+    profile = stored_profile(document, metadata)
+    if profile is None:
+        return document[:budget]
+
+    metadata = metadata or {}
+    name = profile_entity_name(profile) or metadata.get("entity_name") or "Unknown"
+    other_names = [
+        *(profile.get("titles_and_nicknames") or []),
+        profile.get("secondary_name"),
+        *(metadata["aliases"].split("; ") if metadata.get("aliases") else []),
+    ]
+    other_names = list(dict.fromkeys(n for n in other_names if n and n != name))
+    lines = [f"{name} (also {', '.join(other_names)})" if other_names else name]
+
+    remaining = budget - len(lines[0])
+    for field in SUMMARY_FIELDS:
+        if not profile.get(field):
+            continue
+        line = f"{field.replace('_', ' ').capitalize()}: {_format_value(profile[field])}"
+        if len(line) + 1 > remaining:
+            if remaining >= MIN_FIELD_CHARS:
+                lines.append(line[: remaining - 2].rstrip() + "…")
+            break
+        lines.append(line)
+        remaining -= len(line) + 1
+    return "\n".join(lines)
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def forecast_key(fragment: str, username: str, novel_name: str, forecaster_template: dict) -> str:
+    """Cache key for a forecast: the user and novel (whose entities and graph it was built
+    from), the forecaster template version and the fragment's hash."""
+    fragment_hash = hashlib.sha256(fragment.encode("utf-8")).hexdigest()
+    return f"{username}:{novel_name}:{forecaster_template.get('version', '')}:{fragment_hash}"
+
+
+class ForecastCache:
+    """In-memory TTL cache of forecaster responses.
+
+    Keys that are still being computed (claimed by a speculative run) are tracked
+    so that `/api/generate` can wait for that run instead of repeating it.
+    """
+
+    def __init__(self, ttl_seconds: float = 900, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.pending: set[str] = set()
+        self.condition = threading.Condition()
+
+    def _get(self, key: str) -> str | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def get(self, key: str, wait_timeout: float = 0) -> str | None:
+        """Returns the cached forecast, waiting up to `wait_timeout` if it is being computed."""
+        deadline = time.monotonic() + wait_timeout
+        with self.condition:
+            while True:
+                value = self._get(key)
+                remaining = deadline - time.monotonic()
+                if value is not None or key not in self.pending or remaining <= 0:
+                    return value
+                self.condition.wait(remaining)
+
+    def claim(self, key: str) -> bool:
+        """Marks `key` as being computed; False if it is already cached or claimed."""
+        with self.condition:
+            if key in self.pending or self._get(key) is not None:
+                return False
+            self.pending.add(key)
+            return True
+
+    def put(self, key: str, value: str) -> None:
+        with self.condition:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.pending.discard(key)
+            self.condition.notify_all()
+
+    def release(self, key: str) -> None:
+        """Drops the claim on `key` without a value (the computation failed)."""
+        with self.condition:
+            self.pending.discard(key)
+            self.condition.notify_all()
@@ -1,20 +1,43 @@
 import hashlib
 import json
 import logging
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
 
 import boto3
-import chromadb
+from anyio import from_thread
 from botocore.config import Config
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
 from langchain_aws import ChatBedrockConverse
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from opentelemetry import trace
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from pydantic import BaseModel
 
-from utils import get_template_from_dynamo, load_config
+from admission import AdmissionController, AdmissionRejectedError, client_address
+from deadlines import Deadline, DeadlineExecutor, LatencyTracker, StageTimeoutError
+from entity_graph import EntityGraphStore
+from entity_profiles import profile_entity_name, render_profile, stored_profile
+from forecast_cache import ForecastCache, forecast_key
+from mining import MiningQueueFullError, create_mining_executor
+from singleflight import SingleFlight
+from story_storage import StaleStoryIndexError, StoryStore, index_chapters
+from summaries import StoryContextBuilder, SummaryStore, text_hash
+from telemetry import (
+    generate_duration,
+    inject_trace_context,
+    record_llm_sizes,
+    setup_otel,
+    shutdown_otel,
+    traced_stage,
+    track_in_flight,
+)
+from utils import create_chroma_client, get_template_from_dynamo, load_config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +52,8 @@ class StoryUploadRequest(BaseModel):
     bucket_name: str
     username: str
     story_text_hash: str
+    # lets the upload start a speculative forecast with this novel's templates
+    novel_name: str | None = None
 
 
 class EntityAddRequest(BaseModel):
@@ -59,16 +84,43 @@ class AppState:
     s3_client = None
     prompt_templates_table = None
     chroma_collection = None
-    llm = None
+    # "forecaster" / "completion" / "summary" -> chat model
+    llms = {}
     lambda_client = None
+    mining_executor = None
+    forecast_cache = None
+    generate_flights = None
+    # endpoint -> AdmissionController
+    admission = {}
+    # runs /api/generate stages within their deadline shares
+    deadline_executor = None
+    # "forecaster" / "completion" -> LatencyTracker, for hedging
+    llm_latency = {}
+    story_context_builder = None
+    entity_graph_store = None
+    story_store = None
     config = None
 
 
 state = AppState()
 
+DEFAULT_LLM_CONFIG = {"model_id": "deepseek.v3-v1:0", "temperature": 0.2}
+
+# Upper bound on `hops` for neighbor lookups
+MAX_GRAPH_HOPS = 3
+
 # --- Initialization ---
 
 
+def _create_llm(llm_config: dict, region: str, client_config: Config) -> ChatBedrockConverse:
+    sampling = {
+        key: llm_config[key] for key in ("temperature", "top_p", "max_tokens") if key in llm_config
+    }
+    return ChatBedrockConverse(
+        model_id=llm_config["model_id"], region_name=region, config=client_config, **sampling
+    )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
@@ -81,10 +133,12 @@ async def lifespan(app: FastAPI):
         # AWS Resources
         state.s3_client = boto3.client("s3", region_name=region)
 
+        # jobs are submitted as asynchronous invocations, which return right away
+        mining_lambda_config = state.config.get("mining", {}).get("lambda", {})
         lambda_client_config = Config(
-            connect_timeout=10, 
-            read_timeout=600,    
-            retries={'max_attempts': 2}
+            connect_timeout=10,
+            read_timeout=mining_lambda_config.get("read_timeout_seconds", 30),
+            retries={"max_attempts": 2},
         )
 
         state.lambda_client = boto3.client("lambda", region_name=region, config=lambda_client_config)
@@ -95,10 +149,7 @@ async def lifespan(app: FastAPI):
 
         # ChromaDB
         try:
-            chroma_client = chromadb.HttpClient(
-                host=state.config.get("chroma").get("remote").get("host"),
-                port=state.config.get("chroma").get("remote").get("port"),
-            )
+            chroma_client = create_chroma_client(state.config.get("chroma"))
             state.chroma_collection = chroma_client.get_or_create_collection(
                 name=state.config.get("chroma").get("default_collection")
             )
@@ -110,10 +161,107 @@ async def lifespan(app: FastAPI):
                 f"Could not connect to ChromaDB: {e}. Vector search features will fail."
             )
 
-        # LLM
-        state.llm = ChatBedrockConverse(
-            model_id="deepseek.v3-v1:0", region_name=region, temperature=0.2
+        # Compressed story objects with a chapter/block index for ranged reads
+        storage_config = state.config.get("story_storage", {})
+        state.story_store = StoryStore(
+            state.s3_client,
+            index_prefix=storage_config.get("index_prefix", "story_indexes/"),
+            compression=storage_config.get("compression", "gzip"),
+            compression_level=storage_config.get("compression_level", 6),
+            block_chars=storage_config.get("block_chars", 65536),
+        )
+
+        # Entity mining backend (Lambda or local process pool)
+        state.mining_executor = create_mining_executor(state.config, state.lambda_client)
+        logger.info(f"Using '{state.mining_executor.backend}' entity mining backend.")
+
+        # Speculative forecasts computed right after a story upload
+        speculative_config = state.config.get("speculative_forecast", {})
+        if speculative_config.get("enabled", False):
+            state.forecast_cache = ForecastCache(
+                ttl_seconds=speculative_config.get("ttl_seconds", 900),
+                max_entries=speculative_config.get("max_entries", 256),
+            )
+
+        # Identical concurrent /api/generate requests share one generation
+        coalescing_config = state.config.get("generate_coalescing", {})
+        if coalescing_config.get("enabled", False):
+            state.generate_flights = SingleFlight(
+                reuse_seconds=coalescing_config.get("reuse_window_seconds", 5),
+                max_entries=coalescing_config.get("max_entries", 256),
+            )
+
+        # Concurrency limits and wait queues for the LLM-heavy endpoints
+        admission_config = state.config.get("admission", {})
+        if admission_config.get("enabled", False):
+            state.admission = {
+                endpoint: AdmissionController(endpoint, **limits)
+                for endpoint, limits in admission_config.get("endpoints", {}).items()
+            }
+
+        # LLMs, one per pipeline stage (aws.forecaster_llm / story_completion_llm / summary_llm)
+        bedrock_client_config = aws_config.get("bedrock_client", {})
+        bedrock_config = Config(
+            connect_timeout=bedrock_client_config.get("connect_timeout_seconds", 10),
+            read_timeout=bedrock_client_config.get("read_timeout_seconds", 120),
+            retries={"max_attempts": bedrock_client_config.get("max_attempts", 2)},
         )
+        completion_llm_config = aws_config.get("story_completion_llm", DEFAULT_LLM_CONFIG)
+        state.llms = {
+            "forecaster": _create_llm(
+                aws_config.get("forecaster_llm", completion_llm_config), region, bedrock_config
+            ),
+            "completion": _create_llm(completion_llm_config, region, bedrock_config),
+            "summary": _create_llm(
+                aws_config.get("summary_llm", completion_llm_config), region, bedrock_config
+            ),
+        }
+
+        # Per-request deadline for /api/generate, optionally with hedged LLM calls
+        deadline_config = state.config.get("deadlines", {})
+        if deadline_config.get("enabled", False):
+            state.deadline_executor = DeadlineExecutor(
+                deadline_config.get("max_workers", 16), deadline_config.get("max_abandoned_calls")
+            )
+            hedging_config = deadline_config.get("hedging", {})
+            if hedging_config.get("enabled", False):
+                state.llm_latency = {
+                    stage: LatencyTracker(
+                        window=hedging_config.get("window", 100),
+                        percentile=hedging_config.get("percentile", 0.95),
+                        min_samples=hedging_config.get("min_samples", 20),
+                    )
+                    for stage in ("forecaster", "completion")
+                }
+
+        # Bounded completion context built from cached chunk/chapter/book summaries
+        story_context_config = state.config.get("story_context", {})
+        if story_context_config.get("enabled", False):
+            state.story_context_builder = StoryContextBuilder(
+                state.llms["summary"],
+                SummaryStore(
+                    state.s3_client,
+                    bucket=story_context_config.get(
+                        "summary_bucket", aws_config.get("bucket_name")
+                    ),
+                    prefix=story_context_config.get("summary_prefix", "summaries/"),
+                ),
+                max_tokens=story_context_config.get("max_tokens", 4000),
+                recent_text_tokens=story_context_config.get("recent_text_tokens", 1500),
+                summary_max_words=story_context_config.get("summary_max_words"),
+                max_workers=story_context_config.get("max_workers", 8),
+            )
+
+        # Per-novel relationship graphs written by the entity miner
+        entity_graph_config = state.config.get("entity_graph", {})
+        if entity_graph_config.get("enabled", False):
+            state.entity_graph_store = EntityGraphStore(
+                state.s3_client,
+                bucket=aws_config.get("bucket_name"),
+                prefix=entity_graph_config.get("prefix", "entity_graphs/"),
+                ttl_seconds=entity_graph_config.get("cache_ttl_seconds", 300),
+                miss_ttl_seconds=entity_graph_config.get("miss_cache_ttl_seconds", 10),
+            )
 
         logger.info("Resources initialized successfully.")
     except Exception as e:
@@ -122,8 +270,20 @@ async def lifespan(app: FastAPI):
 
     yield
 
+    # Shutdown
+    if state.mining_executor:
+        state.mining_executor.shutdown()
+    if state.deadline_executor:
+        state.deadline_executor.shutdown()
+    shutdown_otel()
+
+
+setup_otel()
 
 app = FastAPI(lifespan=lifespan, title="NovelWriter API")
+# compressed responses for clients that send Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+FastAPIInstrumentor.instrument_app(app)
 
 # --- Endpoints ---
 
@@ -132,31 +292,132 @@ app = FastAPI(lifespan=lifespan, title="NovelWriter API")
 async def get_story(bucket: str, object_key: str):
     """Fetches a story object from an S3 bucket."""
     try:
-        response = state.s3_client.get_object(Bucket=bucket, Key=object_key)
-        content = response["Body"].read().decode("utf-8")
+        content = state.story_store.read_all(bucket, object_key)
         return {"content": content}
-    except state.s3_client.exceptions.NoSuchKey:
+    except state.s3_client.exceptions.NoSuchKey as e:
         raise HTTPException(
             status_code=404,
             detail=f"Object '{object_key}' not found in bucket '{bucket}'",
-        )
+        ) from e
     except Exception as e:
         logger.error(f"S3 Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+def _story_index(bucket: str, object_key: str) -> tuple[dict, str | None]:
+    """The story's index and, for stories uploaded without one, the full text it was
+    built from; their index is written then, so later requests use ranged reads."""
+    index = state.story_store.load_index(bucket, object_key)
+    if index is not None:
+        return index, None
+    return state.story_store.index_existing(bucket, object_key)
+
+
+@app.get("/api/story/index")
+async def get_story_index(bucket: str, object_key: str):
+    """Lists a story's chapters with their character offsets."""
+    try:
+        index, _ = _story_index(bucket, object_key)
+    except state.s3_client.exceptions.NoSuchKey as e:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Object '{object_key}' not found in bucket '{bucket}'",
+        ) from e
+    except Exception as e:
+        logger.error(f"S3 Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+    chapters = [
+        {"chapter": i, "title": c["title"], "start": c["start"], "end": c["end"]}
+        for i, c in enumerate(index["chapters"])
+    ]
+    return {"length": index["length"], "chapters": chapters}
+
+
+@app.get("/api/story/page")
+async def get_story_page(
+    bucket: str,
+    object_key: str,
+    chapter: int | None = None,
+    start: int | None = None,
+    end: int | None = None,
+):
+    """Reads one chapter, or the characters [start, end), of a story.
+
+    Only the compressed blocks holding the window are fetched (S3 byte-range reads).
+    Windows are capped at `story_storage.max_page_chars`; `next_start` continues a read."""
+    if (chapter is None) == (start is None):
+        raise HTTPException(status_code=400, detail="Pass either 'chapter' or 'start'")
+    max_page_chars = state.config.get("story_storage", {}).get("max_page_chars", 200000)
+
+    try:
+        index, content = _story_index(bucket, object_key)
+        title = None
+        if chapter is not None:
+            if not 0 <= chapter < len(index["chapters"]):
+                raise HTTPException(
+                    status_code=404, detail=f"Chapter {chapter} not found in '{object_key}'"
+                )
+            start, end = index["chapters"][chapter]["start"], index["chapters"][chapter]["end"]
+            title = index["chapters"][chapter]["title"]
+        start = max(0, start)
+        end = min(index["length"] if end is None else end, start + max_page_chars)
+        if end < start:
+            raise HTTPException(status_code=400, detail="'end' must not be before 'start'")
+
+        if content is None:
+            try:
+                page = state.story_store.read_range(bucket, object_key, index, start, end)
+            except StaleStoryIndexError:
+                index, content = state.story_store.index_existing(bucket, object_key)
+        if content is not None:
+            page = content[start:end]
+    except HTTPException:
+        raise
+    except state.s3_client.exceptions.NoSuchKey as e:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Object '{object_key}' not found in bucket '{bucket}'",
+        ) from e
+    except Exception as e:
+        logger.error(f"S3 Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+    end = start + len(page)
+    return {
+        "content": page,
+        "chapter": chapter,
+        "title": title,
+        "start": start,
+        "end": end,
+        "length": index["length"],
+        "next_start": end if end < index["length"] else None,
+    }
 
 
 @app.post("/api/story")
-async def upload_story(request: StoryUploadRequest):
-    """Uploads a story object to an S3 bucket."""
+async def upload_story(request: StoryUploadRequest, background_tasks: BackgroundTasks):
+    """Uploads a story object to an S3 bucket, compressed as set by `story_storage`,
+    along with its chapter index.
+
+    With speculative forecasting enabled and a `novel_name` given, the vector search and
+    forecaster for the latest fragment run in the background after the response, so a
+    following `/api/generate` for the same content can go straight to completion."""
     story_text_hash = hashlib.sha256(request.text.encode("utf-8")).hexdigest()
     try:
-        state.s3_client.put_object(
-            Bucket=request.bucket_name,
-            Key=request.filepath,
-            Body=request.text,
-            ContentType="plain/text",
-            Metadata={"username": request.username, "story_text_hash": story_text_hash},
+        state.story_store.write(
+            request.bucket_name,
+            request.filepath,
+            request.text,
+            metadata={"username": request.username, "story_text_hash": story_text_hash},
         )
+        if state.forecast_cache and request.novel_name:
+            background_tasks.add_task(
+                _admitted_speculative_forecast,
+                request.text,
+                request.novel_name,
+                request.username,
+            )
         return {"message": "Story uploaded successfully", "path": request.filepath}
     except Exception as e:
         logger.error(f"S3 Upload Error: {e}")
@@ -167,7 +428,7 @@ async def upload_story(request: StoryUploadRequest):
 async def get_prompt_template(novel_name: str, template_type: str):
     """Fetches prompt templates from DynamoDB."""
     try:
-        item = get_template_from_dynamo(novel_name, template_type)
+        item = get_template_from_dynamo(state.prompt_templates_table, novel_name, template_type)
         return item
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -213,14 +474,27 @@ async def add_entity(request: EntityAddRequest):
         raise HTTPException(status_code=503, detail="ChromaDB service unavailable")
 
     try:
-        document_text = f"{request.entity}: {request.description}\nRelations: {request.key_relations}\nHistory: {request.history}"
+        # only the name and description are embedded; the rest is kept with the entry
+        document_text = f"{request.entity}: {request.description}"
+        profile = {
+            "name": request.entity,
+            "description": request.description,
+            "key_relations": request.key_relations,
+            "history": request.history,
+        }
 
         # TODO: Change to use a more robust ID generation strategy
         doc_id = f"{request.entity}-{datetime.now().timestamp()}"
 
         state.chroma_collection.add(
             documents=[document_text],
-            metadatas=[{"source": "manual_entry", "entity": request.entity}],
+            metadatas=[
+                {
+                    "source": "manual_entry",
+                    "entity": request.entity,
+                    "profile_json": json.dumps(profile),
+                }
+            ],
             ids=[doc_id],
         )
         return {"message": "Entity added successfully", "id": doc_id}
@@ -229,146 +503,716 @@ async def add_entity(request: EntityAddRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _client(request: Request) -> str:
+    """The identity admission limits are keyed on: the client's address as seen by the
+    `admission.trusted_proxy_hops` proxies in front of the server, never a client-sent name."""
+    trusted_proxies = state.config.get("admission", {}).get("trusted_proxy_hops", 0)
+    peer = request.client.host if request.client else None
+    return client_address(peer, request.headers.get("x-forwarded-for"), trusted_proxies)
+
+
+def _rejection(e: AdmissionRejectedError) -> HTTPException:
+    logger.warning(str(e))
+    return HTTPException(
+        status_code=e.status_code,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+@asynccontextmanager
+async def _admitted(endpoint: str, client: str):
+    """Holds a slot of the endpoint's admission controller, if it has one.
+
+    Rejected requests get the controller's status (429/503) with a Retry-After header."""
+    controller = state.admission.get(endpoint)
+    if controller is None:
+        yield
+        return
+    try:
+        await controller.acquire(client)
+    except AdmissionRejectedError as e:
+        raise _rejection(e) from e
+    try:
+        yield
+    finally:
+        controller.release()
+
+
+@contextmanager
+def _admitted_from_thread(endpoint: str, client: str):
+    """`_admitted` for code running in the threadpool; the controller stays on the event loop."""
+    controller = state.admission.get(endpoint)
+    if controller is None:
+        yield
+        return
+    try:
+        from_thread.run(controller.acquire, client)
+    except AdmissionRejectedError as e:
+        raise _rejection(e) from e
+    try:
+        yield
+    finally:
+        from_thread.run_sync(controller.release)
+
+
+@app.get("/api/admission")
+async def get_admission():
+    """Running and queued requests, and rejections so far, per admission-controlled endpoint."""
+    return {endpoint: controller.stats() for endpoint, controller in state.admission.items()}
+
+
 @app.post("/api/mine_entities")
-async def mine_entities(request: MineEntitiesRequest):
-    """Mines entities from story text using the entity-miner Lambda function.
-    
-    This is an asynchronous invocation that does not for the Lambda function to complete.
-    Need to find a way for the frontend to indicate that the process is running."""
-    if not state.lambda_client:
-        raise HTTPException(status_code=503, detail="Lambda service unavailable")
-    
-    function_name = "entity-miner" 
+async def mine_entities(request: MineEntitiesRequest, http_request: Request):
+    """Mines entities from story text using the configured mining backend.
+
+    With the Lambda backend this is an asynchronous invocation that does not wait for
+    the Lambda function to complete. The local backend queues the job on a process pool
+    and its progress can be polled through `GET /api/mine_entities/{job_id}`.
+
+    The `admission.endpoints.mine_entities` limit only covers submitting the job; how many
+    jobs mine at once is bounded by the local backend's `max_workers` and `max_queue_size`,
+    or by the Lambda function's concurrency. The per-user queue limit is keyed on the
+    client's address (see `_client`)."""
+    if not state.mining_executor:
+        raise HTTPException(status_code=503, detail="Entity mining service unavailable")
+
+    async with _admitted("mine_entities", _client(http_request)):
+        return await run_in_threadpool(_submit_mining_job, request)
+
+
+def _submit_mining_job(request: MineEntitiesRequest) -> dict:
     payload = {
         "text": request.story_text,
         "novel_name": request.novel_name,
         "username": request.username,
+        # lets the miner's spans join this request's trace
+        "trace_context": inject_trace_context(),
     }
-    
+
     try:
-        logger.info(f"Invoking Lambda function '{function_name}' from the 'Analyse Story' button...")
-        response = state.lambda_client.invoke(
-            FunctionName=function_name,
-            InvocationType="Event",  
-            Payload=json.dumps(payload)   
+        logger.info(
+            f"Submitting entity mining job to the '{state.mining_executor.backend}' backend "
+            "from the 'Analyse Story' button..."
         )
-        
-        # Check status code from Lambda response
-        status_code = response.get("StatusCode")
-        if status_code != 202:
-            logger.error(f"Lambda invocation returned status code: {status_code}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Lambda invocation failed with status code: {status_code}"
-            )
-        
-        logger.info("Lambda function invoked successfully")
-        
+        with track_in_flight("mine_entities"):
+            job_id = state.mining_executor.submit(payload)
+        logger.info(f"Entity mining job {job_id} submitted successfully")
+
         return {
             "status": "success",
-            "message": "Lambda function invoked successfully",
+            "message": "Entity mining job submitted successfully",
+            "backend": state.mining_executor.backend,
+            "job_id": job_id,
         }
-        
+
+    except MiningQueueFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e)) from e
     except state.lambda_client.exceptions.ResourceNotFoundException:
-        logger.error(f"Lambda function '{function_name}' not found")
+        logger.error("Entity miner Lambda function not found")
+        raise HTTPException(status_code=404, detail="Entity miner Lambda function not found")
+    except Exception as e:
+        logger.error(f"Entity mining submission error: {e}")
+        raise HTTPException(
+            status_code=500, detail=f"Failed to submit entity mining job: {str(e)}"
+        )
+
+
+@app.get("/api/mine_entities/{job_id}")
+async def get_mining_job(job_id: str):
+    """Returns the status (and result, once finished) of a locally executed mining job."""
+    if not state.mining_executor:
+        raise HTTPException(status_code=503, detail="Entity mining service unavailable")
+
+    job = state.mining_executor.get_job(job_id)
+    if job is None:
         raise HTTPException(
             status_code=404,
-            detail=f"Lambda function '{function_name}' not found"
+            detail=f"Mining job '{job_id}' not found on the '{state.mining_executor.backend}' backend",
         )
+    return job
+
+
+@app.get("/api/entity_graph/neighbors")
+async def get_entity_neighbors(
+    novel_name: str,
+    entity: str,
+    username: str = "default_user",
+    hops: int = 1,
+    limit: int = 50,
+):
+    """Returns the entities within `hops` relationships of `entity` and the edges between them."""
+    if not state.entity_graph_store:
+        raise HTTPException(status_code=503, detail="Entity graph service unavailable")
+    if not 1 <= hops <= MAX_GRAPH_HOPS:
+        raise HTTPException(status_code=400, detail=f"hops must be between 1 and {MAX_GRAPH_HOPS}")
+
+    try:
+        graph = state.entity_graph_store.get(f"{username}-{novel_name}")
     except Exception as e:
-        logger.error(f"Lambda invocation error: {e}")
+        logger.error(f"Entity graph load error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if graph is None:
+        raise HTTPException(status_code=404, detail=f"No entity graph for novel '{novel_name}' yet")
+
+    result = graph.neighbors(entity, hops=hops, limit=limit)
+    if result is None:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to invoke Lambda function: {str(e)}"
+            status_code=404, detail=f"Entity '{entity}' not found in the graph of '{novel_name}'"
         )
+    neighbors, edges = result
+    return {"entity": graph.canonical_name(entity), "neighbors": neighbors, "edges": edges}
 
 
 @app.get("/api/generate")
-async def generate_story(bucket: str, story_key: str, novel_name: str = "first novel"):
+async def generate_story(
+    request: Request,
+    bucket: str,
+    story_key: str,
+    novel_name: str = "first novel",
+    username: str = "default_user",
+):
     """
     Generates a story continuation.
     1. Fetches current story from S3.
     2. Retrieves templates (Forecaster & Completion).
-    3. Runs Forecaster chain (Vector Search + LLM).
+    3. Runs Forecaster chain (Vector Search + graph neighbors + LLM).
     4. Runs Completion chain (LLM).
+
+    Requests for the same story text, novel, user and template versions that arrive while
+    one is running (or within `generate_coalescing.reuse_window_seconds` after it) get that
+    request's result, with `coalesced` set.
+
+    Concurrent generations are limited by `admission.endpoints.generate`, per client
+    address (see `_client`); requests beyond the limit and its wait queue get a 429/503 with
+    Retry-After. Only the request that runs a generation holds a slot, not those joining it.
     """
-    if not state.llm:
+    if not state.llms:
         raise HTTPException(status_code=503, detail="LLM service unavailable")
 
-    # 1. Fetch Story
-    try:
-        s3_response = state.s3_client.get_object(Bucket=bucket, Key=story_key)
-        story_content = s3_response["Body"].read().decode("utf-8")
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Could not fetch story: {e}")
-
-    # 2. Prepare Text Splitter & Docs
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2048,
-        chunk_overlap=256,
-        length_function=len,
-        is_separator_regex=False,
-    )
-    docs = text_splitter.create_documents([story_content])
-    if not docs:
-        raise HTTPException(
-            status_code=400, detail="Story content is empty or could not be split."
+    client = _client(request)
+    start = time.perf_counter()
+    outcome = "error"
+    coalesced = False
+    with track_in_flight("generate"):
+        try:
+            result = await run_in_threadpool(
+                _generate_story, bucket, story_key, novel_name, username, client
+            )
+            coalesced = result["coalesced"]
+            outcome = "ok"
+            return result
+        finally:
+            generate_duration.record(
+                time.perf_counter() - start, {"outcome": outcome, "coalesced": coalesced}
+            )
+
+
+def _tail_chars() -> int:
+    return state.config.get("story_storage", {}).get("tail_chars", 8192)
+
+
+def _split_story(story_content: str, with_context: bool = True) -> tuple[str, str]:
+    """Returns the current fragment (last chunk) and the context fragment of a story.
+
+    The current fragment is the last chunk of the story's tail (`story_storage.tail_chars`),
+    so it is the same whether the whole story or only its tail was read. `story_content`
+    may be just the tail when `with_context` is False.
+    """
+    with traced_stage("split") as span:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=2048,
+            chunk_overlap=256,
+            length_function=len,
+            is_separator_regex=False,
+        )
+        tail_docs = text_splitter.create_documents([story_content[-_tail_chars() :]])
+        if not tail_docs:
+            raise HTTPException(
+                status_code=400, detail="Story content is empty or could not be split."
+            )
+        current_fragment = tail_docs[-1].page_content
+
+        context_fragment = ""
+        if with_context:
+            docs = text_splitter.create_documents([story_content])
+            span.set_attribute("story.chunks", len(docs))
+            context_fragment = (
+                "\n".join([doc.page_content for doc in docs[:-3]]) if len(docs) > 3 else ""
+            )
+    return current_fragment, context_fragment
+
+
+def _fetch_templates(novel_name: str, *template_types: str) -> list[dict]:
+    with traced_stage("template_fetch", **{"novel.name": novel_name}):
+        try:
+            return [
+                get_template_from_dynamo(state.prompt_templates_table, novel_name, template_type)
+                for template_type in template_types
+            ]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to fetch templates: {e}")
+
+
+def _hit_entity_name(document: str, metadata: dict | None) -> str | None:
+    """The entity a vector search hit describes, from its metadata or its stored profile."""
+    metadata = metadata or {}
+    name = metadata.get("entity_name") or metadata.get("entity")
+    if name:
+        return name
+    profile = stored_profile(document, metadata)
+    return profile_entity_name(profile) if profile else None
+
+
+def _render_hits(documents: list[str], metadatas: list[dict] | None) -> list[str]:
+    """Token-budgeted summaries of Chroma entries (`vector_search.max_tokens_per_hit`)."""
+    max_tokens = state.config.get("vector_search", {}).get("max_tokens_per_hit", 200)
+    metadatas = metadatas or [None] * len(documents)
+    return [
+        render_profile(document, metadata, max_tokens)
+        for document, metadata in zip(documents, metadatas, strict=True)
+    ]
+
+
+def _expand_with_graph(results: dict, graph_name: str) -> str:
+    """Neighbors of the vector search hits in the novel's relationship graph.
+
+    Adds the relationships between the hits and their neighbors, and the neighbors'
+    stored profiles; no LLM calls are involved.
+    """
+    graph_config = state.config.get("entity_graph", {})
+    graph = state.entity_graph_store.get(graph_name)
+    if graph is None:
+        return ""
+
+    documents = results["documents"][0]
+    metadatas = results["metadatas"][0] if results.get("metadatas") else [None] * len(documents)
+    hit_names = {
+        name
+        for name in (_hit_entity_name(d, m) for d, m in zip(documents, metadatas, strict=True))
+        if name
+    }
+    hit_keys = {name.casefold() for name in hit_names}
+
+    max_neighbors = graph_config.get("max_neighbors", 5)
+    neighbor_names, edges = [], []
+    for name in sorted(hit_names):
+        result = graph.neighbors(name, hops=graph_config.get("expand_hops", 1))
+        if result is None:
+            continue
+        for neighbor in result[0]:
+            if len(neighbor_names) >= max_neighbors:
+                break
+            if neighbor["name"].casefold() not in hit_keys | {n.casefold() for n in neighbor_names}:
+                neighbor_names.append(neighbor["name"])
+        edges.extend(e for e in result[1] if e not in edges)
+
+    sections = []
+    if edges:
+        sections.append(
+            "Relationships:\n"
+            + "\n".join(
+                f"{e['source']} --{e['relation_type']}--> {e['target']}: {e['dynamics']}"
+                for e in edges
+            )
         )
+    if neighbor_names and state.chroma_collection:
+        related = state.chroma_collection.get(where={"entity_name": {"$in": neighbor_names}})
+        if related and related["documents"]:
+            rendered = _render_hits(related["documents"], related.get("metadatas"))
+            sections.append("Related entities:\n" + "\n\n".join(rendered))
+    return "\n\n".join(sections)
+
+
+def _new_deadline() -> Deadline | None:
+    if not state.deadline_executor:
+        return None
+    deadline_config = state.config.get("deadlines", {})
+    return Deadline(deadline_config.get("budget_seconds", 120), deadline_config.get("stage_shares"))
+
+
+def _run_within(
+    deadline: Deadline | None,
+    stage: str,
+    fn,
+    reserved: tuple[str, ...] = (),
+    capped: bool = True,
+):
+    """Runs one stage's call within its share of `deadline` (without a limit if None), or
+    within all the time that is left with `capped=False`.
 
-    current_fragment = docs[-1].page_content
-    context_fragment = (
-        "\n".join([doc.page_content for doc in docs[:-3]]) if len(docs) > 3 else ""
+    Raises StageTimeoutError if the share is already spent or runs out. LLM stages with a
+    latency tracker get a hedged second call once they pass the tracked percentile; the
+    tracker is fed the first call's latency, or the budget when it timed out.
+    """
+    if deadline is None:
+        return fn()
+    budget = deadline.stage_budget(stage, reserved, capped=capped)
+    if budget <= 0:
+        raise StageTimeoutError(f"No time left in the deadline for {stage}")
+    tracker = state.llm_latency.get(stage)
+    hedge_after = tracker.threshold() if tracker else None
+
+    span = trace.get_current_span()
+    span.set_attribute("deadline.budget_seconds", budget)
+    span.set_attribute("deadline.abandoned_calls", state.deadline_executor.abandoned)
+    result, hedged = state.deadline_executor.call(
+        fn, budget, hedge_after=hedge_after, tracker=tracker
     )
+    span.set_attribute("deadline.hedged", hedged)
+    return result
+
+
+def _degrade(degraded: list[str] | None, stage: str) -> None:
+    if degraded is not None and stage not in degraded:
+        degraded.append(stage)
 
-    # 3. Fetch Templates
-    try:
-        forecaster_data = get_template_from_dynamo(novel_name, "forecaster")
-        completion_data = get_template_from_dynamo(novel_name, "novel_completion")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch templates: {e}")
 
+def _run_forecaster(
+    current_fragment: str,
+    forecaster_data: dict,
+    graph_name: str | None = None,
+    deadline: Deadline | None = None,
+    degraded: list[str] | None = None,
+) -> str:
+    """Vector search for the fragment's entities, then the forecaster chain.
+
+    With a `graph_name`, the hits are expanded with their neighbors in that novel's
+    relationship graph. Steps that fail or (with a `deadline`) run out of their share are
+    skipped and added to `degraded`; without the forecaster the response is empty.
+    """
     forecaster_prompt = PromptTemplate.from_template(forecaster_data["prompt_template"])
-    completion_prompt = PromptTemplate.from_template(completion_data["prompt_template"])
 
-    # 4. Run Forecaster
-    # Vector Search for context
     vector_search_results = ""
+    results = None
     if state.chroma_collection:
+        with traced_stage("vector_search") as span:
+            try:
+                results = _run_within(
+                    deadline,
+                    "vector_search",
+                    lambda: state.chroma_collection.query(
+                        query_texts=[current_fragment], n_results=3
+                    ),
+                    reserved=("forecaster", "completion"),
+                )
+                if results and results["documents"]:
+                    vector_search_results = "\n\n".join(
+                        _render_hits(
+                            results["documents"][0],
+                            results["metadatas"][0] if results.get("metadatas") else None,
+                        )
+                    )
+                    span.set_attribute("vector_search.hits", len(results["documents"][0]))
+                    span.set_attribute("vector_search.rendered_chars", len(vector_search_results))
+            except StageTimeoutError as e:
+                logger.warning(f"Skipping vector search: {e}")
+                _degrade(degraded, "vector_search")
+            except Exception as e:
+                span.record_exception(e)
+                logger.warning(f"Vector search failed during generation: {e}")
+                _degrade(degraded, "vector_search")
+
+    if vector_search_results and graph_name and state.entity_graph_store:
+        with traced_stage("graph_expansion", **{"entity_graph.name": graph_name}) as span:
+            try:
+                graph_results = _run_within(
+                    deadline,
+                    "graph_expansion",
+                    lambda: _expand_with_graph(results, graph_name),
+                    reserved=("forecaster", "completion"),
+                )
+                span.set_attribute("entity_graph.expanded", bool(graph_results))
+                if graph_results:
+                    vector_search_results = f"{vector_search_results}\n\n{graph_results}"
+            except StageTimeoutError as e:
+                logger.warning(f"Skipping graph expansion: {e}")
+                _degrade(degraded, "graph_expansion")
+            except Exception as e:
+                span.record_exception(e)
+                logger.warning(f"Graph expansion failed during generation: {e}")
+                _degrade(degraded, "graph_expansion")
+
+    forecaster_llm = state.llms["forecaster"]
+    forecaster_chain = forecaster_prompt | forecaster_llm | StrOutputParser()
+    forecaster_inputs = {
+        "vector_search_results": vector_search_results,
+        "current_story_fragment": current_fragment,
+    }
+
+    with traced_stage(
+        "forecaster_llm", **{"gen_ai.request.model": forecaster_llm.model_id}
+    ) as span:
+        forecaster_response = None
         try:
-            results = state.chroma_collection.query(
-                query_texts=[current_fragment], n_results=3
+            forecaster_response = _run_within(
+                deadline,
+                "forecaster",
+                lambda: forecaster_chain.invoke(forecaster_inputs),
+                reserved=("completion",),
             )
-            if results and results["documents"]:
-                vector_search_results = "\n".join(results["documents"][0])
+        except StageTimeoutError as e:
+            logger.warning(f"Skipping forecaster: {e}")
+            _degrade(degraded, "forecaster")
+            forecaster_response = ""
         except Exception as e:
-            logger.warning(f"Vector search failed during generation: {e}")
+            raise HTTPException(status_code=500, detail=f"Forecaster chain failed: {e}")
+        finally:
+            record_llm_sizes(
+                span,
+                "forecaster",
+                forecaster_prompt.format(**forecaster_inputs),
+                forecaster_response,
+            )
+    return forecaster_response
 
-    forecaster_chain = forecaster_prompt | state.llm | StrOutputParser()
 
-    try:
-        forecaster_response = forecaster_chain.invoke(
-            {
-                "vector_search_results": vector_search_results,
-                "current_story_fragment": current_fragment,
-            }
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Forecaster chain failed: {e}")
+async def _admitted_speculative_forecast(
+    story_content: str, novel_name: str, username: str
+) -> None:
+    """Background task: runs `_speculative_forecast` in a free `generate` admission slot.
 
-    # 5. Run Completion
-    completion_chain = completion_prompt | state.llm | StrOutputParser()
+    The forecast makes the same LLM calls as a generation, so it counts against the same
+    limit; it is only an optimization, so it is skipped rather than queued when no slot is
+    free."""
+    controller = state.admission.get("generate")
+    if controller is None:
+        await run_in_threadpool(_speculative_forecast, story_content, novel_name, username)
+        return
+    with controller.admit_if_free() as admitted:
+        if not admitted:
+            logger.info(f"Skipping speculative forecast for '{novel_name}': generate is busy")
+            return
+        await run_in_threadpool(_speculative_forecast, story_content, novel_name, username)
 
-    try:
-        completion_response = completion_chain.invoke(
-            {
-                "current_story_fragment": context_fragment,
-                "forecaster_response": forecaster_response,
-            }
+
+def _speculative_forecast(story_content: str, novel_name: str, username: str) -> None:
+    """Background task: precomputes the forecast for the latest fragment of an upload."""
+    with traced_stage("speculative_forecast", **{"novel.name": novel_name}) as span:
+        try:
+            current_fragment, _ = _split_story(story_content, with_context=False)
+            (forecaster_data,) = _fetch_templates(novel_name, "forecaster")
+        except HTTPException as e:
+            logger.warning(f"Skipping speculative forecast for '{novel_name}': {e.detail}")
+            return
+
+        key = forecast_key(current_fragment, username, novel_name, forecaster_data)
+        if not state.forecast_cache.claim(key):
+            span.set_attribute("forecast_cache.already_available", True)
+            return
+
+        try:
+            state.forecast_cache.put(
+                key,
+                _run_forecaster(
+                    current_fragment, forecaster_data, graph_name=f"{username}-{novel_name}"
+                ),
+            )
+        except Exception as e:
+            state.forecast_cache.release(key)
+            detail = e.detail if isinstance(e, HTTPException) else e
+            logger.warning(f"Speculative forecast for '{novel_name}' failed: {detail}")
+
+
+def _fetch_story(bucket: str, story_key: str) -> tuple[str | None, dict | None]:
+    """Returns the full story text, or (when the story has an index and the completion
+    context comes from summaries) only its tail and the index."""
+    with traced_stage("s3_fetch", **{"s3.bucket": bucket, "s3.key": story_key}) as span:
+        try:
+            index = None
+            if state.story_context_builder:
+                index = state.story_store.load_index(bucket, story_key)
+            if index is not None:
+                try:
+                    tail = state.story_store.read_range(
+                        bucket, story_key, index, index["length"] - _tail_chars(), index["length"]
+                    )
+                    span.set_attribute("story.length", index["length"])
+                    span.set_attribute("story.read_length", len(tail))
+                    return tail, index
+                except StaleStoryIndexError as e:
+                    logger.warning(f"{e}; reading the whole story")
+            if state.story_context_builder:
+                # no index or a stale one: index the story now for the next request
+                _, story_content = state.story_store.index_existing(bucket, story_key)
+            else:
+                story_content = state.story_store.read_all(bucket, story_key)
+            span.set_attribute("story.length", len(story_content))
+            span.set_attribute("story.read_length", len(story_content))
+            return story_content, None
+        except Exception as e:
+            raise HTTPException(status_code=404, detail=f"Could not fetch story: {e}")
+
+
+def _build_story_context(bucket: str, story_key: str, story_content: str, index: dict | None):
+    """Completion context from summaries; with an index, chapters are read only when needed."""
+    with traced_stage("story_context") as span:
+        try:
+            if index is None:
+                context, stats = state.story_context_builder.build(story_content)
+            else:
+                context, stats = state.story_context_builder.build_from_chapters(
+                    index_chapters(index),
+                    lambda chapters: state.story_store.read_chapters(
+                        bucket, story_key, index, chapters
+                    ),
+                )
+        except StaleStoryIndexError as e:
+            logger.warning(f"{e}; reading the whole story")
+            story_content = state.story_store.read_all(bucket, story_key)
+            context, stats = state.story_context_builder.build(story_content)
+        for key, value in stats.items():
+            span.set_attribute(f"story_context.{key}", value)
+        return context
+
+
+def _generation_key(
+    story_hash: str, novel_name: str, username: str, forecaster_data: dict, completion_data: dict
+) -> str:
+    """Coalescing key for a generation: the story text's hash plus the template versions."""
+    return (
+        f"{username}:{novel_name}:{forecaster_data.get('version', '')}:"
+        f"{completion_data.get('version', '')}:{story_hash}"
+    )
+
+
+def _generate_story(
+    bucket: str, story_key: str, novel_name: str, username: str, client: str
+) -> dict:
+    # 1. Fetch Story (only the tail, when it has an index)
+    story_content, index = _fetch_story(bucket, story_key)
+
+    # 2. Fetch Templates
+    forecaster_data, completion_data = _fetch_templates(
+        novel_name, "forecaster", "novel_completion"
+    )
+
+    def generate():
+        # admitted here, so requests joining this generation do not take slots of their own
+        with _admitted_from_thread("generate", client):
+            return _run_generation(
+                bucket,
+                story_key,
+                novel_name,
+                username,
+                story_content,
+                index,
+                forecaster_data,
+                completion_data,
+                _new_deadline(),
+            )
+
+    if not state.generate_flights:
+        return generate() | {"coalesced": False}
+
+    # 3. Join an identical generation that is running or has just finished
+    if index is not None:
+        story_hash = index.get("text_hash") or index["etag"]
+    else:
+        story_hash = text_hash(story_content)
+    key = _generation_key(story_hash, novel_name, username, forecaster_data, completion_data)
+    result, coalesced = state.generate_flights.do(key, generate)
+    return result | {"coalesced": coalesced}
+
+
+def _run_generation(
+    bucket: str,
+    story_key: str,
+    novel_name: str,
+    username: str,
+    story_content: str,
+    index: dict | None,
+    forecaster_data: dict,
+    completion_data: dict,
+    deadline: Deadline | None,
+) -> dict:
+    # 4. Prepare Text Splitter & Docs
+    current_fragment, context_fragment = _split_story(
+        story_content, with_context=not state.story_context_builder
+    )
+
+    completion_prompt = PromptTemplate.from_template(completion_data["prompt_template"])
+
+    # 5. Run Forecaster (Vector Search + LLM), unless a speculative run already did
+    forecaster_response = None
+    if state.forecast_cache:
+        with traced_stage("forecast_cache") as span:
+            wait_timeout = state.config.get("speculative_forecast", {}).get(
+                "wait_timeout_seconds", 60
+            )
+            if deadline is not None:
+                wait_timeout = min(
+                    wait_timeout, deadline.stage_budget("forecaster", ("completion",))
+                )
+            forecaster_response = state.forecast_cache.get(
+                forecast_key(current_fragment, username, novel_name, forecaster_data),
+                wait_timeout=wait_timeout,
+            )
+            span.set_attribute("forecast_cache.hit", forecaster_response is not None)
+    forecast_cached = forecaster_response is not None
+    degraded_stages = deadline.degraded if deadline else []
+    if not forecast_cached:
+        forecaster_response = _run_forecaster(
+            current_fragment,
+            forecaster_data,
+            graph_name=f"{username}-{novel_name}",
+            deadline=deadline,
+            degraded=degraded_stages,
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Completion chain failed: {e}")
+
+    # 6. Run Completion (with the story's tail as context if the summaries take too long or
+    # fail: they only enrich the context)
+    if state.story_context_builder:
+        try:
+            context_fragment = _run_within(
+                deadline,
+                "story_context",
+                lambda: _build_story_context(bucket, story_key, story_content, index),
+                reserved=("completion",),
+            )
+        except Exception as e:
+            logger.warning(f"Using the story's tail as completion context: {e}")
+            _degrade(degraded_stages, "story_context")
+            context_fragment = story_content[-_tail_chars() :]
+
+    completion_llm = state.llms["completion"]
+    completion_chain = completion_prompt | completion_llm | StrOutputParser()
+    completion_inputs = {
+        "current_story_fragment": context_fragment,
+        "forecaster_response": forecaster_response,
+    }
+
+    with traced_stage(
+        "completion_llm", **{"gen_ai.request.model": completion_llm.model_id}
+    ) as span:
+        completion_response = None
+        try:
+            # the completion is the one stage a generation cannot do without, so it gets
+            # whatever time the earlier stages left rather than only its share
+            completion_response = _run_within(
+                deadline,
+                "completion",
+                lambda: completion_chain.invoke(completion_inputs),
+                capped=False,
+            )
+        except StageTimeoutError as e:
+            raise HTTPException(
+                status_code=504, detail=f"Completion chain timed out: {e}"
+            ) from e
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Completion chain failed: {e}")
+        finally:
+            record_llm_sizes(
+                span,
+                "completion",
+                completion_prompt.format(**completion_inputs),
+                completion_response,
+            )
 
     return {
         "forecaster_response": forecaster_response,
+        "forecast_cached": forecast_cached,
         "story_continuation": completion_response,
+        "degraded_stages": degraded_stages,
     }
@@ -0,0 +1,199 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class MiningQueueFullError(Exception):
+    """Raised when the local mining backend has no free slot for a new job."""
+
+
+class MiningExecutor(ABC):
+    """Submits entity mining jobs.
+
+    A job is the same JSON payload the `entity-miner` Lambda accepts
+    (`text`, `novel_name`, `username`) and its result is the dict returned
+    by `entity_miner.lambda_handler`.
+    """
+
+    backend = None
+
+    @abstractmethod
+    def submit(self, payload: dict) -> str: ...
+
+    def get_job(self, job_id: str) -> dict | None:
+        return None
+
+    def shutdown(self) -> None:  # noqa: B027 - optional hook, nothing to release by default
+        pass
+
+
+class LambdaMiningExecutor(MiningExecutor):
+    backend = "lambda"
+
+    def __init__(self, lambda_client, function_name: str = "entity-miner"):
+        self.lambda_client = lambda_client
+        self.function_name = function_name
+
+    def submit(self, payload: dict) -> str:
+        """Fires an asynchronous ("Event") invocation of the entity-miner Lambda.
+
+        The result is not tracked; the Lambda writes its output to ChromaDB.
+        """
+        logger.info(f"Invoking Lambda function '{self.function_name}'...")
+        response = self.lambda_client.invoke(
+            FunctionName=self.function_name,
+            InvocationType="Event",
+            Payload=json.dumps(payload),
+        )
+
+        status_code = response.get("StatusCode")
+        if status_code != 202:
+            raise RuntimeError(f"Lambda invocation failed with status code: {status_code}")
+
+        return response.get("ResponseMetadata", {}).get("RequestId") or str(uuid.uuid4())
+
+
+def _init_mining_worker(entity_miner_path: str) -> None:
+    # entity_miner.load_config() prefers ./config.json, so run the worker from the
+    # Lambda directory to pick up the miner's config rather than the webserver's.
+    os.chdir(entity_miner_path)
+    if entity_miner_path not in sys.path:
+        sys.path.insert(0, entity_miner_path)
+
+
+def _run_mining_job(payload: dict) -> dict:
+    from entity_miner import lambda_handler
+
+    return lambda_handler(payload, None)
+
+
+class LocalMiningExecutor(MiningExecutor):
+    """Runs `EntityMiningWorkflow` in a local process pool.
+
+    At most `max_workers` jobs run at once and at most `max_queue_size` more
+    wait for a worker; further submissions raise `MiningQueueFullError`.
+    """
+
+    backend = "local"
+
+    def __init__(
+        self,
+        entity_miner_path: str,
+        max_workers: int = 2,
+        max_queue_size: int = 8,
+        max_finished_jobs: int = 100,
+    ):
+        self.entity_miner_path = os.path.abspath(entity_miner_path)
+        if not os.path.exists(os.path.join(self.entity_miner_path, "entity_miner.py")):
+            raise FileNotFoundError(f"entity_miner.py not found in {self.entity_miner_path}")
+
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.max_finished_jobs = max_finished_jobs
+
+        # spawn rather than fork: the parent is running an event loop and threads
+        self.pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_mining_worker,
+            initargs=(self.entity_miner_path,),
+        )
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        self.lock = threading.Lock()
+        self.jobs: dict[str, Future] = {}
+
+    def submit(self, payload: dict) -> str:
+        if not self.slots.acquire(blocking=False):
+            raise MiningQueueFullError(
+                f"Local mining queue is full ({self.max_workers} running, "
+                f"{self.max_queue_size} queued)"
+            )
+
+        try:
+            future = self.pool.submit(_run_mining_job, payload)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+
+        job_id = str(uuid.uuid4())
+        with self.lock:
+            self.jobs[job_id] = future
+            self._evict_finished_jobs()
+        logger.info(f"Queued local mining job {job_id} for '{payload.get('novel_name')}'")
+        return job_id
+
+    def _evict_finished_jobs(self) -> None:
+        finished = [job_id for job_id, future in self.jobs.items() if future.done()]
+        for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def get_job(self, job_id: str) -> dict | None:
+        with self.lock:
+            future = self.jobs.get(job_id)
+        if future is None:
+            return None
+
+        if not future.done():
+            return {"job_id": job_id, "status": "running" if future.running() else "queued"}
+
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"Local mining job {job_id} failed: {e}")
+            result = {"status": "error", "error_type": type(e).__name__, "error_message": str(e)}
+        return {"job_id": job_id, "status": "finished", "result": result}
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _check_local_chroma_mode(config: dict, entity_miner_path: str) -> None:
+    """Rejects embedded Chroma with the local mining backend.
+
+    The webserver and every mining worker are separate processes, and an embedded
+    (`PersistentClient`) Chroma directory must not be opened by more than one process.
+    """
+    miner_config_path = os.path.join(entity_miner_path, "config.json")
+    miner_config = {}
+    if os.path.exists(miner_config_path):
+        with open(miner_config_path) as f:
+            miner_config = json.load(f)
+    for service, service_config in (("webserver", config), ("entity miner", miner_config)):
+        if service_config.get("chroma", {}).get("mode", "http") == "embedded":
+            raise ValueError(
+                f"The {service} uses embedded Chroma, which cannot be shared with the local "
+                "mining backend's worker processes; set chroma.mode to 'http' in both configs"
+            )
+
+
+def create_mining_executor(config: dict, lambda_client=None) -> MiningExecutor:
+    """Builds the mining executor selected by `mining.backend` in config.json."""
+    mining_config = config.get("mining", {})
+    backend = mining_config.get("backend", "lambda")
+
+    if backend == "lambda":
+        lambda_config = mining_config.get("lambda", {})
+        return LambdaMiningExecutor(
+            lambda_client, function_name=lambda_config.get("function_name", "entity-miner")
+        )
+    if backend == "local":
+        local_config = mining_config.get("local", {})
+        entity_miner_path = local_config.get("entity_miner_path", "../lambda")
+        _check_local_chroma_mode(config, entity_miner_path)
+        return LocalMiningExecutor(
+            entity_miner_path=entity_miner_path,
+            max_workers=local_config.get("max_workers", os.cpu_count() or 1),
+            max_queue_size=local_config.get("max_queue_size", 8),
+        )
+
+    raise ValueError(f"Unknown mining backend '{backend}'")
@@ -0,0 +1,75 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key onto one execution.
+
+    The first caller for a key runs the function; callers arriving while it runs wait for it
+    and get the same result (or exception). Successful results are also handed out to callers
+    arriving up to `reuse_seconds` after completion; failures are never reused. Every caller
+    gets its own copy of the result, so one caller changing it does not affect the others.
+    """
+
+    def __init__(self, reuse_seconds: float = 0, max_entries: int = 256):
+        self.reuse_seconds = reuse_seconds
+        self.max_entries = max_entries
+        self.calls: dict[str, _Call] = {}
+        self.recent: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _recent(self, key: str) -> _Call | None:
+        entry = self.recent.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self.recent[key]
+            return None
+        call = _Call()
+        call.result = result
+        call.done.set()
+        return call
+
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Returns `fn()`'s result for `key` and whether it was shared with another caller."""
+        with self.lock:
+            call = self._recent(key) or self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            result = fn()
+            # waiters and later callers copy this snapshot, not the leader's object
+            call.result = copy.deepcopy(result)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                if call.error is None and self.reuse_seconds > 0:
+                    self.recent[key] = (time.monotonic() + self.reuse_seconds, call.result)
+                    self.recent.move_to_end(key)
+                    while len(self.recent) > self.max_entries:
+                        self.recent.popitem(last=False)
+            call.done.set()
+        return result, False
@@ -0,0 +1,234 @@
+import bisect
+import gzip
+import json
+import logging
+
+from summaries import Chapter, split_chapters, text_hash
+
+logger = logging.getLogger(__name__)
+
+# Content-Encoding values of story objects that the read paths know how to decode
+DECODERS = {
+    "gzip": gzip.decompress,
+}
+
+STORY_INDEX_VERSION = 1
+
+
+class StaleStoryIndexError(Exception):
+    """The story object changed since its index was written."""
+
+
+def encode_story(
+    text: str, compression: str | None = "gzip", level: int = 6, block_chars: int = 65536
+) -> tuple[bytes, dict, list[int], list[int]]:
+    """Returns the object body for a story, the extra `put_object` arguments for it and the
+    character and byte offsets of its blocks.
+
+    Each block of `block_chars` characters is encoded on its own (a gzip member when
+    compressed), so any run of blocks can be fetched with a byte-range read and decoded.
+    Concatenated gzip members are still one valid gzip stream.
+    """
+    if compression not in (None, "", "none", "gzip"):
+        raise ValueError(f"Unsupported story compression: {compression}")
+
+    parts, char_offsets, byte_offsets = [], [0], [0]
+    for start in range(0, len(text), block_chars):
+        block = text[start : start + block_chars].encode("utf-8")
+        if compression == "gzip":
+            # mtime=0 keeps the bytes (and the ETag) stable for the same text
+            block = gzip.compress(block, compresslevel=level, mtime=0)
+        parts.append(block)
+        char_offsets.append(min(start + block_chars, len(text)))
+        byte_offsets.append(byte_offsets[-1] + len(block))
+
+    encoding_args = {"ContentEncoding": "gzip"} if compression == "gzip" else {}
+    return b"".join(parts), encoding_args, char_offsets, byte_offsets
+
+
+def plain_block_offsets(text: str, block_chars: int = 65536) -> tuple[list[int], list[int]]:
+    """Character and byte offsets of `block_chars` blocks of an uncompressed UTF-8 story."""
+    char_offsets, byte_offsets = [0], [0]
+    for start in range(0, len(text), block_chars):
+        block = text[start : start + block_chars]
+        char_offsets.append(start + len(block))
+        byte_offsets.append(byte_offsets[-1] + len(block.encode("utf-8")))
+    return char_offsets, byte_offsets
+
+
+def decode_story(response: dict) -> str:
+    """Text of a `get_object` response, compressed or not (objects written before
+    compression have no Content-Encoding)."""
+    return _decode(response["Body"].read(), response.get("ContentEncoding"))
+
+
+def _decode(data: bytes, encoding: str | None) -> str:
+    if encoding and encoding != "identity":
+        if encoding not in DECODERS:
+            raise ValueError(f"Unsupported story Content-Encoding: {encoding}")
+        data = DECODERS[encoding](data)
+    return data.decode("utf-8")
+
+
+def build_story_index(
+    text: str, etag: str, encoding: str | None, char_offsets: list[int], byte_offsets: list[int]
+) -> dict:
+    """Chapter and block offsets of a stored story, for ranged reads."""
+    return {
+        "version": STORY_INDEX_VERSION,
+        "etag": etag,
+        "encoding": encoding,
+        "length": len(text),
+        "text_hash": text_hash(text),
+        "block_char_offsets": char_offsets,
+        "block_byte_offsets": byte_offsets,
+        "chapters": [
+            {"title": c.title, "start": c.start, "end": c.end, "text_hash": c.text_hash}
+            for c in split_chapters(text)
+        ],
+    }
+
+
+def index_chapters(index: dict) -> list[Chapter]:
+    """The chapters of a story index, without their text."""
+    return [
+        Chapter(
+            title=c["title"], text=None, start=c["start"], end=c["end"], text_hash=c["text_hash"]
+        )
+        for c in index["chapters"]
+    ]
+
+
+class StoryStore:
+    """Story objects plus a JSON index per story (`{index_prefix}{key}.json`, same bucket)
+    with the chapter offsets and the byte offsets of the independently encoded blocks.
+
+    Stories uploaded before the index existed have none until `index_existing` builds it.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        index_prefix: str = "story_indexes/",
+        compression: str | None = "gzip",
+        compression_level: int = 6,
+        block_chars: int = 65536,
+    ):
+        self.s3_client = s3_client
+        self.index_prefix = index_prefix
+        self.compression = compression
+        self.compression_level = compression_level
+        self.block_chars = block_chars
+
+    def _index_key(self, key: str) -> str:
+        return f"{self.index_prefix}{key}.json"
+
+    def write(self, bucket: str, key: str, text: str, metadata: dict) -> dict:
+        """Writes the story, then its index; returns the index."""
+        body, encoding_args, char_offsets, byte_offsets = encode_story(
+            text, self.compression, self.compression_level, self.block_chars
+        )
+        response = self.s3_client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=body,
+            ContentType="text/plain",
+            Metadata=metadata,
+            **encoding_args,
+        )
+        index = build_story_index(
+            text,
+            response.get("ETag"),
+            encoding_args.get("ContentEncoding"),
+            char_offsets,
+            byte_offsets,
+        )
+        self._put_index(bucket, key, index)
+        return index
+
+    def _put_index(self, bucket: str, key: str, index: dict) -> None:
+        self.s3_client.put_object(
+            Bucket=bucket,
+            Key=self._index_key(key),
+            Body=json.dumps(index),
+            ContentType="application/json",
+        )
+
+    def index_existing(self, bucket: str, key: str) -> tuple[dict, str]:
+        """Reads a story that has no index (or a stale one), writes its index and returns
+        the index and the text.
+
+        Uncompressed objects are indexed in blocks of `block_chars`, so later reads can use
+        byte ranges; a compressed object is a single gzip stream and one block. Failing to
+        write the index is logged; the next read then indexes the story again.
+        """
+        response = self.s3_client.get_object(Bucket=bucket, Key=key)
+        data = response["Body"].read()
+        encoding = response.get("ContentEncoding")
+        if encoding == "identity":
+            encoding = None
+        text = _decode(data, encoding)
+        if encoding:
+            char_offsets, byte_offsets = [0, len(text)], [0, len(data)]
+        else:
+            char_offsets, byte_offsets = plain_block_offsets(text, self.block_chars)
+        index = build_story_index(text, response.get("ETag"), encoding, char_offsets, byte_offsets)
+        try:
+            self._put_index(bucket, key, index)
+        except Exception as e:
+            logger.warning(f"Could not write the index of story {key}: {e}")
+        return index, text
+
+    def load_index(self, bucket: str, key: str) -> dict | None:
+        try:
+            response = self.s3_client.get_object(Bucket=bucket, Key=self._index_key(key))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        index = json.loads(response["Body"].read())
+        return index if index.get("version") == STORY_INDEX_VERSION else None
+
+    def read_all(self, bucket: str, key: str) -> str:
+        return decode_story(self.s3_client.get_object(Bucket=bucket, Key=key))
+
+    def read_range(self, bucket: str, key: str, index: dict, start: int, end: int) -> str:
+        """Characters [start, end) of the story, fetching only the blocks that hold them.
+
+        Raises StaleStoryIndexError if the object was replaced after the index was written.
+        """
+        start, end = max(0, start), min(end, index["length"])
+        if start >= end:
+            return ""
+        char_offsets, byte_offsets = index["block_char_offsets"], index["block_byte_offsets"]
+        first = bisect.bisect_right(char_offsets, start) - 1
+        last = bisect.bisect_left(char_offsets, end) - 1
+
+        response = self.s3_client.get_object(
+            Bucket=bucket,
+            Key=key,
+            Range=f"bytes={byte_offsets[first]}-{byte_offsets[last + 1] - 1}",
+        )
+        if response.get("ETag") != index["etag"]:
+            raise StaleStoryIndexError(f"Story {key} changed since its index was written")
+        text = _decode(response["Body"].read(), index["encoding"])
+        offset = char_offsets[first]
+        return text[start - offset : end - offset]
+
+    def read_chapters(
+        self, bucket: str, key: str, index: dict, chapters: list[Chapter]
+    ) -> list[str]:
+        """Texts of the given chapters, with one ranged request per run of adjacent chapters."""
+        texts = {}
+        runs: list[list[Chapter]] = []
+        for chapter in sorted(chapters, key=lambda c: c.start):
+            if runs and chapter.start <= runs[-1][-1].end:
+                runs[-1].append(chapter)
+            else:
+                runs.append([chapter])
+        for run in runs:
+            start, end = run[0].start, max(c.end for c in run)
+            text = self.read_range(bucket, key, index, start, end)
+            for chapter in run:
+                texts[chapter.start, chapter.end] = text[
+                    chapter.start - start : chapter.end - start
+                ]
+        return [texts[c.start, c.end] for c in chapters]
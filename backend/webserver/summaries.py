@@ -0,0 +1,407 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Rough chars-per-token ratio used for the context budget
+CHARS_PER_TOKEN = 4
+
+# Chunks per synthetic section when a manuscript has no chapter headings
+SECTION_CHUNKS = 8
+
+CHUNK_SIZE = 2048
+
+# "Chapter ...", "Part IV", "Book 2", "Prologue", "Epilogue: ..." on a line of their own
+CHAPTER_HEADING = re.compile(
+    r"^[ \t]*(?:chapter\b|(?:part|book|act)[ \t]+(?:\d+|[ivxlcdm]+)\b|(?:prologue|epilogue|interlude)"
+    r"(?=[ \t]*(?::|$)))[^\n]{0,80}$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Bump when the prompts change so stale summaries are not reused
+SUMMARY_PROMPT_VERSION = "1"
+
+CHUNK_SUMMARY_PROMPT = """Summarize the following passage of a novel in at most {max_words} words.
+Keep the names of characters, places and objects, and every plot development, decision and
+change in a relationship. Write in the present tense. Return only the summary.
+
+Passage:
+{text}"""
+
+CHAPTER_SUMMARY_PROMPT = """Below are summaries of consecutive passages of one chapter of a novel.
+Combine them into a single summary of the chapter in at most {max_words} words. Keep the names
+of characters, places and objects and the plot developments that matter for later chapters.
+Return only the summary.
+
+Passage summaries:
+{text}"""
+
+BOOK_SUMMARY_PROMPT = """Below are summaries of consecutive chapters of a novel.
+Write a summary of the story so far in at most {max_words} words, covering the main characters,
+their goals and relationships, and the major events in order. Return only the summary.
+
+Chapter summaries:
+{text}"""
+
+LEVEL_PROMPTS = {
+    "chunk": CHUNK_SUMMARY_PROMPT,
+    "chapter": CHAPTER_SUMMARY_PROMPT,
+    "book": BOOK_SUMMARY_PROMPT,
+}
+
+
+def _hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Chapter:
+    title: str
+    # None for a chapter listed in a story index whose text has not been loaded yet
+    text: str | None
+    chunks: list[str] = field(default_factory=list)
+    # character offsets in the manuscript
+    start: int = 0
+    end: int = 0
+    text_hash: str = ""
+
+
+def chunk_splitter(chunk_size: int = CHUNK_SIZE) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=0,
+        length_function=len,
+        is_separator_regex=False,
+        strip_whitespace=False,
+    )
+
+
+def split_chapters(story_content: str, chunk_size: int = CHUNK_SIZE) -> list[Chapter]:
+    """Splits a manuscript into chapters (by heading) and each chapter into chunks.
+
+    Chunks do not overlap and keep their whitespace, so they concatenate back to the
+    chapter text, and chunk boundaries only depend on the chapter's own text.
+    Manuscripts without headings are grouped into sections of `SECTION_CHUNKS` chunks.
+    """
+    splitter = chunk_splitter(chunk_size)
+
+    starts = [match.start() for match in CHAPTER_HEADING.finditer(story_content)]
+    if not starts or starts[0] > 0:
+        starts.insert(0, 0)
+    bounds = zip(starts, starts[1:] + [len(story_content)], strict=True)
+
+    chapters = []
+    for start, end in bounds:
+        text = story_content[start:end]
+        if not text.strip():
+            continue
+        title = text.strip().splitlines()[0][:80]
+        chapters.append(
+            Chapter(
+                title=title,
+                text=text,
+                chunks=splitter.split_text(text),
+                start=start,
+                end=end,
+                text_hash=text_hash(text),
+            )
+        )
+
+    if len(chapters) == 1 and len(chapters[0].chunks) > SECTION_CHUNKS:
+        chunks, start = chapters[0].chunks, chapters[0].start
+        chapters = []
+        for i in range(0, len(chunks), SECTION_CHUNKS):
+            text = "".join(chunks[i : i + SECTION_CHUNKS])
+            chapters.append(
+                Chapter(
+                    title=f"Section {i // SECTION_CHUNKS + 1}",
+                    text=text,
+                    chunks=chunks[i : i + SECTION_CHUNKS],
+                    start=start,
+                    end=start + len(text),
+                    text_hash=text_hash(text),
+                )
+            )
+            start += len(text)
+    return chapters
+
+
+class SummaryStore:
+    """Summaries keyed by content hash: an in-memory LRU in front of S3 JSON objects.
+
+    S3 persistence is optional (no bucket = memory only); S3 errors are logged and the
+    summary is simply recomputed.
+    """
+
+    def __init__(
+        self,
+        s3_client=None,
+        bucket: str | None = None,
+        prefix: str = "summaries/",
+        max_memory_entries: int = 4096,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_memory_entries = max_memory_entries
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _remember(self, key: str, summary: str) -> None:
+        with self.lock:
+            self.entries[key] = summary
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_memory_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if not (self.s3_client and self.bucket):
+            return None
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}.json")
+            summary = json.loads(response["Body"].read())["summary"]
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read summary {key} from S3: {e}")
+            return None
+        self._remember(key, summary)
+        return summary
+
+    def put(self, key: str, summary: str, level: str) -> None:
+        self._remember(key, summary)
+        if not (self.s3_client and self.bucket):
+            return
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=f"{self.prefix}{key}.json",
+                Body=json.dumps({"level": level, "summary": summary}),
+                ContentType="application/json",
+            )
+        except Exception as e:
+            logger.warning(f"Could not write summary {key} to S3: {e}")
+
+
+class StoryContextBuilder:
+    """Builds the completion context of a manuscript within a fixed token budget.
+
+    The most recent text is kept verbatim (up to `recent_text_tokens`). Before it come
+    summaries, newest first while they fit: the earlier chunks of the current chapter,
+    a summary of the whole book before the current chapter and the summaries of the
+    earlier chapters. Chunk, chapter and book summaries are cached by the hash of their
+    input, so only summaries whose text changed are recomputed.
+
+    Chapters can also come from a story index without their text (`build_from_chapters`);
+    the text is then loaded only for the current chapter and for earlier chapters whose
+    summary is not cached.
+    """
+
+    def __init__(
+        self,
+        llm,
+        store: SummaryStore,
+        max_tokens: int = 4000,
+        recent_text_tokens: int = 1500,
+        summary_max_words: dict | None = None,
+        max_workers: int = 8,
+    ):
+        self.llm = llm
+        self.store = store
+        self.max_tokens = max_tokens
+        self.recent_text_tokens = recent_text_tokens
+        self.summary_max_words = {"chunk": 120, "chapter": 250, "book": 400} | (
+            summary_max_words or {}
+        )
+        self.max_workers = max_workers
+        self.flights = SingleFlight()
+
+    def _summarize(self, level: str, key: str, text: str) -> tuple[str, bool]:
+        """Returns the summary and whether it had to be computed.
+
+        Concurrent requests for the same summary share one LLM call, including a call left
+        running by a request that has already given up on it.
+        """
+        summary = self.store.get(key)
+        if summary is not None:
+            return summary, False
+
+        def compute() -> tuple[str, bool]:
+            summary = self.store.get(key)
+            if summary is not None:
+                return summary, False
+            chain = (
+                PromptTemplate.from_template(LEVEL_PROMPTS[level]) | self.llm | StrOutputParser()
+            )
+            summary = chain.invoke(
+                {"text": text, "max_words": self.summary_max_words[level]}
+            ).strip()
+            self.store.put(key, summary, level)
+            return summary, True
+
+        (summary, computed), shared = self.flights.do(key, compute)
+        return summary, computed and not shared
+
+    def _summarize_all(self, level: str, items: list[tuple[str, str]], stats: dict) -> list[str]:
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda item: self._summarize(level, *item), items))
+        computed = sum(1 for _, was_computed in results if was_computed)
+        stats["computed"] += computed
+        stats["cached"] += len(results) - computed
+        return [summary for summary, _ in results]
+
+    @staticmethod
+    def _chunk_key(chunk: str) -> str:
+        return _hash("chunk", SUMMARY_PROMPT_VERSION, chunk)
+
+    @staticmethod
+    def _chapter_key(chapter: Chapter) -> str:
+        return _hash("chapter", SUMMARY_PROMPT_VERSION, chapter.text_hash)
+
+    @staticmethod
+    def _load_texts(chapters: list[Chapter], load_texts, stats: dict) -> None:
+        unloaded = [c for c in chapters if c.text is None]
+        if not unloaded:
+            return
+        splitter = chunk_splitter()
+        for chapter, text in zip(unloaded, load_texts(unloaded), strict=True):
+            chapter.text = text
+            chapter.chunks = splitter.split_text(text)
+        stats["chapters_loaded"] = stats.get("chapters_loaded", 0) + len(unloaded)
+
+    def _chapter_summaries(
+        self, chapters: list[Chapter], stats: dict, load_texts=None
+    ) -> list[str]:
+        # chunk summaries are only needed for chapters whose own summary is not cached
+        chapter_keys = [self._chapter_key(c) for c in chapters]
+        cached = [self.store.get(key) for key in chapter_keys]
+        missing = [c for c, summary in zip(chapters, cached, strict=True) if summary is None]
+        stats["cached"] += len(chapters) - len(missing)
+        self._load_texts(missing, load_texts, stats)
+
+        chunks = [chunk for chapter in missing for chunk in chapter.chunks]
+        chunk_summaries = iter(
+            self._summarize_all("chunk", [(self._chunk_key(c), c) for c in chunks], stats)
+        )
+
+        # kept here rather than read back from the store, which may have evicted them
+        summaries = dict(zip(chapter_keys, cached, strict=True))
+        to_combine = []
+        for chapter, key, summary in zip(chapters, chapter_keys, cached, strict=True):
+            if summary is not None:
+                continue
+            parts = [next(chunk_summaries) for _ in chapter.chunks]
+            if len(parts) == 1:
+                summaries[key] = parts[0]
+                self.store.put(key, parts[0], "chapter")
+            else:
+                to_combine.append((key, "\n\n".join(parts)))
+        combined = self._summarize_all("chapter", to_combine, stats)
+        summaries.update(zip([key for key, _ in to_combine], combined, strict=True))
+
+        return [summaries[key] for key in chapter_keys]
+
+    def build(self, story_content: str) -> tuple[str, dict]:
+        """Returns the context text and stats (summaries computed/cached, token estimate)."""
+        return self.build_from_chapters(split_chapters(story_content))
+
+    def build_from_chapters(self, chapters: list[Chapter], load_texts=None) -> tuple[str, dict]:
+        """Like `build`, for chapters that may lack their text.
+
+        `load_texts(chapters)` returns the texts of the given chapters, in order.
+        """
+        stats = {"computed": 0, "cached": 0}
+        if not chapters:
+            return "", stats | {"chapters": 0, "tokens": 0}
+
+        current, earlier = chapters[-1], chapters[:-1]
+        self._load_texts([current], load_texts, stats)
+        budget = self.max_tokens * CHARS_PER_TOKEN
+
+        # 1. most recent text, verbatim
+        recent_budget = min(self.recent_text_tokens * CHARS_PER_TOKEN, budget)
+        tail_chunks = []
+        for chunk in reversed(current.chunks):
+            if tail_chunks and sum(map(len, tail_chunks)) + len(chunk) > recent_budget:
+                break
+            tail_chunks.insert(0, chunk)
+        recent_text = "".join(tail_chunks)[-budget:]
+        budget -= len(recent_text)
+
+        # 2. earlier chunks of the current chapter, newest first
+        head_chunks = current.chunks[: len(current.chunks) - len(tail_chunks)]
+        head_summaries = self._summarize_all(
+            "chunk", [(self._chunk_key(c), c) for c in head_chunks], stats
+        )
+        current_parts = []
+        for summary in reversed(head_summaries):
+            if len(summary) > budget:
+                break
+            current_parts.insert(0, summary)
+            budget -= len(summary)
+
+        # 3. the book so far, then the earlier chapters newest first
+        book_summary = ""
+        chapter_parts = []
+        if earlier and budget > 0:
+            chapter_summaries = self._chapter_summaries(earlier, stats, load_texts)
+            if sum(map(len, chapter_summaries)) > budget and len(earlier) > 1:
+                book_key = _hash("book", SUMMARY_PROMPT_VERSION, *map(self._chapter_key, earlier))
+                book_text = "\n\n".join(
+                    f"{c.title}\n{s}" for c, s in zip(earlier, chapter_summaries, strict=True)
+                )
+                (book_summary,) = self._summarize_all("book", [(book_key, book_text)], stats)
+                if len(book_summary) > budget:
+                    book_summary = ""
+                budget -= len(book_summary)
+            for chapter, summary in reversed(list(zip(earlier, chapter_summaries, strict=True))):
+                part = f"{chapter.title}\n{summary}"
+                if len(part) > budget:
+                    break
+                chapter_parts.insert(0, part)
+                budget -= len(part)
+
+        sections = []
+        if book_summary:
+            sections.append(f"Summary of the story so far:\n{book_summary}")
+        if chapter_parts:
+            sections.append("Summaries of the previous chapters:\n" + "\n\n".join(chapter_parts))
+        if current_parts:
+            sections.append(
+                f"Summary of the current chapter ({current.title}) so far:\n"
+                + "\n".join(current_parts)
+            )
+        sections.append(f"Most recent text:\n{recent_text}")
+        context = "\n\n".join(sections)
+
+        return context, stats | {"chapters": len(chapters), "tokens": estimate_tokens(context)}
@@ -0,0 +1,131 @@
+import time
+from contextlib import contextmanager
+
+from opentelemetry import metrics, propagate, trace
+from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.instrumentation.botocore import BotocoreInstrumentor
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.trace import Status, StatusCode
+
+tracer = trace.get_tracer("novelwriter.webserver")
+meter = metrics.get_meter("novelwriter.webserver")
+
+stage_duration = meter.create_histogram(
+    "novelwriter.generate.stage.duration",
+    unit="s",
+    description="Duration of each stage of the story generation pipeline",
+)
+generate_duration = meter.create_histogram(
+    "novelwriter.generate.duration",
+    unit="s",
+    description="End-to-end duration of /api/generate",
+)
+llm_prompt_size = meter.create_histogram(
+    "novelwriter.llm.prompt.size",
+    unit="By",
+    description="Size of the rendered prompt sent to the LLM",
+)
+llm_response_size = meter.create_histogram(
+    "novelwriter.llm.response.size",
+    unit="By",
+    description="Size of the LLM response",
+)
+requests_in_flight = meter.create_up_down_counter(
+    "novelwriter.requests.in_flight",
+    unit="{request}",
+    description="Requests currently being processed by LLM-heavy endpoints",
+)
+admission_queue_depth = meter.create_up_down_counter(
+    "novelwriter.admission.queue.depth",
+    unit="{request}",
+    description="Requests waiting for a slot on LLM-heavy endpoints",
+)
+admission_wait = meter.create_histogram(
+    "novelwriter.admission.wait",
+    unit="s",
+    description="Time queued requests waited for a slot",
+)
+admission_rejections = meter.create_counter(
+    "novelwriter.admission.rejections",
+    unit="{request}",
+    description="Requests rejected by admission control, by reason",
+)
+
+
+def setup_otel() -> None:
+    """Exports traces and metrics to the OTLP collector.
+
+    The endpoint is read from OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318).
+    """
+    resource = Resource.create(
+        {
+            "service.name": "novelwriter-webserver",
+            "service.namespace": "novelwriter",
+        }
+    )
+
+    tracer_provider = TracerProvider(resource=resource)
+    tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(tracer_provider)
+
+    meter_provider = MeterProvider(
+        resource=resource,
+        metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter())],
+    )
+    metrics.set_meter_provider(meter_provider)
+
+    BotocoreInstrumentor().instrument()
+
+
+def shutdown_otel() -> None:
+    for provider in (trace.get_tracer_provider(), metrics.get_meter_provider()):
+        if hasattr(provider, "shutdown"):
+            provider.shutdown()
+
+
+@contextmanager
+def traced_stage(stage: str, **attributes):
+    """Runs a generate pipeline stage inside a span and records its duration."""
+    start = time.perf_counter()
+    outcome = "ok"
+    with tracer.start_as_current_span(f"generate.{stage}") as span:
+        span.set_attribute("novelwriter.stage", stage)
+        for key, value in attributes.items():
+            span.set_attribute(key, value)
+        try:
+            yield span
+        except Exception as e:
+            outcome = "error"
+            span.set_status(Status(StatusCode.ERROR, str(e)))
+            raise
+        finally:
+            stage_duration.record(time.perf_counter() - start, {"stage": stage, "outcome": outcome})
+
+
+def record_llm_sizes(span, stage: str, prompt: str, response: str | None) -> None:
+    span.set_attribute("gen_ai.prompt.size", len(prompt))
+    llm_prompt_size.record(len(prompt), {"stage": stage})
+    if response is not None:
+        span.set_attribute("gen_ai.response.size", len(response))
+        llm_response_size.record(len(response), {"stage": stage})
+
+
+@contextmanager
+def track_in_flight(endpoint: str):
+    requests_in_flight.add(1, {"endpoint": endpoint})
+    try:
+        yield
+    finally:
+        requests_in_flight.add(-1, {"endpoint": endpoint})
+
+
+def inject_trace_context() -> dict:
+    """Serializes the current trace context (W3C traceparent) for a Lambda payload."""
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejectedError, client_address
+
+
+def controller(**limits) -> AdmissionController:
+    return AdmissionController("generate", **({"retry_after_seconds": 7} | limits))
+
+
+async def hold(controller: AdmissionController, user: str, release: asyncio.Event, log: list):
+    async with controller.admit(user):
+        log.append(user)
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_runs_at_most_max_concurrent_and_queues_the_rest():
+    async def scenario():
+        admission, release, log = controller(max_concurrent=2), asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(admission, f"user-{i}", release, log)) for i in range(3)]
+        await settle()
+        assert (len(log), admission.active, admission.queued) == (2, 2, 1)
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert len(log) == 3
+        assert (admission.active, admission.queued, admission.rejected) == (0, 0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_freed_slots_go_to_users_in_turn():
+    async def scenario():
+        admission, log = controller(max_concurrent=1, max_queue_per_user=3), []
+        await admission.acquire("running")
+        releases = {}
+        tasks = []
+        for user in ["busy", "busy", "busy", "other"]:
+            release = asyncio.Event()
+            releases.setdefault(user, []).append(release)
+            tasks.append(asyncio.create_task(hold(admission, user, release, log)))
+            await settle()
+
+        admission.release()
+        for release in [*releases["busy"], *releases["other"]]:
+            await settle()
+            release.set()
+        await asyncio.gather(*tasks)
+        # "other" waited behind three "busy" requests but got the second slot
+        assert log == ["busy", "other", "busy", "busy"]
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected_with_503():
+    async def scenario():
+        admission = controller(max_concurrent=1, max_queue=1)
+        await admission.acquire("a")
+        waiting = asyncio.create_task(admission.acquire("b"))
+        await settle()
+
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            await admission.acquire("c")
+        assert (rejected.value.status_code, rejected.value.retry_after) == (503, 7)
+        assert admission.rejected == 1
+        waiting.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_one_users_share_of_the_queue_is_rejected_with_429():
+    async def scenario():
+        admission = controller(max_concurrent=1, max_queue=4, max_queue_per_user=1)
+        await admission.acquire("a")
+        waiting = [asyncio.create_task(admission.acquire(user)) for user in ("b", "c")]
+        await settle()
+
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            await admission.acquire("b")
+        assert rejected.value.status_code == 429
+        for task in waiting:
+            task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_is_rejected_and_frees_the_queue():
+    async def scenario():
+        admission = controller(max_concurrent=1, queue_timeout_seconds=0.05)
+        await admission.acquire("a")
+
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            await admission.acquire("b")
+        assert rejected.value.status_code == 503
+        assert (admission.active, admission.queued, admission.waiting) == (1, 0, {})
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        admission = controller(max_concurrent=1)
+        await admission.acquire("a")
+        waiting = asyncio.create_task(admission.acquire("b"))
+        await settle()
+        waiting.cancel()
+        await settle()
+
+        assert (admission.queued, admission.waiting) == (0, {})
+        admission.release()
+        assert admission.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_admit_if_free_never_queues():
+    async def scenario():
+        admission = controller(max_concurrent=1)
+        with admission.admit_if_free() as admitted:
+            assert admitted and admission.active == 1
+            with admission.admit_if_free() as admitted_again:
+                assert not admitted_again
+        assert admission.active == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize(
+    ("peer", "forwarded_for", "trusted_proxies", "expected"),
+    [
+        ("10.0.1.5", None, 1, "10.0.1.5"),
+        ("10.0.1.5", "203.0.113.9", 0, "10.0.1.5"),
+        ("10.0.1.5", "203.0.113.9", 1, "203.0.113.9"),
+        # a client-sent X-Forwarded-For only adds entries on the left
+        ("10.0.1.5", "1.2.3.4, 203.0.113.9", 1, "203.0.113.9"),
+        ("10.0.1.5", "1.2.3.4, 203.0.113.9, 10.0.2.7", 2, "203.0.113.9"),
+        (None, None, 0, "unknown"),
+    ],
+)
+def test_client_address(peer, forwarded_for, trusted_proxies, expected):
+    assert client_address(peer, forwarded_for, trusted_proxies) == expected
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+
+import deadlines
+from deadlines import Deadline, DeadlineExecutor, LatencyTracker, StageTimeoutError
+
+SHARES = {"vector_search": 0.05, "forecaster": 0.3, "story_context": 0.25, "completion": 0.4}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(deadlines.time, "monotonic", clock)
+    return clock
+
+
+def test_optional_stage_is_capped_at_its_share(clock):
+    deadline = Deadline(120, SHARES)
+    assert deadline.stage_budget("forecaster", ("completion",)) == pytest.approx(36)
+
+
+def test_optional_stage_leaves_the_completion_share(clock):
+    deadline = Deadline(120, SHARES)
+    clock.now += 60
+    assert deadline.stage_budget("story_context", ("completion",)) == pytest.approx(12)
+
+
+def test_completion_gets_the_time_the_optional_stages_left(clock):
+    deadline = Deadline(120, SHARES)
+    clock.now += 10  # vector search, forecaster and story context finished early
+
+    assert deadline.stage_budget("completion") == pytest.approx(48)
+    assert deadline.stage_budget("completion", capped=False) == pytest.approx(110)
+
+
+def test_completion_past_its_share_finishes_within_the_budget():
+    # 120s budget scaled down to 1.2s: the completion's share is 0.48s
+    deadline = Deadline(1.2, SHARES)
+    executor = DeadlineExecutor(max_workers=2)
+
+    def completion():
+        time.sleep(0.7)
+        return "continuation"
+
+    try:
+        with pytest.raises(StageTimeoutError):
+            executor.call(completion, deadline.stage_budget("completion"))
+        deadline = Deadline(1.2, SHARES)
+        result, hedged = executor.call(
+            completion, deadline.stage_budget("completion", capped=False)
+        )
+        assert (result, hedged) == ("continuation", False)
+    finally:
+        executor.shutdown()
+
+
+@pytest.fixture
+def executor():
+    executor = DeadlineExecutor(max_workers=4, max_abandoned=1)
+    yield executor
+    executor.shutdown()
+
+
+def test_tracker_gets_the_first_calls_latency_when_the_hedge_wins(executor):
+    tracker = LatencyTracker(min_samples=1)
+    calls = []
+
+    def slow_then_fast():
+        calls.append(1)
+        time.sleep(0.4 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    result, hedged = executor.call(slow_then_fast, 2, hedge_after=0.05, tracker=tracker)
+    assert (result, hedged) == (2, True)
+    time.sleep(0.5)
+
+    (sample,) = tracker.samples
+    assert sample >= 0.4
+
+
+def test_tracker_gets_the_timeout_for_a_timed_out_call(executor):
+    tracker = LatencyTracker(min_samples=1)
+
+    with pytest.raises(StageTimeoutError):
+        executor.call(lambda: time.sleep(0.4), 0.1, tracker=tracker)
+    time.sleep(0.5)
+
+    assert list(tracker.samples) == [0.1]
+
+
+def test_failed_calls_are_not_tracked(executor):
+    tracker = LatencyTracker(min_samples=1)
+
+    with pytest.raises(ZeroDivisionError):
+        executor.call(lambda: 1 / 0, 1, tracker=tracker)
+
+    assert not tracker.samples
+
+
+def test_calls_fail_fast_while_too_many_abandoned_calls_hold_workers(executor):
+    released = threading.Event()
+    for _ in range(2):
+        with pytest.raises(StageTimeoutError):
+            executor.call(released.wait, 0.05)
+    assert executor.abandoned == 2
+
+    start = time.perf_counter()
+    with pytest.raises(StageTimeoutError, match="abandoned"):
+        executor.call(lambda: "ok", 1)
+    assert time.perf_counter() - start < 0.05
+
+    released.set()
+    time.sleep(0.05)
+    assert executor.abandoned == 0
+    assert executor.call(lambda: "ok", 1) == ("ok", False)
+
+
+def test_no_hedge_without_a_free_worker():
+    executor = DeadlineExecutor(max_workers=1)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    try:
+        assert executor.call(slow, 1, hedge_after=0.05) == ("done", False)
+        assert len(calls) == 1
+    finally:
+        executor.shutdown()
@@ -0,0 +1,84 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_concurrently(flights: SingleFlight, fn, callers: int = 4) -> list:
+    """Calls `flights.do("key", fn)` from `callers` threads; returns results or exceptions."""
+    started = threading.Barrier(callers)
+
+    def call():
+        started.wait()
+        try:
+            return flights.do("key", fn)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        return list(executor.map(lambda _: call(), range(callers)))
+
+
+def slow(result, calls: list):
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return fn
+
+
+def test_concurrent_callers_share_one_call():
+    flights, calls = SingleFlight(), []
+    results = run_concurrently(flights, slow({"text": "done"}, calls))
+
+    assert len(calls) == 1
+    assert [value for value, _ in results] == [{"text": "done"}] * 4
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert flights.calls == {}
+
+
+def test_failure_reaches_every_waiter_and_is_not_reused():
+    flights, calls = SingleFlight(reuse_seconds=60), []
+    error = RuntimeError("model down")
+    results = run_concurrently(flights, slow(error, calls))
+
+    assert len(calls) == 1
+    assert all(result is error for result in results)
+    assert flights.calls == {}
+    assert flights.recent == {}
+    assert flights.do("key", lambda: "retried") == ("retried", False)
+
+
+def test_key_is_cleared_after_success_without_reuse():
+    flights = SingleFlight()
+    assert flights.do("key", lambda: 1) == (1, False)
+    assert flights.calls == {} and not flights.recent
+    assert flights.do("key", lambda: 2) == (2, False)
+
+
+def test_success_is_reused_within_the_window_only():
+    flights = SingleFlight(reuse_seconds=0.1)
+    flights.do("key", lambda: 1)
+    assert flights.do("key", lambda: 2) == (1, True)
+    time.sleep(0.15)
+    assert flights.do("key", lambda: 3) == (3, False)
+
+
+@pytest.mark.parametrize("reuse_seconds", [0, 60])
+def test_each_caller_gets_its_own_result_object(reuse_seconds):
+    flights, calls = SingleFlight(reuse_seconds=reuse_seconds), []
+    results = run_concurrently(flights, slow({"degraded_stages": []}, calls))
+    values = [value for value, _ in results]
+    values[0]["degraded_stages"].append("forecaster")
+
+    assert all(value == {"degraded_stages": []} for value in values[1:])
+    assert len({id(value) for value in values}) == len(values)
+    if reuse_seconds:
+        reused, shared = flights.do("key", lambda: None)
+        assert shared and reused == {"degraded_stages": []}
@@ -0,0 +1,110 @@
+import gzip
+import hashlib
+import io
+import json
+import random
+
+import pytest
+
+from story_storage import StaleStoryIndexError, StoryStore, index_chapters
+
+BUCKET = "stories"
+KEY = "novel/story.txt"
+
+STORY = "".join(
+    f"Chapter {i}\n" + f"Ssarki crossed the Aass-Nag jungle — día {i}, 日{i}. " * 40 + "\n"
+    for i in range(1, 6)
+)
+
+
+class FakeS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        self.objects[Bucket, Key] = (data, kwargs.get("ContentEncoding"))
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        data, encoding = self.objects[Bucket, Key]
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if Range:
+            start, end = Range.removeprefix("bytes=").split("-")
+            data = data[int(start) : int(end) + 1]
+        self.gets.append((Key, Range))
+        response = {"Body": io.BytesIO(data), "ETag": etag}
+        if encoding:
+            response["ContentEncoding"] = encoding
+        return response
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.mark.parametrize("compression", ["gzip", "none"])
+def test_random_ranges_match_the_text(s3, compression):
+    store = StoryStore(s3, compression=compression, block_chars=97)
+    index = store.write(BUCKET, KEY, STORY, metadata={})
+    rng = random.Random(7)
+
+    for _ in range(200):
+        start = rng.randrange(len(STORY))
+        end = rng.randrange(start, len(STORY) + 1)
+        assert store.read_range(BUCKET, KEY, index, start, end) == STORY[start:end]
+
+
+def test_chapters_are_read_with_one_request_per_run(s3):
+    store = StoryStore(s3, block_chars=97)
+    index = store.write(BUCKET, KEY, STORY, metadata={})
+    chapters = index_chapters(index)
+    assert len(chapters) == 5
+    s3.gets.clear()
+    texts = store.read_chapters(BUCKET, KEY, index, [chapters[3], chapters[0], chapters[1]])
+
+    assert texts == [STORY[c.start : c.end] for c in (chapters[3], chapters[0], chapters[1])]
+    assert len(s3.gets) == 2
+
+
+def test_replaced_object_is_reported_stale(s3):
+    store = StoryStore(s3, block_chars=97)
+    index = store.write(BUCKET, KEY, STORY, metadata={})
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=gzip.compress(b"rewritten"), ContentEncoding="gzip")
+
+    with pytest.raises(StaleStoryIndexError):
+        store.read_range(BUCKET, KEY, index, 0, 10)
+
+
+@pytest.mark.parametrize("encoding", [None, "gzip"])
+def test_old_objects_are_indexed_once(s3, encoding):
+    body = STORY.encode("utf-8")
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=KEY,
+        Body=gzip.compress(body) if encoding else body,
+        ContentEncoding=encoding,
+    )
+    store = StoryStore(s3, block_chars=97)
+    assert store.load_index(BUCKET, KEY) is None
+
+    index, text = store.index_existing(BUCKET, KEY)
+
+    assert text == STORY
+    assert store.load_index(BUCKET, KEY) == json.loads(json.dumps(index))
+    assert store.read_range(BUCKET, KEY, index, 100, 700) == STORY[100:700]
+    if encoding is None:
+        # uncompressed objects get blocks, so a page is a small ranged read
+        s3.gets.clear()
+        store.read_range(BUCKET, KEY, index, 100, 200)
+        ((_, byte_range),) = s3.gets
+        start, end = map(int, byte_range.removeprefix("bytes=").split("-"))
+        assert end - start < 500
@@ -0,0 +1,51 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.runnables import RunnableLambda
+
+from summaries import StoryContextBuilder, SummaryStore, text_hash
+
+STORY = "".join(
+    f"Chapter {i}\n" + f"Balasar rides north on day {i}. " * 120 + "\n" for i in range(1, 5)
+)
+
+BUDGET = {"max_tokens": 1000, "recent_text_tokens": 100}
+
+
+class SlowLLM:
+    """Counts summary calls per prompt; each call takes `seconds`."""
+
+    def __init__(self, seconds: float = 0.2):
+        self.seconds = seconds
+        self.calls: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt) -> str:
+        text = prompt.to_string()
+        with self.lock:
+            self.calls[text] = self.calls.get(text, 0) + 1
+        time.sleep(self.seconds)
+        return f"summary {text_hash(text)[:8]}"
+
+
+def test_concurrent_builds_share_summary_calls():
+    llm = SlowLLM()
+    builder = StoryContextBuilder(RunnableLambda(llm), SummaryStore(), **BUDGET)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        contexts = list(executor.map(lambda _: builder.build(STORY)[0], range(4)))
+
+    assert len(set(contexts)) == 1
+    assert llm.calls and set(llm.calls.values()) == {1}
+
+
+def test_chapter_summaries_survive_store_eviction():
+    builder = StoryContextBuilder(
+        RunnableLambda(SlowLLM(seconds=0)), SummaryStore(max_memory_entries=1), **BUDGET
+    )
+
+    context, stats = builder.build(STORY)
+
+    assert "Summaries of the previous chapters" in context
+    assert stats["computed"] > 1
@@ -1,6 +1,8 @@
 import logging
 import json
 
+import chromadb
+
 logger = logging.getLogger(__name__)
 
 def load_config():
@@ -14,10 +16,22 @@ def load_config():
         logger.error("Error decoding config.json.")
         raise
 
-def get_template_from_dynamo(novel_name: str, template_type: str) -> dict:
-    config = load_config()
+def create_chroma_client(chroma_config: dict):
+    """Client for the `remote` Chroma server, or with `mode: embedded` a persistent
+    in-process client that keeps its data under `embedded.path`."""
+    if chroma_config.get("mode", "http") == "embedded":
+        return chromadb.PersistentClient(
+            path=chroma_config.get("embedded", {}).get("path", "../chroma_data"),
+            settings=chromadb.Settings(anonymized_telemetry=False),
+        )
+    return chromadb.HttpClient(
+        host=chroma_config.get("remote").get("host"),
+        port=chroma_config.get("remote").get("port"),
+    )
+
+def get_template_from_dynamo(table, novel_name: str, template_type: str) -> dict:
     try:
-        response = config.get("aws").get("dynamodb_table").get_item(
+        response = table.get_item(
             Key={"novel_name": novel_name, "template_type": template_type}
         )
         item = response.get("Item")
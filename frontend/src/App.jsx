@@ -64,7 +64,7 @@ function App() {
       const timestamp = Date.now();
       const storyKey = `temp/story-${timestamp}.txt`;
 
-      await storyAPI.uploadStory(storyText, storyKey, bucket);
+      await storyAPI.uploadStory(storyText, storyKey, bucket, novelName);
 
       // Generate continuation
       const response = await generationAPI.generateStory(bucket, storyKey, novelName);
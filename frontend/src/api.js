@@ -13,8 +13,9 @@ export const storyAPI = {
         api.get('/story', { params: { bucket, object_key: objectKey } }),
 
     // POST /story - Upload story to S3
-    uploadStory: (text, filepath, bucketName) =>
-        api.post('/story', { text, filepath, bucket_name: bucketName }),
+    // novelName lets the backend start a speculative forecast for the upload
+    uploadStory: (text, filepath, bucketName, novelName) =>
+        api.post('/story', { text, filepath, bucket_name: bucketName, novel_name: novelName }),
 };
 
 export const templateAPI = {
@@ -91,6 +91,9 @@ resource "aws_instance" "fastapi-server" {
       --name fastapi-backend \
       --restart unless-stopped \
       -p 7000:7000 \
+      -e OTEL_SERVICE_NAME=novelwriter-webserver \
+      -e OTEL_EXPORTER_OTLP_PROTOCOL=http/protobuf \
+      -e OTEL_EXPORTER_OTLP_ENDPOINT=http://172.17.0.1:4318 \
       066777916969.dkr.ecr.ap-south-1.amazonaws.com/primary:novelwriter-webserver-latest
 
     # Pull the OTel Collector image from ECR
@@ -136,6 +139,12 @@ resource "aws_lambda_function" "entity-miner" {
       OTEL_LOG_LEVEL = "info"
       OTEL_EXPORTER_OTLP_PROTOCOL = "http/protobuf"
       OTEL_EXPORTER_OTLP_ENDPOINT = "http://localhost:4318" # TODO: change to the actual endpoint
+      OTEL_TRACES_SAMPLER = "parentbased_traceidratio"
+      OTEL_TRACES_SAMPLER_ARG = "1.0"
+      MINER_TAIL_SAMPLING = "true"
+      MINER_TAIL_SAMPLING_MIN_DURATION_MS = "30000"
+      MINER_TAIL_SAMPLING_RATIO = "0.1"
+      MINER_TELEMETRY_FLUSH_TIMEOUT_MS = "500"
     }
   }
 } 
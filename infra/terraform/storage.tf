@@ -5,9 +5,12 @@ resource "aws_s3_bucket" "stories" {
 resource "aws_s3_bucket_notification" "stories_notification" {
   bucket = aws_s3_bucket.stories.id
 
+  # only stories: the services' own JSON objects (entity graphs, summaries, story indexes)
+  # live in this bucket too and must not start a mining run
   lambda_function {
     lambda_function_arn = aws_lambda_function.entity-miner.arn
     events              = ["s3:ObjectCreated:Put", "s3:ObjectCreated:Post"]
+    filter_suffix       = ".txt"
   }
 
   depends_on = [aws_lambda_function.entity-miner]